@@ -1,4 +1,5 @@
 sudo mkdir /srv/replik_schedule
 sudo mkdir /srv/replik_schedule/running
 sudo mkdir /srv/replik_schedule/staging
+sudo mkdir /srv/replik_schedule/images
 sudo chmod -R 757 /srv/replik_schedule
\ No newline at end of file
@@ -1,96 +1,269 @@
 import os
-from os.path import join
-from typing import Dict
-from shutil import copyfile, move
-from subprocess import call
+import re
+import json
+import time
+import hashlib
+from fnmatch import fnmatch
+from os.path import join, isfile, relpath, dirname
+from typing import Dict, List
+from tempfile import mkstemp
+from subprocess import call, run, DEVNULL, PIPE
 
 import replik.console as console
 import replik.utils as utils
 import replik.constants as const
+import replik.images as images
 
 
-def execute(directory: str, script: str, info: Dict, outfile_name: str = ""):
-    """"""
-    utils.handle_broken_project(directory)
-    dockerdir = const.get_dockerdir(directory)
-    dockerfile = join(dockerdir, "Dockerfile")
-    dockerfile_bkp = join(dockerdir, "Dockerfile.bkp")
-    hook_pre_useradd = join(dockerdir, "hook_pre_useradd")
-    hook_post_useradd = join(dockerdir, "hook_post_useradd")
+BASE_REPOSITORY = "replik_base"  # images of the base Dockerfiles
+USER_REPOSITORY = "replik_user"  # base images with the user of a uid
+
+
+def get_base_layer(dockerdir: str):
+    """
+    The base Dockerfile of the project on its own. It is shared by all
+    projects with the same base Dockerfile: its tag is the hash of the
+    Dockerfile and, only if it copies files, of the build context.
+    :returns: tag, Dockerfile, build context (None: no files are needed)
+    """
+    with open(join(dockerdir, "Dockerfile")) as D_base:
+        dockerfile = D_base.read()
+    context = None
+    if re.search(r"^\s*(COPY|ADD)\s", dockerfile, re.IGNORECASE | re.MULTILINE):
+        context = dockerdir
+    tag = f"{BASE_REPOSITORY}:{get_content_hash(context, dockerfile)[:16]}"
+    return tag, dockerfile, context
+
+
+def get_user_layer(base_tag: str):
+    """
+    The user (with the uid of the caller) on top of a base image, shared by
+    all projects of that user with the same base Dockerfile.
+    :returns: tag, Dockerfile, build context (None)
+    """
+    uid = os.getuid()
+    lines = [f"FROM {base_tag}\n"]
+    lines.append(f'RUN adduser --disabled-password --gecos "" -u {uid} user\n')
+    lines.append("USER user\n")
+    # add startup bash hook
+    lines.append(
+        'RUN echo "/bin/bash /home/user/docker/bashhook.sh" >> /home/user/.bashrc\n'
+    )
+    dockerfile = "".join(lines)
+    tag = f"{USER_REPOSITORY}_{uid}:{get_content_hash(None, dockerfile)[:16]}"
+    return tag, dockerfile, None
 
-    tag = info["tag"]
+
+def get_project_layer(directory: str, info: Dict, user_tag: str):
+    """
+    The hooks and /home/user/run.sh of the project on top of the user layer.
+    It does not depend on the script: run.sh calls $REPLIK_SCRIPT and writes
+    to $REPLIK_LOG, which are set at `docker run` (see {run.get_run_env}),
+    so that all scripts of a project share one image.
+    :returns: tag, Dockerfile, build context
+    """
+    dockerdir = const.get_dockerdir(directory)
     name = info["name"]
-    docker_mem = info["docker_shm"]
     is_simple = info["is_simple"]
-    stdout_to_file = info["stdout_to_file"]
 
-    if len(outfile_name) > 0:
-        if not info["stdout_to_file"]:
-            console.fail(
-                f"Output file name is set to '{outfile_name}' but is currently set to output to terminal rather than file!"
-            )
-            exit()
-        # check for forbidden chars
-        if const.check_if_string_contains_forbidden_symbols(outfile_name):
-            console.fail(
-                f"Output file name is set to '{outfile_name}' which contains invalid characters for a file name!"
-            )
-            exit()
-
-    # -- (1) construct Dockerfile
-    move(dockerfile, dockerfile_bkp)
-
-    with open(dockerfile, "w") as D:
-        with open(dockerfile_bkp) as D_base:
-            for line in D_base:
-                D.write(line)
-        D.write("\n")
-        with open(hook_pre_useradd) as hook:
-            for line in hook:
-                D.write(line)
-        D.write("\n")
-
-        # add user
-        uid = os.getuid()
-        D.write(f'RUN adduser --disabled-password --gecos "" -u {uid} user')
-        D.write("\nUSER user\n")
-
-        with open(hook_post_useradd) as hook:
-            for line in hook:
-                D.write(line)
-
-        # add the script call
-        D.write("\n")
-
-        pipe = ""
-        if stdout_to_file:
-            outfile = const.get_stdout_file_in_container(directory, outfile_name)
-            pipe = f" &>{outfile}"
-
-        if is_simple:
-            D.write(
-                'RUN echo "source ~/.bashrc\\n'
-                + f'cd /home/user/{name} && bash {script}{pipe}"'
-                + " >> /home/user/run.sh"
-            )
-        else:
-            D.write(
-                'RUN echo "source ~/.bashrc\\n'
-                + f'cd /home/user/{name}/scripts && python {script}{pipe}"'
-                + f" >> /home/user/run.sh"
-            )
+    lines = [f"FROM {user_tag}\n", "USER root\n"]
+    with open(join(dockerdir, "hook_pre_useradd")) as hook:
+        lines.append(hook.read())
+    lines.append("\nUSER user\n")
+
+    with open(join(dockerdir, "hook_post_useradd")) as hook:
+        lines.append(hook.read())
+
+    # add the script call: the tasks of a job array also pass their
+    # arguments (see {schedule.execute}), the log is appended to so that
+    # a preempted job keeps the output of its earlier runs
+    lines.append("\n")
+    if is_simple:
+        workdir, interpreter = f"/home/user/{name}", "bash"
+    else:
+        workdir, interpreter = f"/home/user/{name}/scripts", "python"
+    run_sh = [
+        "source ~/.bashrc",
+        f"cd {workdir}",
+        'if [ -n "$REPLIK_LOG" ]; then exec &>>"$REPLIK_LOG"; fi',
+        f'{interpreter} $REPLIK_SCRIPT $REPLIK_ARRAY_ARGS "$@"',
+    ]
+    lines.append(
+        "RUN printf '%s\\n' "
+        + " ".join(f"'{line}'" for line in run_sh)
+        + " > /home/user/run.sh\n"
+    )
+    return info["tag"], "".join(lines), dockerdir
+
+
+def get_layers(directory: str, info: Dict):
+    """
+    :returns: [(tag, Dockerfile, build context)] of the base image, the
+        user layer and the project image, each is built FROM the one before
+    """
+    base = get_base_layer(const.get_dockerdir(directory))
+    user = get_user_layer(base[0])
+    return [base, user, get_project_layer(directory, info, user[0])]
+
+
+def get_context_files(dockerdir: str) -> List[str]:
+    """
+    :returns: sorted paths (relative to {dockerdir}) of the files that are
+        sent to the docker daemon, i.e. without the ones in .dockerignore
+    """
+    patterns = []
+    dockerignore = join(dockerdir, ".dockerignore")
+    if isfile(dockerignore):
+        with open(dockerignore) as f:
+            patterns = [line.strip().rstrip("/") for line in f]
+        patterns = [p for p in patterns if len(p) > 0 and not p.startswith("#")]
+        if any(p.startswith("!") for p in patterns):
+            patterns = []  # exceptions are not supported: hash everything
+
+    def is_ignored(path: str) -> bool:
+        parts = path.split("/")
+        prefixes = ["/".join(parts[: i + 1]) for i in range(len(parts))]
+        return any(fnmatch(prefix, p) for p in patterns for prefix in prefixes)
+
+    files = []
+    for root, _, fnames in os.walk(dockerdir):
+        for fname in fnames:
+            path = relpath(join(root, fname), dockerdir)
+            if path not in ["Dockerfile", "Dockerfile.bkp"] and not is_ignored(path):
+                files.append(path)
+    return sorted(files)
 
-        # add startup bash hook
-        D.write("\n")
-        D.write(
-            'RUN echo "/bin/bash /home/user/docker/bashhook.sh" >> /home/user/.bashrc'
-        )
 
-    r = call(f"cd {dockerdir} && docker build --tag='{tag}' .", shell=True)
+def get_content_hash(dockerdir: str, dockerfile: str) -> str:
+    """
+    :param dockerdir: build context, None if the build does not need one
+    :returns: hash of the {dockerfile} and the files of the build context
+    """
+    h = hashlib.sha256()
+    h.update(dockerfile.encode())
+    for path in [] if dockerdir is None else get_context_files(dockerdir):
+        h.update(f"\0{path}\0".encode())
+        with open(join(dockerdir, path), "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
 
-    move(dockerfile_bkp, dockerfile)
-    if r != 0:
-        console.fail("building failed\n")
-        exit(0)
 
-    # --
+def get_build_key(dockerdir: str, dockerfile: str, tag: str) -> str:
+    """
+    :param dockerfile: content of the generated Dockerfile, see {get_layers}
+    :returns: hash over everything that goes into the image {tag}: if it did
+        not change since the last build, the build can be skipped
+    """
+    h = hashlib.sha256()
+    h.update(f"{const.VERSION}\0{tag}\0".encode())
+    h.update(get_content_hash(dockerdir, dockerfile).encode())
+    return h.hexdigest()
+
+
+def load_build_cache(directory: str) -> Dict:
+    """:returns: {tag: {"key": .., "build_time_in_s": ..}}"""
+    fname = const.get_build_cache_file(directory)
+    if not isfile(fname):
+        return {}
+    try:
+        with open(fname, "r") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        return {}
+
+
+def store_build_cache(directory: str, cache: Dict):
+    """atomic, so that builds of the same project can run at the same time"""
+    fname = const.get_build_cache_file(directory)
+    fd, tmp_fname = mkstemp(dir=dirname(fname), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_fname, fname)
+
+
+def image_exists(tag: str) -> bool:
+    r = call(["docker", "image", "inspect", tag], stdout=DEVNULL, stderr=DEVNULL)
+    return r == 0
+
+
+def get_image_size(tag: str) -> int:
+    """:returns: size of the image {tag} in bytes, including its base images"""
+    r = run(
+        ["docker", "image", "inspect", "--format={{.Size}}", tag],
+        stdout=PIPE,
+        stderr=DEVNULL,
+    )
+    return int(r.stdout) if r.returncode == 0 else 0
+
+
+def build_image(dockerdir: str, dockerfile: str, tag: str) -> bool:
+    """
+    The generated {dockerfile} is passed on stdin, {dockerdir} is only read
+    as build context: nothing in the project is changed during the build.
+    :param dockerdir: None if the build does not need a context
+    :returns: True if the image {tag} has been built
+    """
+    if dockerdir is None:
+        cmd = ["docker", "build", f"--tag={tag}", "-"]
+    else:
+        cmd = ["docker", "build", f"--tag={tag}", "--file=-", dockerdir]
+    r = run(cmd, input=dockerfile.encode())
+    return r.returncode == 0
+
+
+def execute(
+    directory: str, info: Dict, verbose: bool = False, fun_build=build_image
+):
+    """
+    Builds the image of the project unless nothing that goes into it changed
+    since the last build (see {get_build_key}) and the image still exists.
+    The shared base and user layers (see {get_layers}) are only built if
+    no other project has built them yet.
+    :param verbose: report skipped builds, build times and image sizes
+    :param fun_build: {function} (dockerdir, dockerfile, tag) -> bool, e.g.
+        to build on the scheduler server, see {client.request_build}
+    """
+    utils.handle_broken_project(directory)
+
+    # -- (1) construct Dockerfiles
+    layers = get_layers(directory, info)
+    tag, content, dockerdir = layers[-1]
+
+    key = get_build_key(dockerdir, content, tag)
+    images.record_image_use([layer_tag for layer_tag, _, _ in layers])
+    cache = load_build_cache(directory)
+    if tag in cache and cache[tag]["key"] == key and image_exists(tag):
+        if verbose:
+            console.info(
+                f"{tag} is up to date, skipped docker build "
+                f"(saved ~{cache[tag]['build_time_in_s']:.1f}s)"
+            )
+        return
+
+    start_time = time.time()
+    for layer_tag, layer_content, layer_dockerdir in layers:
+        if layer_tag != tag and image_exists(layer_tag):
+            if verbose:
+                console.info(f"{layer_tag} exists, it is shared")
+            continue
+        layer_start_time = time.time()
+        if not fun_build(layer_dockerdir, layer_content, layer_tag):
+            console.fail("building failed\n")
+            exit(0)
+        if verbose:
+            console.info(f"built {layer_tag} in {time.time() - layer_start_time:.1f}s")
+    build_time_in_s = time.time() - start_time
+
+    if verbose:
+        shared_size = get_image_size(layers[-2][0])
+        own_size = get_image_size(tag) - shared_size
+        console.info(
+            f"{tag}: {own_size / 1e6:.1f} MB of its own on top of "
+            f"{shared_size / 1e6:.1f} MB of shared layers, "
+            f"built in {build_time_in_s:.1f}s"
+        )
+
+    # other builds of this project may have finished in the meantime
+    cache = load_build_cache(directory)
+    cache[tag] = {"key": key, "build_time_in_s": build_time_in_s}
+    store_build_cache(directory, cache)
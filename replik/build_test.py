@@ -0,0 +1,105 @@
+import unittest
+import tempfile
+import os
+from os.path import join, dirname
+from shutil import copyfile
+import replik.build as BUILD
+import replik.constants as const
+
+TEMPLATES_DIR = join(dirname(__file__), "..", "templates")
+
+
+def make_project(directory: str):
+    dockerdir = const.get_dockerdir(directory)
+    os.makedirs(join(dockerdir, "data"))
+    for fname in ["Dockerfile", "hook_pre_useradd", "hook_post_useradd"]:
+        copyfile(join(TEMPLATES_DIR, fname), join(dockerdir, fname))
+    copyfile(join(TEMPLATES_DIR, "dockerignore"), join(dockerdir, ".dockerignore"))
+    with open(join(dockerdir, "requirements.txt"), "w") as f:
+        f.write("numpy\n")
+    return {
+        "name": "demo",
+        "tag": "a/replik_demo",
+        "is_simple": False,
+        "stdout_to_file": True,
+    }
+
+
+class TestBuild(unittest.TestCase):
+    def test_build_key(self):
+        tmp = tempfile.TemporaryDirectory()
+        info = make_project(tmp.name)
+        dockerdir = const.get_dockerdir(tmp.name)
+
+        def key(tag="a/replik_demo"):
+            _, dockerfile, _ = BUILD.get_layers(tmp.name, info)[-1]
+            return BUILD.get_build_key(dockerdir, dockerfile, tag)
+
+        self.assertEqual(
+            [
+                ".dockerignore",
+                "hook_post_useradd",
+                "hook_pre_useradd",
+                "requirements.txt",
+            ],
+            BUILD.get_context_files(dockerdir),
+        )
+        # the script and the log file are not part of the image
+        _, dockerfile, _ = BUILD.get_layers(tmp.name, info)[-1]
+        self.assertIn("python $REPLIK_SCRIPT $REPLIK_ARRAY_ARGS", dockerfile)
+        self.assertNotIn("/logs/", dockerfile)
+        first = key()
+        self.assertEqual(first, key())
+        self.assertNotEqual(first, key(tag="b/replik_demo"))
+
+        # files that are not sent to the docker daemon do not matter
+        for fname in ["data/big.bin", "start.sh"]:
+            with open(join(dockerdir, fname), "w") as f:
+                f.write("x")
+        self.assertEqual(first, key())
+
+        with open(join(dockerdir, "hook_pre_useradd"), "a") as f:
+            f.write("RUN echo 'changed'\n")
+        self.assertNotEqual(first, key())
+        tmp.cleanup()
+
+    def test_layers(self):
+        tmps = [tempfile.TemporaryDirectory() for _ in range(2)]
+        infos = [make_project(tmp.name) for tmp in tmps]
+
+        def tags(i):
+            return [tag for tag, _, _ in BUILD.get_layers(tmps[i].name, infos[i])]
+
+        # projects with the same base Dockerfile share the base and user layer
+        base, user, project = BUILD.get_layers(tmps[0].name, infos[0])
+        self.assertTrue(base[0].startswith(BUILD.BASE_REPOSITORY + ":"))
+        self.assertIsNone(base[2])  # no build context needed
+        self.assertTrue(user[1].startswith(f"FROM {base[0]}\n"))
+        self.assertTrue(project[1].startswith(f"FROM {user[0]}\n"))
+        self.assertEqual("a/replik_demo", project[0])
+        self.assertEqual(tags(0), tags(1))
+
+        # a hook only changes the project layer
+        dockerdir = const.get_dockerdir(tmps[1].name)
+        with open(join(dockerdir, "hook_pre_useradd"), "a") as f:
+            f.write("RUN echo 'changed'\n")
+        self.assertEqual(tags(0)[:2], tags(1)[:2])
+        self.assertNotEqual(
+            BUILD.get_layers(tmps[0].name, infos[0])[2][1],
+            BUILD.get_layers(tmps[1].name, infos[1])[2][1],
+        )
+
+        # a base Dockerfile that copies files depends on the build context
+        with open(join(dockerdir, "Dockerfile"), "a") as f:
+            f.write("COPY requirements.txt /tmp/\n")
+        base = BUILD.get_layers(tmps[1].name, infos[1])[0]
+        self.assertEqual(dockerdir, base[2])
+        with open(join(dockerdir, "requirements.txt"), "a") as f:
+            f.write("scipy\n")
+        self.assertNotEqual(base[0], BUILD.get_layers(tmps[1].name, infos[1])[0][0])
+        for tmp in tmps:
+            tmp.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
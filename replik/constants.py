@@ -50,12 +50,23 @@ def check_if_string_contains_forbidden_symbols(txt: str) -> bool:
     return False
 
 
+SCHEDULE_DIR = "/srv/replik_schedule"  # see install_schedule.sh
+
+
 def running_files_dir_for_scheduler() -> str:
-    return "/srv/replik_schedule/running"
+    return join(SCHEDULE_DIR, "running")
 
 
 def staging_files_dir_for_scheduler() -> str:
-    return "/srv/replik_schedule/staging"
+    return join(SCHEDULE_DIR, "staging")
+
+
+def journal_file_for_scheduler() -> str:
+    return join(SCHEDULE_DIR, "journal.jsonl")
+
+
+def image_usage_dir_for_scheduler() -> str:
+    return join(SCHEDULE_DIR, "images")
 
 
 def get_dockerdir(directory: str) -> str:
@@ -66,6 +77,13 @@ def get_local_replik_dir(directory: str) -> str:
     return join(directory, ".replik")
 
 
+def get_build_cache_file(directory: str) -> str:
+    """
+    {root}/.replik/build_cache.json: key and duration of the last build per tag
+    """
+    return join(directory, ".replik/build_cache.json")
+
+
 def replik_root_file(directory: str) -> str:
     """
     {root}/.replik
@@ -88,13 +106,18 @@ def is_broken_project(directory: str) -> bool:
     return isfile(join(directory, "docker/Dockerfile.bkp"))
 
 
-def get_stdout_file_in_container(directory: str, outfile_name: str = "") -> str:
+def get_stdout_file_in_container(
+    directory: str, outfile_name: str = "", suffix: str = ""
+) -> str:
+    """
+    :param suffix: e.g. the index of the task of a job array
+    """
     now = datetime.now()
     dt_string = now.strftime("%Y%m%d_%H%M%S")
     if len(outfile_name) == 0:
-        return f"/home/user/.replik/logs/stdout_{dt_string}.log"
+        return f"/home/user/.replik/logs/stdout_{dt_string}{suffix}.log"
     else:
-        return f"/home/user/.replik/logs/{outfile_name}_{dt_string}.log"
+        return f"/home/user/.replik/logs/{outfile_name}_{dt_string}{suffix}.log"
 
 
 def get_replik_settings(directory: str) -> Dict:
@@ -0,0 +1,192 @@
+"""
+Tracks when each replik image has been used last and removes the least
+recently used ones (and dangling layers) once the images take more disk
+space than a budget, see {collect}.
+"""
+import os
+import re
+import subprocess
+from os.path import join, isfile, isdir
+from typing import Dict, List
+from urllib.parse import quote, unquote
+
+import replik.console as console
+import replik.constants as const
+
+
+SIZE_UNITS = {"": 1, "k": 1e3, "m": 1e6, "g": 1e9, "t": 1e12}
+
+
+def parse_size(text: str) -> int:
+    """
+    :param text: e.g. "512MB" (as printed by docker), "100G" or "1.5t"
+    :returns: size in bytes
+    """
+    match = re.fullmatch(r"\s*([\d.]+)\s*([kKmMgGtT]?)i?[bB]?\s*", text)
+    if match is None:
+        raise ValueError(f"invalid size '{text}'")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+def is_replik_image(tag: str) -> bool:
+    """project images ({username}/replik_{name}) and their shared layers"""
+    repository = tag.rsplit(":", 1)[0]
+    return (
+        repository.startswith("replik_base")
+        or repository.startswith("replik_user_")
+        or repository.split("/")[-1].startswith("replik_")
+    )
+
+
+def normalize_tag(tag: str) -> str:
+    """{tag} as listed by docker, i.e. with ":latest" if it has no tag"""
+    return tag if ":" in tag.split("/")[-1] else f"{tag}:latest"
+
+
+def record_image_use(tags: List[str], cur_time_in_s: float = None):
+    """
+    called whenever the images {tags} are used, e.g. by `replik run`. Every
+    image has a file in {const.image_usage_dir_for_scheduler}, its
+    modification time is the last use. The shared layers are used by all
+    users: the files are writable for everyone, as only the owner of a file
+    may set an explicit time, other users touch it with the current time.
+    :param cur_time_in_s: for unit testing
+    """
+    usage_dir = const.image_usage_dir_for_scheduler()
+    times = None if cur_time_in_s is None else (cur_time_in_s, cur_time_in_s)
+    for tag in tags:
+        fname = join(usage_dir, quote(normalize_tag(tag), safe=""))
+        try:
+            try:
+                fd = os.open(fname, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+                os.fchmod(fd, 0o666)  # not restricted by the umask
+                os.close(fd)
+            except FileExistsError:
+                pass
+            os.utime(fname, times)
+        except OSError:
+            continue  # e.g. the usage is not tracked on this machine
+
+
+def get_last_uses() -> Dict[str, float]:
+    """:returns: {tag: last use in s}"""
+    usage_dir = const.image_usage_dir_for_scheduler()
+    if not isdir(usage_dir):
+        return {}
+    return dict(
+        (unquote(fname), os.path.getmtime(join(usage_dir, fname)))
+        for fname in os.listdir(usage_dir)
+    )
+
+
+def forget_image(tag: str):
+    fname = join(const.image_usage_dir_for_scheduler(), quote(tag, safe=""))
+    if isfile(fname):
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+
+
+def get_protected_tags(status) -> List[str]:
+    """
+    :param status: of the scheduler, see {Scheduler.publish_status}
+    :returns: the images of the staged, running and killed processes and of
+        the builds in flight: they must not be removed
+    """
+    tags = set()
+    for place in ["running", "staging"]:
+        entries = status[place]
+        entries = entries.values() if isinstance(entries, dict) else entries
+        tags.update(entry["info"]["tag"] for entry in entries)
+    tags.update(proc["tag"] for proc in status["killing"])
+    tags.update(build["tag"] for build in status.get("builds", []))
+    return [normalize_tag(tag) for tag in tags]
+
+
+def list_images() -> List[str]:
+    """:returns: tags of all replik images"""
+    out = subprocess.run(
+        ["docker", "image", "ls", "--format", "{{.Repository}}:{{.Tag}}"],
+        stdout=subprocess.PIPE,
+    ).stdout.decode("utf-8")
+    return [tag for tag in out.split("\n") if len(tag) > 0 and is_replik_image(tag)]
+
+
+def get_images_disk_usage() -> int:
+    """:returns: bytes used by all docker images"""
+    out = subprocess.run(
+        ["docker", "system", "df", "--format", "{{.Type}}\t{{.Size}}"],
+        stdout=subprocess.PIPE,
+    ).stdout.decode("utf-8")
+    for line in out.split("\n"):
+        if line.startswith("Images\t"):
+            return parse_size(line.split("\t")[1])
+    return 0
+
+
+def remove_image(tag: str) -> bool:
+    """never forced: docker refuses to remove images of (stopped) containers"""
+    r = subprocess.run(
+        ["docker", "image", "rm", tag],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return r.returncode == 0
+
+
+def prune_dangling_images():
+    subprocess.run(["docker", "image", "prune", "--force"], stdout=subprocess.DEVNULL)
+
+
+def collect(
+    budget: int,
+    protected: List[str],
+    fun_list_images=list_images,
+    fun_disk_usage=get_images_disk_usage,
+    fun_remove=remove_image,
+    fun_prune=prune_dangling_images,
+    verbose: bool = False,
+) -> List[str]:
+    """
+    Remove dangling layers and then the least recently used replik images
+    until all images together take at most {budget} bytes. Images that
+    have never been recorded as used are removed first. A shared layer is
+    used whenever one of its projects is, so it goes after them.
+    :param protected: tags that are never removed, see {get_protected_tags}
+    :returns: the removed tags that freed disk space. Removing a layer that
+        other images are built on only drops its tag, this is not counted.
+    """
+    fun_prune()
+    usage = fun_disk_usage()
+    if usage <= budget:
+        return []
+    last_uses = get_last_uses()
+
+    def order(tag: str):
+        """least recently used first, projects before user before base layers"""
+        layer = 0 if "/" in tag else (2 if tag.startswith("replik_base") else 1)
+        return last_uses.get(tag, 0), layer
+
+    protected = set(normalize_tag(tag) for tag in protected)
+    candidates = sorted(
+        [tag for tag in fun_list_images() if tag not in protected], key=order
+    )
+    removed = []
+    for tag in candidates:
+        if usage <= budget:
+            break
+        if not fun_remove(tag):
+            continue  # e.g. a stopped container still uses it
+        forget_image(tag)
+        fun_prune()
+        previous_usage, usage = usage, fun_disk_usage()
+        if usage >= previous_usage:
+            if verbose:
+                console.info(f"untagged {tag}, other images are built on it")
+            continue
+        removed.append(tag)
+        if verbose:
+            console.info(f"removed {tag}, images use {usage / 1e9:.1f} GB")
+    return removed
+
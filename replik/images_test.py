@@ -0,0 +1,120 @@
+import unittest
+import os
+import stat
+from os.path import join
+from urllib.parse import quote
+import replik.images as IMAGES
+import replik.constants as const
+
+
+class TestImages(unittest.TestCase):
+    def test_sizes_and_tags(self):
+        self.assertEqual(512 * 10**6, IMAGES.parse_size("512MB"))
+        self.assertEqual(1500 * 10**9, IMAGES.parse_size("1.5T"))
+        self.assertEqual(100 * 10**9, IMAGES.parse_size("100G"))
+        self.assertEqual(0, IMAGES.parse_size("0B"))
+        with self.assertRaises(ValueError):
+            IMAGES.parse_size("lots")
+
+        self.assertTrue(IMAGES.is_replik_image("julian/replik_demo:latest"))
+        self.assertTrue(IMAGES.is_replik_image("replik_base:0123"))
+        self.assertTrue(IMAGES.is_replik_image("replik_user_1000:0123"))
+        self.assertFalse(IMAGES.is_replik_image("ubuntu:20.04"))
+        self.assertEqual("a/replik_b:latest", IMAGES.normalize_tag("a/replik_b"))
+
+        status = {
+            "running": [{"info": {"tag": "a/replik_run"}}],
+            "staging": {3: {"info": {"tag": "a/replik_stage"}}},
+            "killing": [{"tag": "a/replik_kill"}],
+            "builds": [{"tag": "a/replik_build"}],
+        }
+        self.assertEqual(
+            [f"a/replik_{name}:latest" for name in ["build", "kill", "run", "stage"]],
+            sorted(IMAGES.get_protected_tags(status)),
+        )
+
+    def test_collect(self):
+        os.makedirs(const.image_usage_dir_for_scheduler(), exist_ok=True)
+        sizes = {
+            "t/replik_old:latest": 10,
+            "t/replik_new:latest": 10,
+            "t/replik_staged:latest": 10,
+            "t/replik_unknown:latest": 10,
+            "replik_user_1:a": 5,
+            "replik_base:a": 50,
+        }
+        IMAGES.record_image_use(["t/replik_old", "replik_user_1:a"], 100)
+        IMAGES.record_image_use(["t/replik_new", "replik_base:a"], 200)
+
+        def remove(tag):
+            del sizes[tag]
+            return True
+
+        removed = IMAGES.collect(
+            budget=70,
+            protected=["t/replik_staged"],
+            fun_list_images=lambda: list(sizes.keys()),
+            fun_disk_usage=lambda: sum(sizes.values()),
+            fun_remove=remove,
+            fun_prune=lambda: None,
+        )
+        self.assertEqual(
+            ["t/replik_unknown:latest", "t/replik_old:latest", "replik_user_1:a"],
+            removed,
+        )
+        self.assertNotIn("t/replik_old:latest", IMAGES.get_last_uses())
+        self.assertEqual(
+            [],
+            IMAGES.collect(
+                100, [], fun_disk_usage=lambda: 100, fun_prune=lambda: None
+            ),
+        )
+
+        # the shared base goes after the projects that have used it last
+        removed = IMAGES.collect(
+            budget=0,
+            protected=["t/replik_staged"],
+            fun_list_images=lambda: list(sizes.keys()),
+            fun_disk_usage=lambda: sum(sizes.values()),
+            fun_remove=remove,
+            fun_prune=lambda: None,
+        )
+        self.assertEqual(["t/replik_new:latest", "replik_base:a"], removed)
+        self.assertEqual(["t/replik_staged:latest"], list(sizes.keys()))
+
+    def test_record_image_use(self):
+        usage_dir = const.image_usage_dir_for_scheduler()
+        os.makedirs(usage_dir, exist_ok=True)
+        tags = ["replik_base:b", "x" * 300, "replik_user_1:b", "t/replik_rec"]
+        for tag in tags:
+            IMAGES.forget_image(IMAGES.normalize_tag(tag))
+        # a tag that can not be recorded does not stop the others
+        IMAGES.record_image_use(tags, 100)
+        last_uses = IMAGES.get_last_uses()
+        for tag in ["replik_base:b", "replik_user_1:b", "t/replik_rec:latest"]:
+            self.assertEqual(100, last_uses[tag])
+            # other users touch the shared layers as well
+            mode = os.stat(join(usage_dir, quote(tag, safe=""))).st_mode
+            self.assertEqual(0o666, stat.S_IMODE(mode))
+            IMAGES.forget_image(tag)
+
+    def test_collect_untagged_parent(self):
+        sizes = {"t/replik_staged:latest": 10, "replik_base:c": 50}
+
+        def remove(tag):
+            """the base is only untagged: the staged image is built on it"""
+            return True
+
+        removed = IMAGES.collect(
+            budget=0,
+            protected=["t/replik_staged"],
+            fun_list_images=lambda: list(sizes.keys()),
+            fun_disk_usage=lambda: sum(sizes.values()),
+            fun_remove=remove,
+            fun_prune=lambda: None,
+        )
+        self.assertEqual([], removed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,6 +18,7 @@ import replik.info as info
 import replik.scheduler.schedule as schedule
 import replik.scheduler.unschedule as unschedule
 import replik.scheduler.schedule_info as schedule_info
+import replik.scheduler.image_gc as image_gc
 
 
 def demask_script(script):
@@ -34,7 +35,29 @@ def demask_script(script):
 @click.option("--gpu", default=-1)
 @click.option("--mem", default=-1)
 @click.option("--outfile_name", default="")
-def replik(directory, tool, script, extra_paths, uid, cpu, gpu, mem, outfile_name):
+@click.option("--watch", is_flag=True, help="schedule-info: follow all changes")
+@click.option("--tag", default="", help="unschedule: all processes with this tag")
+@click.option("--user", default="", help="unschedule: all processes of this user")
+@click.option("--array", default="", help="schedule: args file or range of a job array")
+@click.option("--verbose", is_flag=True, help="report skipped builds")
+@click.option("--budget", default="100G", help="gc: disk space for all images")
+def replik(
+    directory,
+    tool,
+    script,
+    extra_paths,
+    uid,
+    cpu,
+    gpu,
+    mem,
+    outfile_name,
+    watch,
+    tag,
+    user,
+    array,
+    verbose,
+    budget,
+):
     """"""
     script = demask_script(script)
 
@@ -48,6 +71,7 @@ def replik(directory, tool, script, extra_paths, uid, cpu, gpu, mem, outfile_nam
             script,
             final_docker_exec_command="/bin/bash /home/user/run.sh",
             outfile_name=outfile_name,
+            verbose=verbose,
         )
     elif tool == "enter":
         run.execute(
@@ -55,6 +79,7 @@ def replik(directory, tool, script, extra_paths, uid, cpu, gpu, mem, outfile_nam
             script,
             final_docker_exec_command="/bin/bash",
             outfile_name=outfile_name,
+            verbose=verbose,
         )
     elif tool == "info":
         info.execute(directory)
@@ -67,11 +92,15 @@ def replik(directory, tool, script, extra_paths, uid, cpu, gpu, mem, outfile_nam
             gpu=gpu,
             mem=mem,
             outfile_name=outfile_name,
+            array=array,
+            verbose=verbose,
         )
     elif tool == "schedule-info":
-        schedule_info.execute()
+        schedule_info.execute(watch=watch)
     elif tool == "unschedule":
-        unschedule.execute(uid)
+        unschedule.execute(uid, tag=tag, username=user, array=array)
+    elif tool == "gc":
+        image_gc.execute(budget)
     else:
         console.warning(f"no command '{tool}'")
 
@@ -1,7 +1,9 @@
 from subprocess import call
 from typing import Dict
 from os.path import join
+from shlex import quote
 
+import replik.console as console
 import replik.constants as const
 import replik.build as build
 from replik.paths import load_all_extra_paths
@@ -39,8 +41,50 @@ def set_all_paths(directory: str, info: Dict):
     return docker_exec_command
 
 
+def check_outfile_name(info: Dict, outfile_name: str):
+    if len(outfile_name) > 0:
+        if not info["stdout_to_file"]:
+            console.fail(
+                f"Output file name is set to '{outfile_name}' but is currently set to output to terminal rather than file!"
+            )
+            exit()
+        # check for forbidden chars
+        if const.check_if_string_contains_forbidden_symbols(outfile_name):
+            console.fail(
+                f"Output file name is set to '{outfile_name}' which contains invalid characters for a file name!"
+            )
+            exit()
+
+
+def get_run_env(
+    directory: str, script: str, info: Dict, outfile_name: str = "", suffix: str = ""
+) -> Dict:
+    """
+    environment of /home/user/run.sh (see {build.get_project_layer}): the script
+    call and, if stdout_to_file is set, the log file
+    :param suffix: of the log file, e.g. of the task of a job array
+    """
+    env = {"REPLIK_SCRIPT": script}
+    if info["stdout_to_file"]:
+        env["REPLIK_LOG"] = const.get_stdout_file_in_container(
+            directory, outfile_name, suffix=suffix
+        )
+    return env
+
+
+def set_env(env: Dict):
+    docker_exec_command = ""
+    for name, value in env.items():
+        docker_exec_command += f"-e {name}={quote(str(value))} "
+    return docker_exec_command
+
+
 def execute(
-    directory: str, script: str, final_docker_exec_command: str, outfile_name: str
+    directory: str,
+    script: str,
+    final_docker_exec_command: str,
+    outfile_name: str,
+    verbose: bool = False,
 ):
     """"""
     info = const.get_replik_settings(directory)
@@ -50,7 +94,8 @@ def execute(
     gpus = int(info["gpus"])
     dockerdir = const.get_dockerdir(directory)
 
-    build.execute(directory, script, info, outfile_name=outfile_name)
+    check_outfile_name(info, outfile_name)
+    build.execute(directory, info, verbose=verbose)
 
     # execute the docker image
 
@@ -60,6 +105,8 @@ def execute(
         docker_exec_command += "--gpus all "
 
     docker_exec_command += set_all_paths(directory, info)
+    env = get_run_env(directory, script, info, outfile_name)
+    docker_exec_command += set_env(env)
 
     docker_exec_command += f"--rm -it {tag} " + final_docker_exec_command
 
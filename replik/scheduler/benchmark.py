@@ -0,0 +1,626 @@
+"""
+Benchmarks for the scheduler, run with:
+    python -m replik.scheduler.benchmark [--quick] [--json] [--save=baseline.json]
+        [--baseline=baseline.json] [--tolerance=0.5]
+Docker is faked so this can run without a docker daemon and the mark
+files are written to a temporary directory, see {temporary_mark_dirs}.
+With --baseline the results are compared to a previous --save and the
+exit code is 1 if any of them got worse by more than {tolerance}.
+    python -m replik.scheduler.benchmark --builds={project} [--n_builds=8]
+builds the image of a replik project {n_builds} times at once with the
+real docker daemon instead, see {bench_parallel_builds}.
+"""
+import sys
+import json
+import time
+import threading
+import multiprocessing
+import tracemalloc
+import tempfile
+import zmq
+from os.path import join
+from typing import Dict, List
+import replik.console as console
+import replik.constants as const
+import replik.build as build
+from replik.scheduler.resource_monitor import ResourceMonitor
+from replik.scheduler.schedule import ReplikProcess, rank_processes_that_can_be_killed
+from replik.scheduler.staging_queue import StagingQueue
+from replik.scheduler.uid_queue import UidQueue
+from replik.scheduler.scheduler import Scheduler, temporary_mark_dirs
+from replik.scheduler.journal import Journal
+from replik.scheduler.message import (
+    MsgType,
+    get_is_alive_msg,
+    get_request_status_msg,
+    get_request_uid_msg,
+)
+from replik.scheduler.server import RpcServer
+
+
+def fake_docker_kill(container_name: str):
+    pass
+
+
+def setup_full_machine(n_staging: int, n_gpus: int = 8, max_id: int = None):
+    """
+    all GPUs are occupied by processes that may not be killed yet while
+    {n_staging} processes are waiting in the staging queue.
+    """
+    if max_id is None:
+        max_id = n_staging + n_gpus + 1
+    mon = ResourceMonitor(cpu_count=64, gpu_count=n_gpus, mem_gb=512)
+    scheduler = Scheduler(mon, max_id=max_id, fun_docker_kill=fake_docker_kill)
+    info = {"cpus": 4, "gpus": 1, "memory": "16g", "tag": "bench"}
+    running = []
+    for _ in range(n_gpus):
+        running.append(scheduler.add_process_to_staging(info, cur_time_in_s=0))
+    scheduler.scheduling_step([], current_time_in_s=0)
+    for _ in range(n_staging):
+        scheduler.add_process_to_staging(info, cur_time_in_s=1)
+    containers = [proc.container_name() for proc in running]
+    return scheduler, containers
+
+
+def bench_scheduling_step(n_staging: int, n_steps: int = 10):
+    """returns the mean duration of a scheduling step in seconds"""
+    scheduler, containers = setup_full_machine(n_staging)
+    cur_time = 60
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        cur_time += 5
+        scheduler.scheduling_step(containers, current_time_in_s=cur_time)
+    elapsed = (time.perf_counter() - start) / n_steps
+    assert len(scheduler.STAGING_QUEUE) == n_staging
+    return elapsed
+
+
+def bench_submit(n_staging: int):
+    """returns the mean duration of a submission in seconds"""
+    mon = ResourceMonitor(cpu_count=64, gpu_count=8, mem_gb=512)
+    scheduler = Scheduler(mon, max_id=n_staging, fun_docker_kill=fake_docker_kill)
+    info = {"cpus": 4, "gpus": 1, "memory": "16g", "tag": "bench"}
+    start = time.perf_counter()
+    for _ in range(n_staging):
+        scheduler.add_process_to_staging(info, cur_time_in_s=0)
+    return (time.perf_counter() - start) / n_staging
+
+
+def bench_unschedule(n_staging: int):
+    """returns the duration of a scheduling step that removes every
+    second staging process in seconds"""
+    scheduler, containers = setup_full_machine(n_staging)
+    for proc in list(scheduler.STAGING_QUEUE)[::2]:
+        scheduler.schedule_uid_for_killing(proc.uid)
+    start = time.perf_counter()
+    scheduler.scheduling_step(containers, current_time_in_s=60)
+    elapsed = time.perf_counter() - start
+    assert len(scheduler.STAGING_QUEUE) == n_staging // 2
+    return elapsed
+
+
+def bench_recovery(n_staging: int):
+    """
+    returns the duration of recovering {n_staging} + 8 running
+    processes from the journal in seconds
+    """
+    tmp = tempfile.TemporaryDirectory()
+    fname = join(tmp.name, "journal.jsonl")
+    mon = ResourceMonitor(cpu_count=64, gpu_count=8, mem_gb=512)
+    scheduler = Scheduler(
+        mon,
+        max_id=n_staging + 9,
+        fun_docker_kill=fake_docker_kill,
+        journal=Journal(fname),
+    )
+    scheduler.recover([], current_time_in_s=0)
+    info = {"cpus": 4, "gpus": 1, "memory": "16g", "tag": "bench"}
+    for _ in range(8):
+        scheduler.add_process_to_staging(info, cur_time_in_s=0)
+    scheduler.scheduling_step([], current_time_in_s=0)
+    for _ in range(n_staging):
+        scheduler.add_process_to_staging(info, cur_time_in_s=1)
+    containers = [proc.container_name() for proc, _ in scheduler.RUNNING_QUEUE]
+
+    mon = ResourceMonitor(cpu_count=64, gpu_count=8, mem_gb=512)
+    scheduler = Scheduler(
+        mon,
+        max_id=n_staging + 9,
+        fun_docker_kill=fake_docker_kill,
+        journal=Journal(fname),
+    )
+    start = time.perf_counter()
+    scheduler.recover(containers, current_time_in_s=2)
+    elapsed = time.perf_counter() - start
+    assert len(scheduler.STAGING_QUEUE) == n_staging
+    assert len(scheduler.RUNNING_QUEUE) == 8
+    tmp.cleanup()
+    return elapsed
+
+
+def bench_placement(n_staging: int, n_steps: int = 10):
+    """
+    returns the mean duration of deciding which processes to preempt and
+    to place (without applying the decision) in seconds
+    """
+    scheduler, _ = setup_full_machine(n_staging)
+    cur_time = 2 * 3600  # all running processes may be preempted
+    running = [proc for proc, _ in scheduler.RUNNING_QUEUE]
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        procs_to_be_killed = rank_processes_that_can_be_killed(
+            running, current_time_in_s=cur_time
+        )
+        scheduler.resources.schedule_appropriate_resources(
+            procs_to_be_killed, scheduler.STAGING_QUEUE, current_time_in_s=cur_time
+        )
+    return (time.perf_counter() - start) / n_steps
+
+
+def bench_placement_allocations(n_staging: int):
+    """
+    returns the peak memory in bytes allocated while deciding the placement
+    on a full machine, no process may be preempted
+    """
+    scheduler, _ = setup_full_machine(n_staging)
+    tracemalloc.start()
+    scheduler.resources.schedule_appropriate_resources(
+        [], scheduler.STAGING_QUEUE, current_time_in_s=60
+    )
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench_step_allocations(n_staging: int):
+    """returns the peak memory in bytes allocated during a scheduling step"""
+    scheduler, containers = setup_full_machine(n_staging)
+    scheduler.scheduling_step(containers, current_time_in_s=60)
+    tracemalloc.start()
+    scheduler.scheduling_step(containers, current_time_in_s=65)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench_columnar(n_staging: int, n_running: int = 8):
+    """
+    compares the object loop with the columnar staging queue for
+    "which processes fit now" and the whole placement decision on a full
+    machine
+    :returns: {query: (object loop in s, columnar in s)}
+    """
+    mon = ResourceMonitor(cpu_count=64, gpu_count=8, mem_gb=512)
+    for uid in range(n_running):
+        proc = ReplikProcess({"cpus": 8, "gpus": 1, "memory": "64g"}, uid)
+        proc.push_to_running_queue(cur_time_in_s=0)
+        mon.add_process(proc, [uid])
+    objects = UidQueue(key=lambda proc: proc.uid)
+    columns = StagingQueue()
+    for uid in range(n_running, n_running + n_staging):
+        info = {"cpus": 1 + uid % 8, "gpus": 1 + uid % 2, "memory": f"{uid % 64}g"}
+        proc = ReplikProcess(info, uid)
+        proc.push_to_staging_queue(cur_time_in_s=0)
+        objects.append(proc)
+        columns.append(proc)
+    free = mon.get_current_free_resources()
+
+    def timed(fun):
+        start = time.perf_counter()
+        result = fun()
+        return time.perf_counter() - start, result
+
+    results = {}
+    loop_s, fits = timed(lambda: [p for p in objects if free.fits(p.resources)])
+    columnar_s, fits_ = timed(lambda: columns.admissible(free))
+    assert fits == fits_
+    results["fits"] = (loop_s, columnar_s)
+
+    timings = []
+    for staging in [objects, columns]:
+        elapsed, (_, procs_to_schedule, _) = timed(
+            lambda: mon.schedule_appropriate_resources([], staging, 0)
+        )
+        assert len(procs_to_schedule) == 0
+        timings.append(elapsed)
+    results["placement"] = tuple(timings)
+    return results
+
+
+class TimedLock:
+    """drop-in for the scheduler's lock that records how long it is held"""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.acquired_at = 0
+        self.hold_times_in_s = []
+
+    def acquire(self, *args, **kwargs):
+        is_acquired = self.lock.acquire(*args, **kwargs)
+        if is_acquired:
+            self.acquired_at = time.perf_counter()
+        return is_acquired
+
+    def release(self):
+        self.hold_times_in_s.append(time.perf_counter() - self.acquired_at)
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def bench_lock_hold(n_staging: int, n_steps: int = 10):
+    """
+    returns the longest time in seconds the lock is held by a scheduling
+    step and by a submit (both publish a new status, status requests do
+    not take the lock)
+    """
+    scheduler, containers = setup_full_machine(
+        n_staging, max_id=n_staging + n_steps + 9
+    )
+    scheduler.lock = TimedLock()
+    cur_time = 60
+    for _ in range(n_steps):
+        cur_time += 5
+        scheduler.scheduling_step(containers, current_time_in_s=cur_time)
+    step_in_s = max(scheduler.lock.hold_times_in_s)
+    scheduler.lock.hold_times_in_s = []
+    info = {"cpus": 4, "gpus": 1, "memory": "16g", "tag": "bench"}
+    for _ in range(n_steps):
+        scheduler.add_process_to_staging(info, cur_time_in_s=cur_time)
+    submit_in_s = max(scheduler.lock.hold_times_in_s)
+    return step_in_s, submit_in_s
+
+
+def rpc_client_process(address, msgs, n_threads, n_requests_per_client, go, results):
+    """
+    runs {n_threads} REQ clients in its own process, so that they do not
+    compete with the server for the GIL. Puts [(msg type, latency)] into
+    {results} once all clients are done.
+    """
+    context = zmq.Context()
+    latencies = [[] for _ in range(n_threads)]
+
+    def client(i: int):
+        req = context.socket(zmq.REQ)
+        req.connect(address)
+        go.wait()
+        for k in range(n_requests_per_client):
+            msg = msgs[(i + k) % len(msgs)]
+            start = time.perf_counter()
+            req.send_json(msg)
+            req.recv()
+            latencies[i].append((msg["msg"], time.perf_counter() - start))
+        req.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    context.term()
+    results.put(sum(latencies, []))
+
+
+def run_rpc_clients(
+    n_clients: int,
+    msgs: List,
+    n_staging: int,
+    n_requests_per_client: int,
+    n_processes: int = 4,
+):
+    """
+    {n_clients} local REQ clients (spread over {n_processes} processes) send
+    the {msgs} in turn to the {RpcServer} while the scheduling loop runs next
+    to it with a fake container lister.
+    :returns: elapsed time in seconds, {message type: [round-trip latencies]}
+    """
+    scheduler, _ = setup_full_machine(
+        n_staging, max_id=n_staging + n_clients * n_requests_per_client + 9
+    )
+    context = zmq.Context()
+    rpc = RpcServer(scheduler, "tcp://127.0.0.1:*", context=context)
+    stop = threading.Event()
+
+    def fake_list_containers():
+        """every placed process has started its container right away"""
+        with scheduler.lock:
+            return [proc.container_name() for proc, _ in scheduler.RUNNING_QUEUE]
+
+    def scheduling_loop():
+        while not stop.is_set():
+            scheduler.wait_for_step_request(timeout_in_s=0.1, debounce_in_s=0)
+            scheduler.scheduling_step(fake_list_containers())
+
+    threads = [
+        threading.Thread(target=rpc.serve, args=(stop,)),
+        threading.Thread(target=scheduling_loop),
+    ]
+    for thread in threads:
+        thread.start()
+
+    mp = multiprocessing.get_context("spawn")
+    go = mp.Event()
+    results = mp.Queue()
+    n_processes = min(n_processes, n_clients)
+    processes = []
+    for i in range(n_processes):
+        n_threads = n_clients // n_processes + (1 if i < n_clients % n_processes else 0)
+        args = (rpc.address, msgs, n_threads, n_requests_per_client, go, results)
+        processes.append(mp.Process(target=rpc_client_process, args=args))
+    for process in processes:
+        process.start()
+    time.sleep(0.5)  # let all clients connect
+    start = time.perf_counter()
+    go.set()
+    latencies = sum([results.get() for _ in processes], [])
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    context.term()
+
+    by_type = {}
+    for msg_type, latency in latencies:
+        by_type.setdefault(msg_type, []).append(latency)
+    return elapsed, by_type
+
+
+def p99(latencies: List[float]) -> float:
+    latencies = list(sorted(latencies))
+    return latencies[int(0.99 * (len(latencies) - 1))]
+
+
+def bench_rpc(
+    n_clients: int, msg, n_staging: int = 1000, n_requests_per_client: int = 200
+):
+    """
+    :returns: requests per second, p99 round-trip latency in seconds
+    """
+    elapsed, by_type = run_rpc_clients(
+        n_clients, [msg], n_staging, n_requests_per_client
+    )
+    latencies = sum(by_type.values(), [])
+    return len(latencies) / elapsed, p99(latencies)
+
+
+def bench_rpc_load(
+    n_clients: int = 200, n_staging: int = 1000, n_requests_per_client: int = 20
+):
+    """
+    load test: {n_clients} clients that submit, ask for the status and
+    check if the server is alive at the same time
+    :returns: {"submit"|"status"|"alive": p99 round-trip latency in seconds}
+    """
+    info = {"cpus": 4, "gpus": 1, "memory": "16g", "tag": "load"}
+    msgs = [get_request_uid_msg(info), get_request_status_msg(), get_is_alive_msg()]
+    _, by_type = run_rpc_clients(n_clients, msgs, n_staging, n_requests_per_client)
+    names = {
+        MsgType.REQUEST_UID: "submit",
+        MsgType.REQUEST_STATUS: "status",
+        MsgType.ALIVE: "alive",
+    }
+    return dict((names[t], p99(latencies)) for t, latencies in by_type.items())
+
+
+def build_process(directory: str, info: Dict, go):
+    go.wait()
+    build.execute(directory, info)
+
+
+def bench_parallel_builds(directory: str, n_builds: int) -> float:
+    """
+    {n_builds} builds of the project in {directory} at once, like the
+    builds of concurrent `replik schedule` calls. The build cache entry is
+    dropped first so that every process runs `docker build`.
+    :returns: wall time in seconds until all builds are done
+    """
+    info = const.get_replik_settings(directory)
+    cache = build.load_build_cache(directory)
+    cache.pop(info["tag"], None)
+    build.store_build_cache(directory, cache)
+
+    mp = multiprocessing.get_context("spawn")
+    go = mp.Event()
+    procs = [
+        mp.Process(target=build_process, args=(directory, info, go))
+        for _ in range(n_builds)
+    ]
+    for proc in procs:
+        proc.start()
+    start = time.perf_counter()
+    go.set()
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - start
+    if any(proc.exitcode != 0 for proc in procs):
+        console.fail("at least one build failed")
+    return elapsed
+
+
+def run_benchmarks(quick: bool = False, verbose: bool = True) -> Dict:
+    """
+    :returns: {name: {"value", "unit", "better": "lower"|"higher"}}
+    """
+    sizes = [10, 100, 1000] if quick else [10, 100, 1000, 10000]
+    client_counts = [1, 8] if quick else [1, 8, 32]
+    results = {}
+
+    def report(name: str, value: float, unit: str, better: str = "lower"):
+        results[name] = {"value": value, "unit": unit, "better": better}
+
+    def info(text: str):
+        if verbose:
+            console.info(text)
+
+    def write(text: str):
+        if verbose:
+            console.write(text)
+
+    info("\n~ ~ scheduling_step vs. #staging ~ ~")
+    info("#staging | ms/step | us/staged job")
+    for n_staging in sizes:
+        elapsed = bench_scheduling_step(n_staging)
+        report(f"step@{n_staging}", elapsed * 1000, "ms")
+        write(
+            "%8d | %7.02f | %6.02f"
+            % (n_staging, elapsed * 1000, elapsed * 1000000 / n_staging)
+        )
+
+    info("\n~ ~ schedule_appropriate_resources vs. #staging ~ ~")
+    info("#staging | ms/decision")
+    for n_staging in sizes:
+        elapsed = bench_placement(n_staging)
+        report(f"placement@{n_staging}", elapsed * 1000, "ms")
+        write("%8d | %11.02f" % (n_staging, elapsed * 1000))
+
+    info("\n~ ~ memory allocated by a scheduling_step ~ ~")
+    info("#staging | step peak kB | placement peak kB")
+    for n_staging in sizes:
+        peak = bench_step_allocations(n_staging)
+        placement_peak = bench_placement_allocations(n_staging)
+        report(f"step_alloc@{n_staging}", peak / 1000, "kB")
+        report(f"placement_alloc@{n_staging}", placement_peak / 1000, "kB")
+        write(
+            "%8d | %12.01f | %17.01f"
+            % (n_staging, peak / 1000, placement_peak / 1000)
+        )
+
+    info("\n~ ~ object loop vs. columnar staging queue on a full machine ~ ~")
+    info("#staging |     query | loop ms | columnar ms")
+    for n_staging in [1000, 10000] if quick else [1000, 50000]:
+        for query, (loop_s, columnar_s) in bench_columnar(n_staging).items():
+            report(f"{query}_loop@{n_staging}", loop_s * 1000, "ms")
+            report(f"{query}_columnar@{n_staging}", columnar_s * 1000, "ms")
+            write(
+                "%8d | %9s | %7.02f | %11.02f"
+                % (n_staging, query, loop_s * 1000, columnar_s * 1000)
+            )
+
+    info("\n~ ~ longest time the lock is held ~ ~")
+    info("#staging | step ms | submit ms")
+    for n_staging in sizes:
+        step_in_s, submit_in_s = bench_lock_hold(n_staging)
+        report(f"lock_hold_step@{n_staging}", step_in_s * 1000, "ms")
+        report(f"lock_hold_submit@{n_staging}", submit_in_s * 1000, "ms")
+        write(
+            "%8d | %7.02f | %9.02f" % (n_staging, step_in_s * 1000, submit_in_s * 1000)
+        )
+
+    info("\n~ ~ add_process_to_staging vs. #staging ~ ~")
+    info("#staging | us/submit")
+    for n_staging in sizes:
+        elapsed = bench_submit(n_staging)
+        report(f"submit@{n_staging}", elapsed * 1000000, "us")
+        write("%8d | %9.02f" % (n_staging, elapsed * 1000000))
+
+    info("\n~ ~ unschedule half of the staging queue ~ ~")
+    info("#staging | ms/step | us/staged job")
+    for n_staging in sizes:
+        elapsed = bench_unschedule(n_staging)
+        report(f"unschedule@{n_staging}", elapsed * 1000, "ms")
+        write(
+            "%8d | %7.02f | %6.02f"
+            % (n_staging, elapsed * 1000, elapsed * 1000000 / n_staging)
+        )
+
+    info("\n~ ~ recovery from the journal ~ ~")
+    info("#staging | ms")
+    for n_staging in sizes:
+        elapsed = bench_recovery(n_staging)
+        report(f"recovery@{n_staging}", elapsed * 1000, "ms")
+        write("%8d | %7.02f" % (n_staging, elapsed * 1000))
+
+    info("\n~ ~ round trips with 1000 staging processes ~ ~")
+    info("request | #clients | req/s | p99 ms")
+    messages = [("alive", get_is_alive_msg()), ("status", get_request_status_msg())]
+    for name, msg in messages:
+        for n_clients in client_counts:
+            throughput, p99_in_s = bench_rpc(n_clients, msg)
+            report(f"rpc_{name}@{n_clients}", throughput, "req/s", better="higher")
+            report(f"rpc_{name}_p99@{n_clients}", p99_in_s * 1000, "ms")
+            write(
+                "%7s | %8d | %5d | %6.02f"
+                % (name, n_clients, throughput, p99_in_s * 1000)
+            )
+
+    n_clients = 50 if quick else 200
+    info(f"\n~ ~ load test: {n_clients} clients submit, ask for the status, ping ~ ~")
+    info("request | p99 ms")
+    for name, p99_in_s in sorted(bench_rpc_load(n_clients).items()):
+        report(f"load_{name}_p99@{n_clients}", p99_in_s * 1000, "ms")
+        write("%7s | %6.02f" % (name, p99_in_s * 1000))
+
+    return results
+
+
+def find_regressions(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    :returns: the names of all benchmarks that are more than {tolerance}
+        (e.g. 0.5 = 50%) worse than in the {baseline}
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        value, reference = result["value"], baseline[name]["value"]
+        if result["better"] == "lower":
+            is_worse = value > reference * (1 + tolerance)
+        else:
+            is_worse = value < reference / (1 + tolerance)
+        if is_worse:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv: List[str]):
+    options = {}
+    for arg in argv[1:]:
+        if arg.startswith("--") and "=" in arg:
+            key, value = arg[2:].split("=", 1)
+            options[key] = value
+    if "builds" in options:
+        n_builds = int(options.get("n_builds", 8))
+        elapsed = bench_parallel_builds(options["builds"], n_builds)
+        console.write("%d parallel builds: %.02fs" % (n_builds, elapsed))
+        return
+    as_json = "--json" in argv
+    # the marks of a live server on this machine must not be touched
+    with temporary_mark_dirs():
+        results = run_benchmarks(quick="--quick" in argv, verbose=not as_json)
+    if as_json:
+        print(json.dumps(results, indent=2))
+    if "save" in options:
+        with open(options["save"], "w") as f:
+            json.dump(results, f, indent=2)
+    if "baseline" in options:
+        with open(options["baseline"], "r") as f:
+            baseline = json.load(f)
+        tolerance = float(options.get("tolerance", 0.5))
+        regressions = find_regressions(results, baseline, tolerance)
+        for name in regressions:
+            console.fail(
+                "%s: %.02f %s (baseline %.02f)"
+                % (
+                    name,
+                    results[name]["value"],
+                    results[name]["unit"],
+                    baseline[name]["value"],
+                )
+            )
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,53 @@
+import unittest
+import tempfile
+from os.path import join, exists
+import replik.constants as const
+import replik.scheduler.benchmark as BENCH
+from replik.scheduler.message import get_is_alive_msg, get_request_status_msg
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_find_regressions(self):
+        baseline = {
+            "step@10": {"value": 1.0, "unit": "ms", "better": "lower"},
+            "rpc_alive@1": {"value": 1000, "unit": "req/s", "better": "higher"},
+        }
+        results = {
+            "step@10": {"value": 1.4, "unit": "ms", "better": "lower"},
+            "rpc_alive@1": {"value": 700, "unit": "req/s", "better": "higher"},
+            "step@100": {"value": 100, "unit": "ms", "better": "lower"},
+        }
+        self.assertEqual([], BENCH.find_regressions(results, baseline, 0.5))
+        self.assertEqual(
+            ["step@10", "rpc_alive@1"], BENCH.find_regressions(results, baseline, 0.2)
+        )
+
+    def test_rpc(self):
+        for msg in [get_is_alive_msg(), get_request_status_msg()]:
+            throughput, p99 = BENCH.bench_rpc(
+                2, msg, n_staging=10, n_requests_per_client=10
+            )
+            self.assertTrue(throughput > 0)
+            self.assertTrue(p99 > 0)
+
+    def test_lock_hold(self):
+        step_in_s, status_in_s = BENCH.bench_lock_hold(10, n_steps=2)
+        self.assertTrue(step_in_s > 0)
+        self.assertTrue(status_in_s > 0)
+
+    def test_live_marks_are_untouched(self):
+        tmp = tempfile.TemporaryDirectory()
+        schedule_dir = const.SCHEDULE_DIR
+        const.SCHEDULE_DIR = join(tmp.name, "missing")  # no server on this host
+        try:
+            with BENCH.temporary_mark_dirs():
+                self.assertTrue(BENCH.bench_scheduling_step(10, n_steps=2) > 0)
+                self.assertTrue(BENCH.bench_recovery(10) > 0)
+            self.assertFalse(exists(const.SCHEDULE_DIR))
+        finally:
+            const.SCHEDULE_DIR = schedule_dir
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+"""
+Builds the images of `replik schedule` on the server so that a burst of
+submissions does not start as many `docker build` at once. At most
+{max_workers} images are built at a time, the others wait in submission
+order. A build of the same tag and build key (see {build.get_build_key})
+that is already queued or running is not started again: the clients
+share its result.
+"""
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+import replik.build as build
+import replik.console as console
+
+
+class BuildState(IntEnum):
+    QUEUED = 1
+    BUILDING = 2
+    DONE = 3
+    FAILED = 4
+
+
+class Build:
+    def __init__(self, build_id: int, tag: str, key: str, username: str):
+        self.build_id = build_id
+        self.tag = tag
+        self.key = key
+        self.username = username
+        self.state = BuildState.QUEUED
+        self.n_clients = 1  # submissions that wait for this build
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_json(self):
+        return {
+            "id": self.build_id,
+            "tag": self.tag,
+            "key": self.key,
+            "username": self.username,
+            "state": self.state,
+            "n_clients": self.n_clients,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class BuildQueue:
+    def __init__(
+        self,
+        fun_build=build.build_image,
+        max_workers: int = 2,
+        keep_finished: int = 100,
+        on_change=None,
+        verbose: bool = False,
+    ):
+        """
+        :param fun_build: {function} (dockerdir, dockerfile, tag) -> bool
+        :param keep_finished: number of finished builds whose result can
+            still be asked for, see {get}
+        :param on_change: {function} called (without any lock held) whenever
+            a build has been queued, started or finished
+        """
+        super().__init__()
+        self.fun_build = fun_build
+        self.on_change = on_change
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.builds = {}  # build_id -> {Build}, queued, running and finished
+        self.in_flight = {}  # (tag, key) -> {Build}, queued or running
+        self.finished = deque()  # build_ids in the order they have finished
+        self.keep_finished = keep_finished
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="replik_build"
+        )
+
+    def submit(self, dockerdir: str, dockerfile: str, tag: str, username: str):
+        """
+        :param dockerfile: generated Dockerfile, see {build.get_layers}
+        :returns: json of the new {Build} or of the identical one in flight
+        """
+        try:
+            key = build.get_build_key(dockerdir, dockerfile, tag)
+        except OSError:
+            key = None  # the build itself fails and reports it
+        with self.lock:
+            if (tag, key) in self.in_flight:
+                job = self.in_flight[(tag, key)]
+                job.n_clients += 1
+                return job.to_json()
+            job = Build(self.next_id, tag, key, username)
+            self.next_id += 1
+            self.builds[job.build_id] = job
+            self.in_flight[(tag, key)] = job
+            result = job.to_json()
+        self.pool.submit(self.run, job, dockerdir, dockerfile)
+        self.changed()
+        return result
+
+    def run(self, job: Build, dockerdir: str, dockerfile: str):
+        with self.lock:
+            job.state = BuildState.BUILDING
+            job.started = time.time()
+        self.changed()
+        try:
+            success = self.fun_build(dockerdir, dockerfile, job.tag)
+        except Exception as e:
+            if self.verbose:
+                console.fail(f"could not build {job.tag}: {e}")
+            success = False
+        with self.lock:
+            job.state = BuildState.DONE if success else BuildState.FAILED
+            job.finished = time.time()
+            del self.in_flight[(job.tag, job.key)]
+            self.finished.append(job.build_id)
+            while len(self.finished) > self.keep_finished:
+                del self.builds[self.finished.popleft()]
+        self.changed()
+
+    def changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def get(self, build_id: int):
+        """:returns: json of the build or None if it is unknown"""
+        with self.lock:
+            if build_id not in self.builds:
+                return None
+            return self.builds[build_id].to_json()
+
+    def to_json(self):
+        """the queued and running builds, in submission order"""
+        with self.lock:
+            return [job.to_json() for job in self.in_flight.values()]
@@ -0,0 +1,65 @@
+import unittest
+import tempfile
+import threading
+from replik.scheduler.build_queue import BuildQueue, BuildState
+from replik.scheduler.resource_monitor import ResourceMonitor
+from replik.scheduler.scheduler import Scheduler
+
+
+class TestBuildQueue(unittest.TestCase):
+    def test_builds(self):
+        tmp = tempfile.TemporaryDirectory()
+        release = threading.Event()
+        started = []
+        lock = threading.Lock()
+
+        def fake_build(dockerdir, dockerfile, tag):
+            with lock:
+                started.append(tag)
+            release.wait(timeout=5)
+            return tag != "c"
+
+        mon = ResourceMonitor(cpu_count=4, gpu_count=1, mem_gb=100)
+        builds = BuildQueue(
+            fun_build=fake_build,
+            max_workers=2,
+            on_change=lambda: scheduler.publish_builds(),
+        )
+        scheduler = Scheduler(
+            mon, max_id=10, fun_docker_kill=lambda name: None, builds=builds
+        )
+
+        a = builds.submit(tmp.name, "FROM a", "a", "alice")
+        b = builds.submit(tmp.name, "FROM b", "b", "bob")
+        c = builds.submit(tmp.name, "FROM c", "c", "carol")
+        # the same tag and content is built only once
+        self.assertEqual(a["id"], builds.submit(tmp.name, "FROM a", "a", "bob")["id"])
+        self.assertNotEqual(
+            a["id"], builds.submit(tmp.name, "FROM a2", "a", "bob")["id"]
+        )
+
+        # at most two builds at a time, the others wait in order
+        for _ in range(100):
+            if len(started) == 2:
+                break
+            release.wait(timeout=0.01)
+        self.assertEqual(["a", "b"], started)
+        self.assertEqual(BuildState.QUEUED, builds.get(c["id"])["state"])
+        status = scheduler.get_resources_infos_as_json()
+        self.assertEqual(
+            ["a", "b", "c", "a"], [build["tag"] for build in status["builds"]]
+        )
+        self.assertEqual(2, status["builds"][0]["n_clients"])
+
+        release.set()
+        builds.pool.shutdown(wait=True)
+        self.assertEqual(BuildState.DONE, builds.get(a["id"])["state"])
+        self.assertEqual(BuildState.DONE, builds.get(b["id"])["state"])
+        self.assertEqual(BuildState.FAILED, builds.get(c["id"])["state"])
+        self.assertEqual([], scheduler.get_resources_infos_as_json()["builds"])
+        self.assertIsNone(builds.get(100))
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,73 +5,175 @@ A client needs to provide the following resources:
 }
 """
 import zmq
-import signal
-from time import time
+import time
+import threading
 from replik.scheduler.message import (
+    MsgType,
     get_is_alive_msg,
     get_murder_msg,
     get_request_uid_msg,
+    get_request_uids_msg,
+    get_murders_msg,
     get_request_status_msg,
+    get_notify_exit_msg,
+    get_request_build_msg,
+    get_request_build_state_msg,
 )
+from replik.scheduler.notify import EVENTS_PORT, STATUS_TOPIC, get_topic, subscribe
+from replik.scheduler.build_queue import BuildState
+import replik.build as build
 import replik.console as console
+import replik.constants as const
 
 context = zmq.Context()
 
-socket = context.socket(zmq.REQ)
-# socket.setsockopt(zmq.CONNECT_TIMEOUT, 2000)
-# socket.setsockopt(zmq.LINGER, 10)
-
-socket.connect("tcp://localhost:5555")
-
+SERVER_ADDRESS = "tcp://localhost:5555"
+TIMEOUT_IN_S = 5
+BUILD_POLL_INTERVAL_IN_S = 1
 
-def send_message_with_timeout(socket, msg):
-    # if the server is NOT up this send command will way forever!
-    # Time-out with python instead...
-    def term_handler():
-        raise Exception("no server")
-
-    signal.signal(signal.SIGALRM, term_handler)
-    signal.alarm(5)
-    failed = False
-    try:
+socket = context.socket(zmq.REQ)
+socket.setsockopt(zmq.LINGER, 0)
+socket.connect(SERVER_ADDRESS)
+# the tasks of an array share the socket from different threads
+socket_lock = threading.Lock()
+
+
+def send_message_with_timeout(msg):
+    """
+    :returns: (True, None) if the server did not reply in time, else
+        (False, reply)
+    """
+    global socket
+    with socket_lock:
         socket.send_json(msg)
-        result = message = socket.recv_json()
-        signal.alarm(0)
-    except Exception as exec:
-        failed = True
-
-    if failed:
-        console.fail("replik server is not up")
-        return True, None
-
-    return False, result
+        if socket.poll(timeout=TIMEOUT_IN_S * 1000) == 0:
+            # a REQ socket that waits for a reply can not send anymore
+            socket.close()
+            socket = context.socket(zmq.REQ)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.connect(SERVER_ADDRESS)
+            console.fail("replik server is not up")
+            return True, None
+        reply = socket.recv_json()
+    if reply["msg"] == MsgType.ERROR:
+        console.fail(f"replik server could not handle the request: {reply['error']}")
+        exit(0)
+    return False, reply
 
 
 def check_server_status():
-    timeout, msg = send_message_with_timeout(socket, get_is_alive_msg())
+    timeout, msg = send_message_with_timeout(get_is_alive_msg())
     return not timeout
 
 
 def request_uid(info):
-    timeout, msg = send_message_with_timeout(socket, get_request_uid_msg(info))
+    timeout, msg = send_message_with_timeout(get_request_uid_msg(info))
     if timeout:
         console.fail("Could not request uid: Timeout!")
         exit(0)
+    if msg["uid"] is None:
+        console.fail(f"Could not request uid: {msg['error']}")
+        exit(0)
 
     return msg["uid"], msg["container_name"], msg["mark"], msg["staging_mark"]
 
 
+def request_uids(infos):
+    """
+    submit all {infos} with a single request
+    :returns: [(uid, container_name, mark, staging_mark)], empty if the
+        server could not stage all of them
+    """
+    timeout, msg = send_message_with_timeout(get_request_uids_msg(infos))
+    if timeout:
+        console.fail("Could not request uids: Timeout!")
+        exit(0)
+    return [
+        (p["uid"], p["container_name"], p["mark"], p["staging_mark"])
+        for p in msg["procs"]
+    ]
+
+
+def request_build(dockerdir: str, dockerfile: str, tag: str) -> bool:
+    """
+    build the image {tag} on the server and wait for it, see {BuildQueue}.
+    Falls back to a local build if the server does not build images.
+    :returns: True if the image has been built
+    """
+    msg = get_request_build_msg(dockerdir, dockerfile, tag, const.get_username())
+    timeout, msg = send_message_with_timeout(msg)
+    if timeout:
+        console.fail("Could not request build: Timeout!")
+        exit(0)
+    if msg["build"] is None:
+        return build.build_image(dockerdir, dockerfile, tag)
+    build_id, state = msg["build"]["id"], None
+    while True:
+        if msg["build"] is None:
+            console.fail(f"build {build_id} is unknown to the server")
+            return False
+        if msg["build"]["state"] != state:
+            state = msg["build"]["state"]
+            console.info(f"build {build_id} of {tag}: {BuildState(state).name}")
+        if state in [BuildState.DONE, BuildState.FAILED]:
+            return state == BuildState.DONE
+        time.sleep(BUILD_POLL_INTERVAL_IN_S)
+        timeout, msg = send_message_with_timeout(get_request_build_state_msg(build_id))
+        if timeout:
+            console.fail("Could not request the build state: Timeout!")
+            exit(0)
+
+
+def subscribe_to_uid(uid):
+    """:returns: SUB socket that receives the state changes of {uid}"""
+    return subscribe(f"tcp://localhost:{EVENTS_PORT}", get_topic(uid), context=context)
+
+
+def subscribe_to_status():
+    """:returns: SUB socket that receives every change of the status"""
+    return subscribe(f"tcp://localhost:{EVENTS_PORT}", STATUS_TOPIC, context=context)
+
+
 def request_to_kill_uid(uid):
-    timeout, msg = send_message_with_timeout(socket, get_murder_msg(uid))
+    timeout, msg = send_message_with_timeout(get_murder_msg(uid))
     if timeout:
         console.fail("Could not kill uid: Timeout!")
         exit(0)
     console.warning(f"uid {uid} has been listed as 'unscheduled'")
 
 
-def request_server_infos():
-    timeout, msg = send_message_with_timeout(socket, get_request_status_msg())
+def request_to_kill(
+    uids=None, tag: str = None, username: str = None, array: str = None
+):
+    """
+    unschedule all {uids} and all processes with {tag}, of {username}
+    and/or of the job {array} with a single request
+    :returns: the unscheduled uids
+    """
+    timeout, msg = send_message_with_timeout(
+        get_murders_msg(uids, tag=tag, username=username, array=array)
+    )
+    if timeout:
+        console.fail("Could not kill uids: Timeout!")
+        exit(0)
+    console.warning(f"{len(msg['uids'])} uids have been listed as 'unscheduled'")
+    return msg["uids"]
+
+
+def notify_container_exit(uid):
+    """let the server re-schedule right away instead of at its next tick"""
+    send_message_with_timeout(get_notify_exit_msg(uid))
+
+
+def request_server_infos(version: int = None):
+    """
+    :param version: of the status the client already has
+    :returns: the status of the server or None if {version} is still current
+    """
+    timeout, msg = send_message_with_timeout(get_request_status_msg(version))
     if timeout:
         console.fail("Could not request uid: Timeout!")
         exit(0)
+    if msg["msg"] == MsgType.STATUS_NOT_MODIFIED:
+        return None
     return msg["status"]
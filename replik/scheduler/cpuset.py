@@ -0,0 +1,127 @@
+"""
+CPU topology of the machine: the cpus of every NUMA node. It is read from
+/sys/devices/system/node or from a json file that overrides it:
+{
+    "nodes": {"0": [0, 1, 2, 3], "1": [4, 5, 6, 7]}
+}
+"""
+import json
+from os import listdir
+from os.path import isdir, isfile, join
+from typing import Dict, List
+
+
+SYSFS_NODE_DIR = "/sys/devices/system/node"
+
+
+def parse_cpulist(cpulist: str) -> List[int]:
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if len(part) == 0:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus += list(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus: List[int]) -> str:
+    """[0, 1, 2, 3, 8, 10, 11] -> '0-3,8,10-11' as expected by --cpuset-cpus"""
+    parts = []
+    for cpu in sorted(cpus):
+        if len(parts) > 0 and parts[-1][1] == cpu - 1:
+            parts[-1][1] = cpu
+        else:
+            parts.append([cpu, cpu])
+    return ",".join(
+        str(first) if first == last else f"{first}-{last}" for first, last in parts
+    )
+
+
+class CpuTopology:
+    def __init__(self, nodes: Dict[int, List[int]]):
+        """
+        :param nodes: {numa node: [cpus]}
+        """
+        super().__init__()
+        self.nodes = dict(
+            (int(node), list(sorted(cpus))) for node, cpus in nodes.items()
+        )
+        self.node_of_cpu = {}
+        for node, cpus in self.nodes.items():
+            for cpu in cpus:
+                assert cpu not in self.node_of_cpu, f"cpu {cpu} is in two nodes"
+                self.node_of_cpu[cpu] = node
+
+    def __len__(self):
+        return len(self.node_of_cpu)
+
+    def cpus(self) -> List[int]:
+        return list(sorted(self.node_of_cpu.keys()))
+
+    def mems(self, cpus: List[int]) -> List[int]:
+        """the NUMA nodes of the {cpus}"""
+        return list(sorted(set(self.node_of_cpu[cpu] for cpu in cpus)))
+
+    def to_json(self):
+        return {"nodes": dict((str(node), cpus) for node, cpus in self.nodes.items())}
+
+
+def load_cpu_topology(fname: str) -> CpuTopology:
+    with open(fname, "r") as f:
+        topo = json.load(f)
+    return CpuTopology(nodes=topo["nodes"])
+
+
+def read_cpu_topology(node_dir: str = SYSFS_NODE_DIR) -> CpuTopology:
+    """
+    :returns: {CpuTopology} of this machine or None if the kernel does
+        not expose its NUMA nodes
+    """
+    if not isdir(node_dir):
+        return None
+    nodes = {}
+    for name in listdir(node_dir):
+        cpulist = join(node_dir, name, "cpulist")
+        if name.startswith("node") and name[4:].isdigit() and isfile(cpulist):
+            with open(cpulist, "r") as f:
+                cpus = parse_cpulist(f.read())
+            if len(cpus) > 0:
+                nodes[int(name[4:])] = cpus
+    if len(nodes) == 0:
+        return None
+    return CpuTopology(nodes=nodes)
+
+
+def select_cpus(
+    free_cpus: Dict[int, List[int]], n_cpus: int, preferred_nodes: List[int] = None
+) -> List[int]:
+    """
+    choose {n_cpus} of the {free_cpus} so that they span as few NUMA nodes as
+    possible. The {preferred_nodes} (e.g. the ones of the gpus of the
+    process) are filled first. Otherwise the smallest node that can hold all
+    {n_cpus} is used so that large nodes stay available for later.
+    :param free_cpus: {numa node: [free cpus]}
+    """
+    if preferred_nodes is None:
+        preferred_nodes = []
+    assert sum(len(cpus) for cpus in free_cpus.values()) >= n_cpus
+    nodes = [node for node in preferred_nodes if node in free_cpus]
+    others = [node for node in free_cpus.keys() if node not in nodes]
+    fitting = [node for node in others if len(free_cpus[node]) >= n_cpus]
+    if len(nodes) == 0 and len(fitting) > 0:
+        nodes = [min(fitting, key=lambda node: (len(free_cpus[node]), node))]
+    else:
+        nodes += sorted(others, key=lambda node: (-len(free_cpus[node]), node))
+
+    cpus = []
+    for node in nodes:
+        for cpu in free_cpus[node]:
+            if len(cpus) == n_cpus:
+                return cpus
+            cpus.append(cpu)
+    assert len(cpus) == n_cpus, f"n_cpus:{n_cpus}, {cpus}"
+    return cpus
@@ -0,0 +1,134 @@
+import unittest
+import json
+import tempfile
+from os import makedirs
+from os.path import join
+import replik.scheduler.cpuset as CPUSET
+import replik.scheduler.scheduler as SCHEDULER
+import replik.scheduler.resource_monitor as RESMON
+import replik.scheduler.schedule as SCHED
+from replik.scheduler.topology import GpuTopology
+from replik.scheduler.journal import Journal
+
+
+# two sockets with 4 cpus and 2 gpus each
+NODES = {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+GPU_TOPOLOGY = GpuTopology(
+    distances=[[0, 1, 2, 2], [1, 0, 2, 2], [2, 2, 0, 1], [2, 2, 1, 0]],
+    numa=[0, 0, 1, 1],
+)
+
+
+def fun_docker_kill(container_name):
+    pass
+
+
+class TestCpuset(unittest.TestCase):
+    def test_cpulist(self):
+        self.assertEqual([0, 1, 2, 3, 8, 10, 11], CPUSET.parse_cpulist("0-3,8,10-11\n"))
+        self.assertEqual([], CPUSET.parse_cpulist("\n"))
+        self.assertEqual("0-3,8,10-11", CPUSET.format_cpulist([11, 0, 1, 2, 3, 8, 10]))
+        self.assertEqual("", CPUSET.format_cpulist([]))
+
+    def test_read_cpu_topology(self):
+        tmp = tempfile.TemporaryDirectory()
+        for node, cpulist in [("node0", "0-3\n"), ("node1", "4-7\n"), ("node2", "\n")]:
+            makedirs(join(tmp.name, node))
+            with open(join(tmp.name, node, "cpulist"), "w") as f:
+                f.write(cpulist)
+        makedirs(join(tmp.name, "power"))
+
+        topology = CPUSET.read_cpu_topology(tmp.name)
+        self.assertEqual(NODES, topology.nodes)
+        self.assertEqual(8, len(topology))
+        self.assertEqual([0, 1], topology.mems([3, 4]))
+        self.assertIsNone(CPUSET.read_cpu_topology(join(tmp.name, "missing")))
+
+        # the override file
+        fname = join(tmp.name, "cpus.json")
+        with open(fname, "w") as f:
+            json.dump(topology.to_json(), f)
+        self.assertEqual(NODES, CPUSET.load_cpu_topology(fname).nodes)
+        tmp.cleanup()
+
+    def test_select_cpus(self):
+        free_cpus = {0: [1, 2, 3], 1: [4, 5, 6, 7]}
+        # the smallest node that holds all cpus
+        self.assertEqual([1, 2], CPUSET.select_cpus(free_cpus, 2))
+        self.assertEqual([4, 5, 6, 7], CPUSET.select_cpus(free_cpus, 4))
+        # the node of the gpus comes first
+        self.assertEqual([4, 5], CPUSET.select_cpus(free_cpus, 2, [1]))
+        # spill over onto the fullest other node
+        self.assertEqual([1, 2, 3, 4, 5], CPUSET.select_cpus(free_cpus, 5, [0]))
+
+    def test_resource_monitor(self):
+        mon = RESMON.ResourceMonitor(
+            cpu_count=8,
+            gpu_count=4,
+            mem_gb=100,
+            topology=GPU_TOPOLOGY,
+            cpu_topology=CPUSET.CpuTopology(NODES),
+        )
+        procs = []
+        for uid, (cpus, gpus) in enumerate([(2, [2]), (3, []), (3, [3])]):
+            proc = SCHED.ReplikProcess(
+                {"cpus": cpus, "gpus": len(gpus), "memory": "1g"}, uid
+            )
+            mon.add_process(proc, gpus)
+            procs.append(proc)
+
+        # gpu 2 is on node 1
+        self.assertEqual([4, 5], procs[0].cpuset)
+        # no gpus: the smallest node that holds all cpus
+        self.assertEqual([0, 1, 2], procs[1].cpuset)
+        # node 1 is full, the rest spills over
+        self.assertEqual([3, 6, 7], procs[2].cpuset)
+        self.assertEqual([0, 1], mon.get_mems(procs[2].cpuset))
+
+        mon.remove_process(procs[1])
+        self.assertEqual([], procs[1].cpuset)
+        self.assertEqual([None, None, None, 2, 0, 0, 2, 2], list(mon.cpus.values()))
+        self.assertFalse(mon.can_adopt([0], [2, 3]))
+        self.assertTrue(mon.can_adopt([0], [1, 2]))
+        self.assertFalse(mon.can_adopt([0], [8]))
+
+    def test_recover(self):
+        tmp = tempfile.TemporaryDirectory()
+        fname = join(tmp.name, "journal.jsonl")
+
+        def make_scheduler():
+            mon = RESMON.ResourceMonitor(
+                cpu_count=8,
+                gpu_count=4,
+                mem_gb=100,
+                topology=GPU_TOPOLOGY,
+                cpu_topology=CPUSET.CpuTopology(NODES),
+            )
+            return SCHEDULER.Scheduler(
+                mon, max_id=100, fun_docker_kill=fun_docker_kill, journal=Journal(fname)
+            )
+
+        scheduler = make_scheduler()
+        scheduler.recover([], current_time_in_s=0)
+        info = {"cpus": 2, "gpus": 1, "memory": "10g", "tag": "a"}
+        proc1 = scheduler.add_process_to_staging(info, cur_time_in_s=0)
+        proc2 = scheduler.add_process_to_staging(info, cur_time_in_s=0)
+        scheduler.scheduling_step([], current_time_in_s=1)
+        cpuset2 = proc2.cpuset
+        self.assertEqual(2, len(cpuset2))
+        with open(SCHEDULER.get_mark_file(proc2.uid), "r") as f:
+            mark = json.load(f)
+        self.assertEqual(cpuset2, mark["cpus"])
+        self.assertEqual(scheduler.resources.get_mems(cpuset2), mark["mems"])
+
+        # -- the server restarts, proc2 keeps its cpus --
+        scheduler = make_scheduler()
+        scheduler.recover([proc2.container_name()], current_time_in_s=2)
+        proc2_, _ = scheduler.RUNNING_QUEUE.get(proc2.uid)
+        self.assertEqual(cpuset2, proc2_.cpuset)
+        self.assertFalse(proc1.uid in scheduler.RUNNING_QUEUE)
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,15 +1,102 @@
 from subprocess import call
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
+import threading
+import json
 import time
+import replik.console as console
 
 
-def kill(container_name: str):
+CONTAINER_PREFIX = "replik_"
+
+
+def is_running(container_name: str) -> bool:
+    """:returns: False if the container has stopped or does not exist"""
+    r = subprocess.run(
+        ["docker", "inspect", "--format", "{{.State.Running}}", container_name],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    return r.returncode == 0 and r.stdout.decode("utf-8").strip() == "true"
+
+
+def kill(container_name: str, grace_period_in_s: float = 10):
+    """
+    run the killhook, give the container {grace_period_in_s} to exit by
+    itself and kill it otherwise. Returns once the container is gone and
+    raises if it is still running, e.g. because the daemon did not respond.
+    """
     call(
         f"docker exec -d {container_name} bash /home/user/docker/killhook.sh",
         shell=True,
     )
-    time.sleep(10)
+    try:
+        # `docker wait` returns as soon as the container has stopped
+        subprocess.run(
+            ["docker", "wait", container_name],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=grace_period_in_s,
+        )
+    except subprocess.TimeoutExpired:
+        pass
     call(f"docker kill {container_name}", shell=True)
+    subprocess.run(
+        ["docker", "wait", container_name],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    if is_running(container_name):
+        raise RuntimeError(f"{container_name} is still running")
+
+
+class KillExecutor:
+    """
+    Kills containers in parallel in the background so that the scheduler
+    does not need to hold its lock during the grace period.
+    """
+
+    def __init__(
+        self,
+        fun_docker_kill=kill,
+        max_workers: int = 8,
+        grace_period_in_s: float = 10,
+        retry_in_s: float = 10,
+        verbose: bool = False,
+    ):
+        """
+        :param fun_docker_kill: {function} (container_name, grace_period_in_s),
+            returns once the container is gone and raises otherwise
+        :param retry_in_s: time until a failed kill is tried again
+        """
+        super().__init__()
+        self.fun_docker_kill = fun_docker_kill
+        self.grace_period_in_s = grace_period_in_s
+        self.retry_in_s = retry_in_s
+        self.verbose = verbose
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="replik_kill"
+        )
+
+    def submit(self, container_name: str, on_done):
+        """
+        :param on_done: {function} called once the container is gone. A
+            failed kill is retried until it succeeds: the resources of the
+            container must not be handed out while it may still use them.
+        """
+
+        def kill_container():
+            while True:
+                try:
+                    self.fun_docker_kill(container_name, self.grace_period_in_s)
+                    break
+                except Exception as e:
+                    if self.verbose:
+                        console.fail(f"could not kill {container_name}: {e}")
+                time.sleep(self.retry_in_s)
+            on_done()
+
+        return self.pool.submit(kill_container)
 
 
 def get_running_container_names():
@@ -28,3 +115,130 @@ def get_running_container_names():
         )
         if len(f) > 0
     ]
+
+
+def stream_container_events():
+    """
+    start `docker events` right away and return a generator over its
+    container start/die/kill/oom events. The generator ends when the
+    stream is lost.
+    """
+    proc = subprocess.Popen(
+        [
+            "docker",
+            "events",
+            "--filter",
+            "type=container",
+            "--filter",
+            "event=start",
+            "--filter",
+            "event=die",
+            "--filter",
+            "event=kill",
+            "--filter",
+            "event=oom",
+            "--format",
+            "{{json .}}",
+        ],
+        stdout=subprocess.PIPE,
+    )
+
+    def events():
+        try:
+            for line in proc.stdout:
+                line = line.decode("utf-8").strip()
+                if len(line) > 0:
+                    yield json.loads(line)
+        finally:
+            proc.kill()
+
+    return events()
+
+
+class ContainerTracker(threading.Thread):
+    """
+    Keeps the set of live replik containers up-to-date from the docker
+    event stream. A full `docker ps` is only done at start-up and when
+    the event stream is lost.
+    """
+
+    def __init__(
+        self,
+        on_exit=None,
+        fun_event_stream=stream_container_events,
+        fun_list_containers=get_running_container_names,
+        retry_in_s: float = 1,
+        verbose: bool = False,
+    ):
+        """
+        :param on_exit: {function} called with the container name whenever
+            a replik container dies, gets killed or runs out of memory
+        :param fun_event_stream: {function} returning an iterator of docker events
+        :param fun_list_containers: {function} returning all running container names
+        """
+        super().__init__(daemon=True)
+        self.lock = threading.Lock()
+        self.on_exit = on_exit
+        self.fun_event_stream = fun_event_stream
+        self.fun_list_containers = fun_list_containers
+        self.retry_in_s = retry_in_s
+        self.verbose = verbose
+        self.live_containers = set()
+        self.n_resyncs = 0
+
+    def get_running_container_names(self):
+        """a copy of the names of all live replik containers"""
+        with self.lock:
+            return set(self.live_containers)
+
+    def resync(self):
+        live_containers = set(
+            name
+            for name in self.fun_list_containers()
+            if name.startswith(CONTAINER_PREFIX)
+        )
+        with self.lock:
+            self.live_containers = live_containers
+        self.n_resyncs += 1
+
+    def handle_event(self, event):
+        """
+        :param event: {dict} as produced by `docker events --format '{{json .}}'`
+        """
+        name = event["Actor"]["Attributes"]["name"].lower()
+        if not name.startswith(CONTAINER_PREFIX):
+            return
+        action = event["Action"] if "Action" in event else event["status"]
+        with self.lock:
+            if action == "start":
+                self.live_containers.add(name)
+            elif action == "die":
+                self.live_containers.discard(name)
+        # 'kill' and 'oom' are followed by 'die' once the container is gone
+        # but the scheduler should already know that it will lose it.
+        if action in ("die", "kill", "oom") and self.on_exit is not None:
+            self.on_exit(name)
+
+    def consume(self, events):
+        """handle all events of one stream, returns once the stream is lost"""
+        for event in events:
+            self.handle_event(event)
+
+    def follow_stream(self):
+        """full re-sync followed by consuming a new event stream until it is lost"""
+        # open the stream BEFORE listing the containers so that no
+        # event is lost in between
+        events = self.fun_event_stream()
+        self.resync()
+        self.consume(events)
+
+    def run(self):
+        while True:
+            try:
+                self.follow_stream()
+            except Exception as e:
+                if self.verbose:
+                    console.fail(f"docker event stream failed: {e}")
+            if self.verbose:
+                console.warning("docker event stream lost, re-sync...")
+            time.sleep(self.retry_in_s)
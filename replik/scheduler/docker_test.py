@@ -0,0 +1,92 @@
+import unittest
+import replik.scheduler.docker as DOCKER
+
+
+def event(action, name):
+    return {
+        "Type": "container",
+        "Action": action,
+        "Actor": {"Attributes": {"name": name}},
+    }
+
+
+class FakeEventStream:
+    """stands in for `docker events`: every call returns the next stream"""
+
+    def __init__(self, streams):
+        self.streams = list(streams)
+
+    def __call__(self):
+        if len(self.streams) == 0:
+            raise Exception("docker daemon is gone")
+        return iter(self.streams.pop(0))
+
+
+class TestContainerTracker(unittest.TestCase):
+    def test_events(self):
+        exited = []
+        tracker = DOCKER.ContainerTracker(
+            on_exit=exited.append,
+            fun_event_stream=FakeEventStream([]),
+            fun_list_containers=lambda: ["replik_00000001", "postgres"],
+        )
+        tracker.resync()
+        self.assertEqual({"replik_00000001"}, tracker.get_running_container_names())
+
+        tracker.consume(
+            [
+                event("start", "replik_00000002"),
+                event("start", "some_other_container"),
+                event("die", "some_other_container"),
+                event("oom", "replik_00000001"),
+                event("die", "replik_00000001"),
+            ]
+        )
+        self.assertEqual({"replik_00000002"}, tracker.get_running_container_names())
+        self.assertEqual(["replik_00000001", "replik_00000001"], exited)
+        self.assertEqual(1, tracker.n_resyncs)
+
+    def test_resync_on_stream_loss(self):
+        listings = [["replik_00000001"], ["replik_00000003"]]
+        tracker = DOCKER.ContainerTracker(
+            fun_event_stream=FakeEventStream(
+                [[event("start", "replik_00000002")], []]
+            ),
+            fun_list_containers=lambda: listings.pop(0),
+        )
+
+        tracker.follow_stream()
+        self.assertEqual(
+            {"replik_00000001", "replik_00000002"},
+            tracker.get_running_container_names(),
+        )
+
+        # the stream is lost: the next one starts with a full re-sync
+        tracker.follow_stream()
+        self.assertEqual({"replik_00000003"}, tracker.get_running_container_names())
+        self.assertEqual(2, tracker.n_resyncs)
+
+        with self.assertRaises(Exception):
+            tracker.follow_stream()
+
+
+class TestKillExecutor(unittest.TestCase):
+    def test_retry_failed_kill(self):
+        attempts = []
+
+        def fun_docker_kill(container_name, grace_period_in_s):
+            attempts.append(container_name)
+            if len(attempts) < 3:
+                raise RuntimeError("docker daemon did not respond")
+
+        done = []
+        executor = DOCKER.KillExecutor(fun_docker_kill=fun_docker_kill, retry_in_s=0.01)
+        future = executor.submit("replik_00000001", on_done=lambda: done.append(True))
+        future.result(timeout=5)
+        # the container is only released once it is known to be gone
+        self.assertEqual(["replik_00000001"] * 3, attempts)
+        self.assertEqual([True], done)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,18 @@
+import replik.console as console
+import replik.images as images
+from replik.scheduler.client import check_server_status, request_server_infos
+
+
+def execute(budget: str):
+    """
+    `replik gc`: remove the least recently used images until all images fit
+    into the {budget}, see {images.collect}
+    :param budget: e.g. "100G"
+    """
+    protected = []
+    if check_server_status():
+        protected = images.get_protected_tags(request_server_infos())
+    else:
+        console.warning("only the images of existing containers are protected")
+    removed = images.collect(images.parse_size(budget), protected, verbose=True)
+    console.success(f"removed {len(removed)} images")
@@ -0,0 +1,136 @@
+"""
+Append-only journal of all queue transitions of the scheduler so that
+a restarted server can recover its staging and running queues.
+Each line is a json object:
+    {"op": "stage", "uid": 1, "t": 0.0, "info": {...}}
+    {"op": "run", "uid": 1, "t": 0.0, "gpus": [0, 1], "cpus": [0, 1, 2, 3]}
+    {"op": "gone", "uid": 1}
+"""
+import json
+import os
+from os.path import isfile
+from typing import Dict
+
+
+class Journal:
+    def __init__(self, fname: str, compact_after: int = 100000):
+        """
+        :param fname: journal file, it is created if it does not exist
+        :param compact_after: rewrite the journal once it has that many
+            more records than live processes
+        """
+        super().__init__()
+        self.fname = fname
+        self.compact_after = compact_after
+        self.buffer = []
+        self.n_records = 0
+        self.f = None
+
+    def open(self):
+        self.f = open(self.fname, "a")
+
+    def close(self):
+        self.flush()
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def record_staging(self, proc):
+        self.buffer.append(
+            {
+                "op": "stage",
+                "uid": proc.uid,
+                "t": proc.staging_started_time,
+                "info": proc.info,
+            }
+        )
+
+    def record_running(self, proc, gpus):
+        self.buffer.append(
+            {
+                "op": "run",
+                "uid": proc.uid,
+                "t": proc.running_started_time,
+                "gpus": gpus,
+                "cpus": proc.cpuset,
+            }
+        )
+
+    def record_gone(self, uid: int):
+        self.buffer.append({"op": "gone", "uid": uid})
+
+    def flush(self):
+        """write all buffered records with a single fsync"""
+        if len(self.buffer) == 0:
+            return
+        if self.f is None:
+            self.open()
+        self.f.write("".join(json.dumps(record) + "\n" for record in self.buffer))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.n_records += len(self.buffer)
+        self.buffer = []
+
+    def needs_compaction(self, n_live: int):
+        return self.n_records > n_live + self.compact_after
+
+    def replay(self) -> Dict:
+        """
+        :returns: {uid: {"place": "stage"|"run", "t", "info", "gpus", "cpus", "run_t"}}
+            of all processes that are still alive, in the order they were
+            (re-)staged. "gpus", "cpus" and "run_t" are from the last time it ran.
+        """
+        state = {}
+        if not isfile(self.fname):
+            return state
+        with open(self.fname, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    break  # the last line was not written completely
+                uid = record["uid"]
+                if record["op"] == "stage":
+                    entry = state.pop(uid, {"gpus": [], "cpus": []})
+                    entry["place"] = "stage"
+                    entry["t"] = record["t"]
+                    entry["info"] = record["info"]
+                    state[uid] = entry  # re-staged processes go to the end
+                elif record["op"] == "run" and uid in state:
+                    entry = state[uid]
+                    entry["place"] = "run"
+                    entry["t"] = record["t"]
+                    entry["run_t"] = record["t"]
+                    entry["gpus"] = record["gpus"]
+                    entry["cpus"] = record["cpus"] if "cpus" in record else []
+                elif record["op"] == "gone":
+                    state.pop(uid, None)
+        return state
+
+    def compact(self, staging, running):
+        """
+        atomically replace the journal with the current state only
+        :param staging: [{proc}]
+        :param running: [({proc}, {gpus})]
+        """
+        self.buffer = []
+        for proc in staging:
+            self.record_staging(proc)
+        for proc, gpus in running:
+            self.buffer.append(
+                {"op": "stage", "uid": proc.uid, "t": -1, "info": proc.info}
+            )
+            self.record_running(proc, gpus)
+        tmp_fname = self.fname + ".tmp"
+        with open(tmp_fname, "w") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in self.buffer))
+            f.flush()
+            os.fsync(f.fileno())
+        was_open = self.f is not None
+        if was_open:
+            self.f.close()
+        os.replace(tmp_fname, self.fname)
+        self.n_records = len(self.buffer)
+        self.buffer = []
+        if was_open:
+            self.open()
@@ -0,0 +1,79 @@
+import unittest
+import tempfile
+from os.path import join, isfile
+import replik.scheduler.scheduler as SCHEDULER
+import replik.scheduler.schedule as SCHED
+from replik.scheduler.resource_monitor import ResourceMonitor
+from replik.scheduler.journal import Journal
+
+
+def fun_docker_kill(container_name):
+    pass
+
+
+class TestJournal(unittest.TestCase):
+    def test_recover(self):
+        tmp = tempfile.TemporaryDirectory()
+        fname = join(tmp.name, "journal.jsonl")
+
+        mon = ResourceMonitor(cpu_count=10, gpu_count=2, mem_gb=100)
+        scheduler = SCHEDULER.Scheduler(
+            mon, max_id=100, fun_docker_kill=fun_docker_kill, journal=Journal(fname)
+        )
+        self.assertEqual((0, 0), scheduler.recover([], current_time_in_s=0))
+
+        info = {"cpus": 1, "gpus": 1, "memory": "10g", "tag": "a"}
+        proc1 = scheduler.add_process_to_staging(info, cur_time_in_s=0)
+        proc2 = scheduler.add_process_to_staging(info, cur_time_in_s=0)
+        proc3 = scheduler.add_process_to_staging(info, cur_time_in_s=1)
+        proc4 = scheduler.add_process_to_staging(info, cur_time_in_s=2)
+        scheduler.scheduling_step([], current_time_in_s=5)
+        scheduler.schedule_uid_for_killing(proc3.uid)
+        scheduler.scheduling_step([], current_time_in_s=6)
+        gpus1 = scheduler.RUNNING_QUEUE.get(proc1.uid)[1]
+        gpus2 = scheduler.RUNNING_QUEUE.get(proc2.uid)[1]
+        # current status:
+        # RUNNING: [p1, p2]
+        # STAGING: [p4]
+
+        # -- the server crashes, only proc1 survives --
+        mon = ResourceMonitor(cpu_count=10, gpu_count=2, mem_gb=100)
+        scheduler = SCHEDULER.Scheduler(
+            mon, max_id=100, fun_docker_kill=fun_docker_kill, journal=Journal(fname)
+        )
+        n_staging, n_running = scheduler.recover(
+            [proc1.container_name(), "postgres"], current_time_in_s=100
+        )
+        self.assertEqual(1, n_staging)
+        self.assertEqual(1, n_running)
+
+        proc1_, gpus = scheduler.RUNNING_QUEUE.get(proc1.uid)
+        self.assertEqual(gpus1, gpus)
+        self.assertEqual(5, proc1_.running_started_time)
+        self.assertTrue(isfile(SCHEDULER.get_mark_file(proc1.uid)))
+        self.assertEqual(1, mon.get_current_free_resources().gpu_count)
+
+        proc4_ = scheduler.STAGING_QUEUE.get(proc4.uid)
+        self.assertEqual(SCHED.Place.STAGING, proc4_.place)
+        self.assertEqual(2, proc4_.staging_started_time)
+        self.assertTrue(isfile(SCHEDULER.get_mark_file_staging(proc4.uid)))
+
+        # uids of recovered processes are not handed out again
+        proc5 = scheduler.add_process_to_staging(info, cur_time_in_s=101)
+        self.assertFalse(proc5.uid in [proc1.uid, proc4.uid])
+        self.assertEqual(3, len(scheduler.USED_IDS))
+
+        # proc4 now gets the gpu of proc2 that has not survived
+        scheduler.scheduling_step([proc1.container_name()], current_time_in_s=102)
+        self.assertEqual(gpus2, scheduler.RUNNING_QUEUE.get(proc4.uid)[1])
+
+        # the compacted journal still has everything
+        state = Journal(fname).replay()
+        self.assertEqual(
+            list(sorted([proc1.uid, proc4.uid, proc5.uid])), list(sorted(state.keys()))
+        )
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,23 +9,82 @@ class MsgType(IntEnum):
     REQUEST_MURDER = 4
     REQUEST_STATUS = 5  # current server situation
     RESPOND_STATUS = 6
+    NOTIFY_EXIT = 7  # a client's container has exited
+    STATUS_NOT_MODIFIED = 8  # the client's status version is still current
+    REQUEST_UIDS = 9  # submit many processes at once
+    SEND_UIDS = 10
+    REQUEST_MURDERS = 11  # unschedule many processes at once
+    RESPOND_MURDERS = 12
+    REQUEST_BUILD = 13  # build an image on the server
+    SEND_BUILD = 14  # state of a build
+    REQUEST_BUILD_STATE = 15
+    ERROR = 16  # the server could not handle the request
 
 
 def get_is_alive_msg():
     return {"msg": MsgType.ALIVE}
 
 
-def get_request_status_msg():
-    return {"msg": MsgType.REQUEST_STATUS}
+def get_error_msg(error: str):
+    return {"msg": MsgType.ERROR, "error": error}
+
+
+def get_request_status_msg(version: int = None):
+    """
+    :param version: of the status the client already has, the server only
+        replies with {MsgType.STATUS_NOT_MODIFIED} if it is still current
+    """
+    if version is None:
+        return {"msg": MsgType.REQUEST_STATUS}
+    return {"msg": MsgType.REQUEST_STATUS, "version": version}
 
 
 def get_murder_msg(uid):
     return {"msg": MsgType.REQUEST_MURDER, "uid": uid}
 
 
+def get_notify_exit_msg(uid):
+    return {"msg": MsgType.NOTIFY_EXIT, "uid": uid}
+
+
 def get_request_uid_msg(info):
     return {"msg": MsgType.REQUEST_UID, "info": info}
 
 
+def get_request_uids_msg(infos):
+    return {"msg": MsgType.REQUEST_UIDS, "infos": infos}
+
+
+def get_murders_msg(
+    uids=None, tag: str = None, username: str = None, array: str = None
+):
+    """
+    unschedule all {uids} and all processes with {tag}, of {username}
+    and/or of the job {array}
+    """
+    return {
+        "msg": MsgType.REQUEST_MURDERS,
+        "uids": [] if uids is None else uids,
+        "tag": tag,
+        "username": username,
+        "array": array,
+    }
+
+
+def get_request_build_msg(dockerdir: str, dockerfile: str, tag: str, username: str):
+    """:param dockerfile: generated Dockerfile, {dockerdir} is the context"""
+    return {
+        "msg": MsgType.REQUEST_BUILD,
+        "dockerdir": dockerdir,
+        "dockerfile": dockerfile,
+        "tag": tag,
+        "username": username,
+    }
+
+
+def get_request_build_state_msg(build_id: int):
+    return {"msg": MsgType.REQUEST_BUILD_STATE, "build_id": build_id}
+
+
 def get_msg_type(msg):
     return msg["msg"]
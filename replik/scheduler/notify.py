@@ -0,0 +1,131 @@
+"""
+Publishes the state changes of every process on a PUB socket so that
+waiting clients do not have to poll their mark files. Each event is a
+two-frame message: the topic of the uid and a json object
+    {"uid": 1, "event": JobEvent.RUNNING, "gpus": [0], "cpus": [0, 1], "mems": [0]}
+Clients subscribe to the topic of their own uid, see {subscribe}.
+Every new version of the status is published as a delta on {STATUS_TOPIC},
+see {Scheduler.get_status_delta} and {apply_status_delta}.
+"""
+import zmq
+import json
+from enum import IntEnum
+
+
+EVENTS_PORT = 5556
+STATUS_TOPIC = b"status"
+
+
+class JobEvent(IntEnum):
+    STAGED = 1  # submitted
+    RUNNING = 2  # placed, the client may start its container
+    PREEMPTED = 3  # killed to make room, back in staging
+    KILLED = 4  # unscheduled, the client should give up
+
+
+def get_topic(uid: int) -> bytes:
+    """fixed width so that subscribing to uid 1 does not match uid 12"""
+    return b"%09d" % uid
+
+
+class Notifier:
+    """
+    Buffers the events of a scheduling step and publishes them with {flush},
+    after the journal has been written. It is only used while the scheduler
+    lock is held, so the socket is never used by two threads at once.
+    """
+
+    def __init__(self, address: str, context: zmq.Context = None):
+        """
+        :param address: e.g. "tcp://*:5556", a "*" port binds a random port
+        """
+        super().__init__()
+        self.context = zmq.Context.instance() if context is None else context
+        self.socket = self.context.socket(zmq.PUB)
+        self.socket.bind(address)
+        self.address = self.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        self.buffer = []
+
+    def close(self):
+        self.socket.close()
+
+    def record_staged(self, proc):
+        self.buffer.append({"uid": proc.uid, "event": JobEvent.STAGED})
+
+    def record_running(self, proc, gpus, mems):
+        self.buffer.append(
+            {
+                "uid": proc.uid,
+                "event": JobEvent.RUNNING,
+                "gpus": gpus,
+                "cpus": proc.cpuset,
+                "mems": mems,
+            }
+        )
+
+    def record_preempted(self, proc):
+        self.buffer.append({"uid": proc.uid, "event": JobEvent.PREEMPTED})
+
+    def record_killed(self, uid: int):
+        self.buffer.append({"uid": uid, "event": JobEvent.KILLED})
+
+    def record_status(self, delta):
+        self.buffer.append(delta)
+
+    def flush(self):
+        for event in self.buffer:
+            topic = get_topic(event["uid"]) if "uid" in event else STATUS_TOPIC
+            self.socket.send_multipart([topic, json.dumps(event).encode()])
+        self.buffer = []
+
+
+def subscribe(address: str, topic: bytes, context: zmq.Context = None):
+    """
+    :param topic: {get_topic} of a uid or {STATUS_TOPIC}
+    :returns: SUB socket that receives the events of {topic}
+    """
+    context = zmq.Context.instance() if context is None else context
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.SUBSCRIBE, topic)
+    socket.connect(address)
+    return socket
+
+
+def wait_for_event(socket, timeout_in_s: float):
+    """:returns: the next event on the subscribed {socket} or None on timeout"""
+    if socket.poll(timeout=int(timeout_in_s * 1000)) == 0:
+        return None
+    _, event = socket.recv_multipart()
+    return json.loads(event)
+
+
+def apply_status_delta(status, delta):
+    """
+    :param status: full status of the version {delta["base"]}, it is changed
+        in place: "running" and "staging" become {uid: entry}
+    :returns: False if the {delta} does not follow {status}, e.g. because
+        a delta has been missed: the full status has to be requested again
+    """
+    if delta["base"] != status["version"]:
+        return False
+    for place in ["running", "staging"]:
+        if isinstance(status[place], list):
+            status[place] = dict((e["info"]["uid"], e) for e in status[place])
+    moved = [entry["info"]["uid"] for entry in delta["running"] + delta["staging"]]
+    for uid in delta["removed"] + moved:
+        status["running"].pop(uid, None)
+        status["staging"].pop(uid, None)
+    for place in ["running", "staging"]:
+        for entry in delta[place]:
+            status[place][entry["info"]["uid"]] = entry
+    for key in [
+        "version",
+        "free",
+        "total",
+        "killing",
+        "placement_latency",
+        "fragmentation",
+        "builds",
+    ]:
+        status[key] = delta[key]
+    return True
@@ -0,0 +1,134 @@
+import unittest
+import time
+import zmq
+from replik.scheduler.notify import (
+    STATUS_TOPIC,
+    JobEvent,
+    Notifier,
+    apply_status_delta,
+    get_topic,
+    subscribe,
+    wait_for_event,
+)
+from replik.scheduler.resource_monitor import ResourceMonitor
+from replik.scheduler.scheduler import Scheduler
+
+
+class TestNotify(unittest.TestCase):
+    def test_events(self):
+        context = zmq.Context()
+        notifier = Notifier("tcp://127.0.0.1:*", context=context)
+        mon = ResourceMonitor(cpu_count=4, gpu_count=1, mem_gb=100)
+        scheduler = Scheduler(
+            mon, max_id=10, fun_docker_kill=lambda name: None, notifier=notifier
+        )
+        sockets = [
+            subscribe(notifier.address, get_topic(uid), context=context)
+            for uid in [0, 1]
+        ]
+        time.sleep(0.2)  # subscriptions are not instant
+
+        info = {"cpus": 1, "gpus": 1, "memory": "1g"}
+        proc0 = scheduler.add_process_to_staging(info, cur_time_in_s=0)
+        scheduler.scheduling_step([], current_time_in_s=0)
+        proc1 = scheduler.add_process_to_staging(info, cur_time_in_s=1)
+
+        def events(socket):
+            result = []
+            event = wait_for_event(socket, timeout_in_s=1)
+            while event is not None:
+                result.append(event)
+                event = wait_for_event(socket, timeout_in_s=0.1)
+            return result
+
+        received = events(sockets[0])
+        self.assertEqual(
+            [JobEvent.STAGED, JobEvent.RUNNING], [e["event"] for e in received]
+        )
+        self.assertEqual([0], received[1]["gpus"])
+        self.assertEqual([JobEvent.STAGED], [e["event"] for e in events(sockets[1])])
+
+        # proc0 has run long enough and makes room for proc1
+        time_in_s = 2 * 3600
+        scheduler.scheduling_step([proc0.container_name()], time_in_s)
+        self.assertEqual(
+            [JobEvent.PREEMPTED], [e["event"] for e in events(sockets[0])]
+        )
+        self.assertEqual([JobEvent.RUNNING], [e["event"] for e in events(sockets[1])])
+
+        scheduler.schedule_uid_for_killing(proc0.uid)
+        scheduler.scheduling_step([proc1.container_name()], time_in_s + 1)
+        self.assertEqual([JobEvent.KILLED], [e["event"] for e in events(sockets[0])])
+
+        for socket in sockets:
+            socket.close()
+        notifier.close()
+        context.term()
+
+    def test_status_deltas(self):
+        mon = ResourceMonitor(cpu_count=8, gpu_count=2, mem_gb=100)
+        scheduler = Scheduler(mon, max_id=100, fun_docker_kill=lambda name: None)
+        watched = dict(scheduler.get_resources_infos_as_json())
+
+        def follow():
+            """apply the latest delta and compare with the full status"""
+            delta = scheduler.status_delta
+            self.assertTrue(apply_status_delta(watched, delta))
+            status = scheduler.get_resources_infos_as_json()
+            self.assertEqual(status["version"], watched["version"])
+            for place in ["running", "staging"]:
+                self.assertEqual(status[place], list(watched[place].values()))
+            return delta
+
+        info = {"cpus": 1, "gpus": 1, "memory": "1g"}
+        procs = []
+        for i in range(20):
+            procs.append(scheduler.add_process_to_staging(info, cur_time_in_s=i))
+            delta = follow()
+        # only the new process is sent
+        self.assertEqual(1, len(delta["staging"]))
+        self.assertEqual([], delta["running"] + delta["removed"])
+
+        scheduler.scheduling_step([], current_time_in_s=20)
+        delta = follow()
+        self.assertEqual([0, 1], [e["info"]["uid"] for e in delta["running"]])
+
+        # preemption: two processes move back, two others start
+        containers = [procs[0].container_name(), procs[1].container_name()]
+        scheduler.scheduling_step(containers, current_time_in_s=2 * 3600)
+        delta = follow()
+        self.assertEqual([2, 3], [e["info"]["uid"] for e in delta["running"]])
+        self.assertEqual([0, 1], sorted(e["info"]["uid"] for e in delta["staging"]))
+
+        for uid in [2, 5]:
+            scheduler.schedule_uid_for_killing(uid)
+        scheduler.scheduling_step(containers, current_time_in_s=2 * 3600 + 1)
+        delta = follow()
+        self.assertEqual([5], delta["removed"])
+
+        # a missed delta is detected
+        scheduler.add_process_to_staging(info, cur_time_in_s=0)
+        scheduler.add_process_to_staging(info, cur_time_in_s=0)
+        self.assertFalse(apply_status_delta(watched, scheduler.status_delta))
+
+    def test_status_topic(self):
+        context = zmq.Context()
+        notifier = Notifier("tcp://127.0.0.1:*", context=context)
+        mon = ResourceMonitor(cpu_count=4, gpu_count=1, mem_gb=100)
+        scheduler = Scheduler(
+            mon, max_id=10, fun_docker_kill=lambda name: None, notifier=notifier
+        )
+        socket = subscribe(notifier.address, STATUS_TOPIC, context=context)
+        time.sleep(0.2)
+        scheduler.add_process_to_staging({"cpus": 1, "gpus": 0, "memory": "1g"})
+        delta = wait_for_event(socket, timeout_in_s=1)
+        status = scheduler.get_resources_infos_as_json()
+        self.assertEqual(status["version"], delta["version"])
+        self.assertEqual(1, len(delta["staging"]))
+        socket.close()
+        notifier.close()
+        context.term()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Placement policies decide in which order the staging processes are
+considered and whether a process that fits should actually be placed.
+"""
+from typing import List
+
+
+def dominant_share(res, maximal_resources) -> float:
+    """largest fraction of the machine that {res} requests in any dimension"""
+    shares = []
+    if maximal_resources.cpu_count > 0:
+        shares.append(res.cpus / maximal_resources.cpu_count)
+    if maximal_resources.gpu_count > 0:
+        shares.append(res.gpus / maximal_resources.gpu_count)
+    if maximal_resources.mem_gb > 0:
+        shares.append(res.memory / maximal_resources.mem_gb)
+    return max(shares) if len(shares) > 0 else 0
+
+
+def stranded_gpus(available_resources, maximal_resources) -> float:
+    """
+    free gpus that cannot be used as there are not enough cpus/memory
+    left to give them their fair share of the machine
+    """
+    if maximal_resources.gpu_count == 0 or available_resources.gpu_count <= 0:
+        return 0
+    cpus_per_gpu = maximal_resources.cpu_count / maximal_resources.gpu_count
+    mem_per_gpu = maximal_resources.mem_gb / maximal_resources.gpu_count
+    reachable = min(
+        available_resources.gpu_count,
+        max(available_resources.cpu_count, 0) / cpus_per_gpu,
+        max(available_resources.mem_gb, 0) / mem_per_gpu,
+    )
+    return available_resources.gpu_count - reachable
+
+
+def fragmentation(available_resources, maximal_resources) -> float:
+    """fraction of all gpus that are free but stranded"""
+    if maximal_resources.gpu_count == 0:
+        return 0
+    return stranded_gpus(available_resources, maximal_resources) / (
+        maximal_resources.gpu_count
+    )
+
+
+class PlacementPolicy:
+    """
+    FIFO-greedy: processes are considered in queue order and every
+    process that fits is placed.
+    """
+
+    reorders = False
+
+    def score(self, proc, maximal_resources) -> float:
+        """processes with lower scores are considered first"""
+        return 0
+
+    def accepts(self, proc, available_resources, maximal_resources) -> bool:
+        return available_resources.fits(proc.resources)
+
+    def order(self, staging: List, maximal_resources) -> List:
+        if not self.reorders:
+            return staging
+        # sorting is stable: equal scores keep their queue order
+        return list(sorted(staging, key=lambda p: self.score(p, maximal_resources)))
+
+
+class DominantResourceBestFit(PlacementPolicy):
+    """
+    best-fit decreasing: processes with the largest dominant share are
+    placed first so that small processes fill the remaining holes.
+    """
+
+    reorders = True
+
+    def score(self, proc, maximal_resources) -> float:
+        return -dominant_share(proc.resources, maximal_resources)
+
+
+class KeepGpusReachable(PlacementPolicy):
+    """
+    Processes without gpus may only be placed if every free gpu keeps
+    {share} of its fair amount of cpus and memory.
+    """
+
+    def __init__(self, policy: PlacementPolicy = None, share: float = 0.5):
+        """
+        :param policy: {PlacementPolicy} that decides the order, FIFO by default
+        """
+        super().__init__()
+        self.policy = PlacementPolicy() if policy is None else policy
+        self.share = share
+        self.reorders = self.policy.reorders
+
+    def score(self, proc, maximal_resources) -> float:
+        return self.policy.score(proc, maximal_resources)
+
+    def accepts(self, proc, available_resources, maximal_resources) -> bool:
+        if not self.policy.accepts(proc, available_resources, maximal_resources):
+            return False
+        if proc.resources.gpus > 0 or maximal_resources.gpu_count == 0:
+            return True
+        left = available_resources.subtract(proc.resources)
+        n_gpus = left.gpu_count
+        cpus_per_gpu = maximal_resources.cpu_count / maximal_resources.gpu_count
+        mem_per_gpu = maximal_resources.mem_gb / maximal_resources.gpu_count
+        return (
+            left.cpu_count >= n_gpus * cpus_per_gpu * self.share
+            and left.mem_gb >= n_gpus * mem_per_gpu * self.share
+        )
+
+
+def get_policy(name: str) -> PlacementPolicy:
+    """
+    :param name: fifo | best_fit | fifo+keep_gpus | best_fit+keep_gpus
+    """
+    if name == "fifo":
+        return PlacementPolicy()
+    elif name == "best_fit":
+        return DominantResourceBestFit()
+    elif name == "fifo+keep_gpus":
+        return KeepGpusReachable(PlacementPolicy())
+    elif name == "best_fit+keep_gpus":
+        return KeepGpusReachable(DominantResourceBestFit())
+    raise ValueError(f"unknown placement policy '{name}'")
@@ -1,6 +1,12 @@
 import multiprocessing
+import time
 from typing import List
 from copy import deepcopy
+from replik.scheduler.placement import PlacementPolicy, fragmentation
+from replik.scheduler.topology import GpuTopology, select_gpus
+from replik.scheduler.cpuset import CpuTopology, select_cpus
+from replik.scheduler.uid_queue import UidQueue
+from replik.scheduler.staging_queue import StagingQueue
 
 
 def get_system_memory_gb():
@@ -60,11 +66,35 @@ class FreeResources:
         n_gpu = self.gpu_count + res.gpus
         return FreeResources(n_cpu, n_gpu, mem_gb)
 
+    def take(self, res: Resources):
+        """remove the resources in-place"""
+        self.mem_gb -= res.memory
+        self.cpu_count -= res.cpus
+        self.gpu_count -= res.gpus
+
+    def give(self, res: Resources):
+        """add back the resources in-place"""
+        self.mem_gb += res.memory
+        self.cpu_count += res.cpus
+        self.gpu_count += res.gpus
+
+    def copy(self):
+        return FreeResources(self.cpu_count, self.gpu_count, self.mem_gb)
+
     def fits(self, res: Resources):
-        mem_gb = self.mem_gb - res.memory
-        n_cpu = self.cpu_count - res.cpus
-        n_gpu = self.gpu_count - res.gpus
-        return mem_gb >= 0 and n_cpu >= 0 and n_gpu >= 0
+        # comparisons only: checking a fit allocates nothing
+        return (
+            res.memory <= self.mem_gb
+            and res.cpus <= self.cpu_count
+            and res.gpus <= self.gpu_count
+        )
+
+    def __eq__(self, other):
+        return (
+            self.cpu_count == other.cpu_count
+            and self.gpu_count == other.gpu_count
+            and self.mem_gb == other.mem_gb
+        )
 
     def __str__(self):
         return f"cpu {self.cpu_count}, gpu: {self.gpu_count}, mem: {self.mem_gb}"
@@ -74,30 +104,114 @@ class FreeResources:
 
 
 class ResourceMonitor:
-    def __init__(self, cpu_count: int, gpu_count: int, mem_gb: int, memory_factor=0.80):
+    def __init__(
+        self,
+        cpu_count: int,
+        gpu_count: int,
+        mem_gb: int,
+        memory_factor=0.80,
+        backfill: bool = False,
+        policy: PlacementPolicy = None,
+        topology: GpuTopology = None,
+        cpu_topology: CpuTopology = None,
+        debug: bool = False,
+    ):
         """
         :param memory_factor: down-sizing factor to ensure that there's some mem left on the machine
+        :param backfill: if True, the first staging process that does not fit gets
+            a reservation and later processes may only be scheduled if they do not
+            delay it (EASY backfilling). Otherwise any process that fits is scheduled.
+        :param policy: {PlacementPolicy} deciding the order in which the staging
+            processes are considered, FIFO-greedy by default
+        :param topology: {GpuTopology}, if given multi-gpu processes get the gpus
+            with the smallest interconnect distance. Otherwise the first free gpus.
+        :param cpu_topology: {CpuTopology}, if given every process is pinned to
+            its own cpus, close to its gpus. Otherwise processes are not pinned.
+        :param debug: if True, the used resources are re-computed from all
+            processes after every change and compared to the running counters
         """
         super().__init__()
+        self.backfill = backfill
+        self.policy = PlacementPolicy() if policy is None else policy
+        if topology is not None:
+            assert len(topology) == gpu_count, f"topology needs {gpu_count} gpus"
+        self.topology = topology
+        if cpu_topology is not None:
+            assert (
+                len(cpu_topology) == cpu_count
+            ), f"cpu topology needs {cpu_count} cpus"
+        self.cpu_topology = cpu_topology
 
         self.maximal_resources = FreeResources(
             cpu_count=cpu_count, gpu_count=gpu_count, mem_gb=mem_gb * memory_factor
         )
 
+        self.debug = debug
+        # running counters of the resources of all {current_processes}, they
+        # are integers so that adding and removing processes is exact
+        self.used_resources = FreeResources(cpu_count=0, gpu_count=0, mem_gb=0)
+
         self.current_processes = {}
         self.gpus = [None] * gpu_count
+        self.cpus = (
+            {} if cpu_topology is None else dict((i, None) for i in cpu_topology.cpus())
+        )
 
-    def add_process(self, process, gpus: List[int]):
+    def add_process(self, process, gpus: List[int], cpus: List[int] = None):
         """
         This is adding the process without checking that it fits!
         This has to be taken care of before!!
         :param process: {replik.scheduler.ReplikProcess}
+        :param cpus: the cpus to pin the process to (e.g. when it is re-adopted),
+            if None they are chosen close to the {gpus}. Ignored without a
+            cpu topology.
         """
         assert process.uid not in self.current_processes
         for gpuid in gpus:
             assert self.gpus[gpuid] == None
             self.gpus[gpuid] = process.uid
+        if self.cpu_topology is not None:
+            if cpus is None:
+                cpus = self.select_cpus(process.resources.cpus, gpus)
+            for cpuid in cpus:
+                assert self.cpus[cpuid] == None
+                self.cpus[cpuid] = process.uid
+            process.cpuset = list(sorted(cpus))
         self.current_processes[process.uid] = process
+        self.used_resources.give(process.resources)
+        if self.debug:
+            self.check_consistency()
+
+    def select_cpus(self, n_cpus: int, gpus: List[int]) -> List[int]:
+        """free cpus for a new process, on the NUMA nodes of its {gpus} if possible"""
+        free_cpus = {}
+        for cpuid, uid in self.cpus.items():
+            if uid == None:
+                node = self.cpu_topology.node_of_cpu[cpuid]
+                free_cpus.setdefault(node, []).append(cpuid)
+        preferred_nodes = []
+        if self.topology is not None:
+            for gpuid in gpus:
+                if self.topology.numa[gpuid] not in preferred_nodes:
+                    preferred_nodes.append(self.topology.numa[gpuid])
+        return select_cpus(free_cpus, n_cpus, preferred_nodes)
+
+    def get_mems(self, cpus: List[int]) -> List[int]:
+        """NUMA nodes the memory of a process pinned to {cpus} is allocated on"""
+        if self.cpu_topology is None:
+            return []
+        return self.cpu_topology.mems(cpus)
+
+    def can_adopt(self, gpus: List[int], cpus: List[int] = None):
+        """check if these gpus (and cpus) exist and are free"""
+        for gpuid in gpus:
+            if gpuid < 0 or gpuid >= len(self.gpus) or self.gpus[gpuid] != None:
+                return False
+        if self.cpu_topology is not None and cpus is not None:
+            for cpuid in cpus:
+                if cpuid not in self.cpus or self.cpus[cpuid] != None:
+                    return False
+        return True
 
     def remove_process(self, process):
         """Remove a process"""
@@ -105,45 +219,132 @@ class ResourceMonitor:
         for gpuid in range(len(self.gpus)):
             if self.gpus[gpuid] == process.uid:
                 self.gpus[gpuid] = None
+        for cpuid in process.cpuset:
+            if self.cpus.get(cpuid) == process.uid:
+                self.cpus[cpuid] = None
+        process.cpuset = []
         del self.current_processes[process.uid]
+        self.used_resources.take(process.resources)
+        if self.debug:
+            self.check_consistency()
 
     def get_current_free_resources(self) -> FreeResources:
-        """"""
-        current_res = self.maximal_resources
+        """O(1), from the running counters"""
+        return FreeResources(
+            cpu_count=self.maximal_resources.cpu_count - self.used_resources.cpu_count,
+            gpu_count=self.maximal_resources.gpu_count - self.used_resources.gpu_count,
+            mem_gb=self.maximal_resources.mem_gb - self.used_resources.mem_gb,
+        )
+
+    def check_consistency(self):
+        """the running counters have to match the sum over all processes"""
+        used_res = FreeResources(cpu_count=0, gpu_count=0, mem_gb=0)
         for proc in self.current_processes.values():
-            current_res = current_res.subtract(proc.resources)
-        return current_res
+            used_res = used_res.add(proc.resources)
+        assert (
+            used_res == self.used_resources
+        ), f"used resources are {self.used_resources} but should be {used_res}"
+        n_used_gpus = sum(1 for uid in self.gpus if uid != None)
+        assert n_used_gpus == self.used_resources.gpu_count, "gpus are out of sync"
+
+    def get_placement_score(self, gpus: List[int]) -> float:
+        """interconnect distance between the {gpus}, lower is better"""
+        if self.topology is None:
+            return 0
+        return self.topology.score(gpus)
 
-    def schedule_appropriate_resources(self, unscheduling: List, staging: List):
+    def get_fragmentation(self) -> float:
+        """fraction of all gpus that are free but lack the cpus/memory to be used"""
+        return fragmentation(self.get_current_free_resources(), self.maximal_resources)
+
+    def reserve(self, proc, available_resources, running: List, current_time_in_s):
+        """
+        Find the earliest time at which {proc} fits assuming that the
+        {running} processes give up their resources as late as possible.
+        :returns: {reservation_time_in_s}, {FreeResources} that are left over at
+            that time (None if {proc} never fits)
+        """
+        for other in sorted(running, key=lambda p: p.released_at_in_s()):
+            available_resources = available_resources.add(other.resources)
+            if available_resources.fits(proc.resources):
+                reservation_time_in_s = max(
+                    current_time_in_s, other.released_at_in_s()
+                )
+                return reservation_time_in_s, available_resources.subtract(
+                    proc.resources
+                )
+        return float("inf"), None
+
+    def schedule_appropriate_resources(
+        self, unscheduling: List, staging: List, current_time_in_s=None
+    ):
         """
         return {procs_to_kill} ['00001', '00005'], {procs_to_schedule} [('00002', [0]), ('00003', [1, 2])]
         """
+        if current_time_in_s is None:
+            current_time_in_s = time.time()
         current_res = self.get_current_free_resources()
 
         # (1) check the resource availabilty if we remove
         # all the 'overdue' processes. For now this is only
-        # "virtual"!
+        # "virtual"! {available_resources} is changed in-place
+        # so that evaluating a staging process allocates nothing.
         available_resources = current_res
         for proc in unscheduling:
-            available_resources = available_resources.add(proc.resources)
+            available_resources.give(proc.resources)
 
         # (2) try to schedule all processes that are in the
         # waiting queue
         procs_to_schedule = []
         procs_to_staging = []
-        for proc in staging:
-            if available_resources.fits(proc.resources):
-                available_resources = available_resources.subtract(proc.resources)
-                procs_to_schedule.append(proc)
-            # else:
-            #     procs_to_staging.append(proc)
+        reservation_time_in_s = None
+        reservation_leftover = None
+        if isinstance(staging, StagingQueue) and not self.policy.reorders:
+            # (2.0) placing processes only shrinks {available_resources}: only
+            # the processes that fit right now have to be looked at
+            candidates = staging.admissible(
+                available_resources, include_first_blocked=self.backfill
+            )
+        else:
+            candidates = self.policy.order(staging, self.maximal_resources)
+        if isinstance(candidates, UidQueue):
+            candidates = candidates.values()  # it is not changed in here
+        for proc in candidates:
+            if not available_resources.fits(proc.resources):
+                if self.backfill and reservation_time_in_s is None:
+                    unscheduling_uids = set(p.uid for p in unscheduling)
+                    running = [
+                        p
+                        for p in self.current_processes.values()
+                        if p.uid not in unscheduling_uids
+                    ]
+                    reservation_time_in_s, reservation_leftover = self.reserve(
+                        proc, available_resources, running, current_time_in_s
+                    )
+                continue
+            if not self.policy.accepts(
+                proc, available_resources, self.maximal_resources
+            ):
+                continue
+            if reservation_time_in_s is not None:
+                # (2.1) backfill: only if it is done before the reservation
+                # starts or if it fits next to the reserved process
+                finish_time_in_s = current_time_in_s + proc.maximal_running_time_in_s()
+                if finish_time_in_s > reservation_time_in_s:
+                    if reservation_leftover is None or not reservation_leftover.fits(
+                        proc.resources
+                    ):
+                        continue
+                    reservation_leftover.take(proc.resources)
+            available_resources.take(proc.resources)
+            procs_to_schedule.append(proc)
 
         # (3) check if some of the old processes still fit... if so we will
         # just let them be and let them KEEP their current GPUs!
         procs_to_kill = []
         for proc in reversed(unscheduling):
             if available_resources.fits(proc.resources):
-                available_resources = available_resources.subtract(proc.resources)
+                available_resources.take(proc.resources)
             else:
                 procs_to_kill.append(proc)
         # procs_to_staging = procs_to_staging + procs_to_kill
@@ -161,7 +362,12 @@ class ResourceMonitor:
         for proc in procs_to_schedule:
             n_gpus = proc.resources.gpus
             proc_gpus = []
-            if n_gpus > 0:
+            if n_gpus > 0 and self.topology is not None:
+                free_gpus = [i for i in range(len(gpus)) if gpus[i] == None]
+                proc_gpus, _ = select_gpus(free_gpus, n_gpus, self.topology)
+                for i in proc_gpus:
+                    gpus[i] = proc.uid
+            elif n_gpus > 0:
                 for i in range(len(gpus)):
                     if gpus[i] == None:
                         proc_gpus.append(i)
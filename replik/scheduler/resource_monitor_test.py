@@ -1,6 +1,9 @@
 import unittest
+import tracemalloc
 import replik.scheduler.resource_monitor as RESMON
 import replik.scheduler.schedule as SCHED
+import replik.scheduler.placement as PLACEMENT
+from replik.scheduler.uid_queue import UidQueue
 
 
 class TestProcesses(unittest.TestCase):
@@ -67,6 +70,145 @@ class TestProcesses(unittest.TestCase):
         self.assertEqual(100, res.mem_gb)
 
 
+class TestBackfill(unittest.TestCase):
+    def run_scenario(self, backfill):
+        # 3 of 4 gpus are in use for another 2h, a 4-gpu process waits
+        mon = RESMON.ResourceMonitor(
+            cpu_count=10, gpu_count=4, mem_gb=100, memory_factor=1.0, backfill=backfill
+        )
+        running = SCHED.ReplikProcess(
+            {
+                "cpus": 1,
+                "gpus": 3,
+                "memory": "10g",
+                "minimum_required_running_hours": 2,
+            },
+            uid=1,
+        )
+        running.push_to_running_queue(cur_time_in_s=0)
+        mon.add_process(running, [0, 1, 2])
+
+        big = SCHED.ReplikProcess({"cpus": 1, "gpus": 4, "memory": "10g"}, uid=2)
+        long = SCHED.ReplikProcess(
+            {"cpus": 1, "gpus": 1, "memory": "10g", "maximal_running_hours": 5},
+            uid=3,
+        )
+        short = SCHED.ReplikProcess(
+            {"cpus": 1, "gpus": 1, "memory": "10g", "maximal_running_hours": 1},
+            uid=4,
+        )
+        cpu_only = SCHED.ReplikProcess(
+            {"cpus": 1, "gpus": 0, "memory": "10g", "maximal_running_hours": 5},
+            uid=5,
+        )
+        _, procs_to_schedule, _ = mon.schedule_appropriate_resources(
+            [], [big, long, short, cpu_only], current_time_in_s=0
+        )
+        return [proc.uid for proc, _ in procs_to_schedule]
+
+    def test_greedy(self):
+        self.assertEqual([3, 5], self.run_scenario(backfill=False))
+
+    def test_backfill(self):
+        # {long} would delay {big}, {short} finishes in time and {cpu_only}
+        # fits next to {big}
+        self.assertEqual([4, 5], self.run_scenario(backfill=True))
+
+
+class TestPlacement(unittest.TestCase):
+    def test_keep_gpus_reachable(self):
+        procs = [
+            SCHED.ReplikProcess({"cpus": 6, "gpus": 0, "memory": "10g"}, uid=1),
+            SCHED.ReplikProcess({"cpus": 2, "gpus": 1, "memory": "10g"}, uid=2),
+            SCHED.ReplikProcess({"cpus": 2, "gpus": 1, "memory": "10g"}, uid=3),
+        ]
+        mon = RESMON.ResourceMonitor(
+            cpu_count=8, gpu_count=2, mem_gb=100, memory_factor=1.0
+        )
+        _, procs_to_schedule, _ = mon.schedule_appropriate_resources([], procs, 0)
+        self.assertEqual([1, 2], [proc.uid for proc, _ in procs_to_schedule])
+        for proc, gpus in procs_to_schedule:
+            mon.add_process(proc, gpus)
+        # one gpu is free but there is no cpu left to use it
+        self.assertEqual(0.5, mon.get_fragmentation())
+
+        mon = RESMON.ResourceMonitor(
+            cpu_count=8,
+            gpu_count=2,
+            mem_gb=100,
+            memory_factor=1.0,
+            policy=PLACEMENT.KeepGpusReachable(share=1.0),
+        )
+        _, procs_to_schedule, _ = mon.schedule_appropriate_resources([], procs, 0)
+        self.assertEqual([2, 3], [proc.uid for proc, _ in procs_to_schedule])
+        for proc, gpus in procs_to_schedule:
+            mon.add_process(proc, gpus)
+        self.assertEqual(0, mon.get_fragmentation())
+
+    def test_best_fit_order(self):
+        procs = [
+            SCHED.ReplikProcess({"cpus": 1, "gpus": 1, "memory": "10g"}, uid=1),
+            SCHED.ReplikProcess({"cpus": 1, "gpus": 0, "memory": "80g"}, uid=2),
+            SCHED.ReplikProcess({"cpus": 1, "gpus": 2, "memory": "10g"}, uid=3),
+            SCHED.ReplikProcess({"cpus": 1, "gpus": 1, "memory": "10g"}, uid=4),
+        ]
+        policy = PLACEMENT.DominantResourceBestFit()
+        maximal = RESMON.FreeResources(cpu_count=8, gpu_count=4, mem_gb=100)
+        self.assertEqual(
+            [2, 3, 1, 4], [proc.uid for proc in policy.order(procs, maximal)]
+        )
+
+
+class TestAccounting(unittest.TestCase):
+    def test_counters(self):
+        mon = RESMON.ResourceMonitor(
+            cpu_count=10, gpu_count=4, mem_gb=100, memory_factor=0.8, debug=True
+        )
+        procs = [
+            SCHED.ReplikProcess({"cpus": 3, "gpus": 1, "memory": "17g"}, uid=uid)
+            for uid in range(3)
+        ]
+        for proc in procs:
+            mon.add_process(proc, [proc.uid])
+        free = mon.get_current_free_resources()
+        self.assertEqual((1, 1), (free.cpu_count, free.gpu_count))
+        self.assertAlmostEqual(80 - 51, free.mem_gb)
+
+        for proc in procs:
+            mon.remove_process(proc)
+        self.assertEqual(mon.maximal_resources, mon.get_current_free_resources())
+
+        # the counters are not changed by the caller
+        mon.get_current_free_resources().take(procs[0].resources)
+        self.assertEqual(mon.maximal_resources, mon.get_current_free_resources())
+
+        mon.used_resources.cpu_count += 1
+        with self.assertRaises(AssertionError):
+            mon.check_consistency()
+
+    def test_fit_allocates_nothing_per_job(self):
+        mon = RESMON.ResourceMonitor(cpu_count=10, gpu_count=1, mem_gb=100)
+        running = SCHED.ReplikProcess({"cpus": 1, "gpus": 1, "memory": "1g"}, uid=0)
+        mon.add_process(running, [0])
+
+        def peak_bytes(n_staging):
+            staging = UidQueue(key=lambda proc: proc.uid)
+            for uid in range(1, n_staging + 1):
+                staging.append(
+                    SCHED.ReplikProcess({"cpus": 1, "gpus": 1, "memory": "1g"}, uid)
+                )
+            tracemalloc.start()
+            _, procs_to_schedule, _ = mon.schedule_appropriate_resources(
+                [], staging, current_time_in_s=0
+            )
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.assertEqual(0, len(procs_to_schedule))
+            return peak
+
+        self.assertTrue(peak_bytes(10000) < peak_bytes(10) + 1000)
+
+
 class TestResources(unittest.TestCase):
     def test_subtraction(self):
         mon = RESMON.FreeResources(cpu_count=5, gpu_count=5, mem_gb=100)
@@ -1,6 +1,8 @@
 import sys
 import json
 import time
+import uuid
+import threading
 import replik.console as console
 import replik.scheduler.client as client
 import replik.constants as const
@@ -8,16 +10,24 @@ import replik.run as RUN
 import replik.build as build
 from typing import List
 from replik.scheduler.resource_monitor import Resources
-from os.path import isfile
+from replik.scheduler.cpuset import format_cpulist
+from replik.scheduler.notify import JobEvent, wait_for_event
+from os.path import isabs, isfile, join
 from subprocess import call
 from enum import IntEnum
 
 
+# the client waits for the events of the server, the mark files are only
+# checked if nothing has been published for that long
+MARK_FILE_POLL_INTERVAL_IN_S = 5
+
+
 class Place:
     NOT_PLACED = 0
     STAGING = 1
     RUNNING = 2
     KILLED = 3  # this will be gc'd soon!
+    KILLING = 4  # unscheduled, waiting for its container to be gone
 
 
 def get_container_name(uid):
@@ -41,10 +51,14 @@ class ReplikProcess:
         )
         self.username = info["username"] if "username" in info else "inkognito"
         self.run_forever = info["run_forever"] if "run_forever" in info else False
-        self.tag = info["tag"]
+        self.tag = info["tag"] if "tag" in info else "untagged"
+        self.array = info["array"] if "array" in info else None  # id of its array
+        self.array_index = info["array_index"] if "array_index" in info else None
         self.staging_started_time = -1
         self.running_started_time = -1
         self.resources = Resources(info)
+        self.cpuset = []  # cpus it is pinned to, empty if it is not pinned
+        self.status_entry = None  # see {Scheduler.get_status_entry}
         self.place = Place.NOT_PLACED
 
     def to_json(self):
@@ -53,6 +67,8 @@ class ReplikProcess:
             "username": self.username,
             "tag": self.tag,
             "resources": self.resources.to_json(),
+            "array": self.array,
+            "array_index": self.array_index,
         }
 
     def container_name(self):
@@ -89,6 +105,7 @@ class ReplikProcess:
         self.place = Place.RUNNING
         self.running_started_time = cur_time_in_s
         self.staging_started_time = -1
+        self.status_entry = None
 
     def push_to_staging_queue(self, cur_time_in_s=None):
         if cur_time_in_s is None:
@@ -97,11 +114,19 @@ class ReplikProcess:
         self.place = Place.STAGING
         self.staging_started_time = cur_time_in_s
         self.running_started_time = -1
+        self.status_entry = None
+
+    def push_to_killing(self):
+        self.running_started_time = -1
+        self.staging_started_time = -1
+        self.place = Place.KILLING
+        self.status_entry = None
 
     def push_to_kill(self):
         self.running_started_time = -1
         self.staging_started_time = -1
         self.place = Place.KILLED
+        self.status_entry = None
 
     def must_be_killed(self, cur_time_in_s=None):
         if self.run_forever:
@@ -109,6 +134,22 @@ class ReplikProcess:
         currently_running_h = self.running_time_in_h(cur_time_in_s)
         return currently_running_h > self.maximal_running_hours
 
+    def released_at_in_s(self):
+        """
+        the latest time at which this running process gives up its resources:
+        after its minimal running time it may be preempted, after its maximal
+        running time it has to be.
+        """
+        if self.run_forever:
+            return float("inf")
+        hours = min(self.minimum_required_running_hours, self.maximal_running_hours)
+        return self.running_started_time + hours * 3600
+
+    def maximal_running_time_in_s(self):
+        if self.run_forever:
+            return float("inf")
+        return self.maximal_running_hours * 3600
+
     def may_be_killed(self, cur_time_in_s=None):
         if self.run_forever:
             return False
@@ -139,6 +180,123 @@ def rank_processes_that_can_be_killed(
     return must_be_killed + may_be_killed
 
 
+def parse_array(array: str, directory: str) -> List:
+    """
+    :param array: a file with the arguments of one task per line (relative
+        to the project {directory}) or a range like '0-9' or '0-90:10'
+    :returns: [(index, arguments)] of all tasks
+    """
+    fname = array if isabs(array) else join(directory, array)
+    if isfile(fname):
+        with open(fname, "r") as f:
+            lines = [line.strip() for line in f]
+        lines = [line for line in lines if len(line) > 0 and not line.startswith("#")]
+        return list(enumerate(lines))
+    step = 1
+    if ":" in array:
+        array, step = array.split(":", 1)
+    first, last = array.split("-", 1)
+    return [(index, "") for index in range(int(first), int(last) + 1, int(step))]
+
+
+def get_docker_run_command(
+    directory: str,
+    info,
+    container_name: str,
+    mark,
+    final_docker_exec_command: str,
+    env=None,
+    interactive: bool = True,
+):
+    """
+    :param mark: content of the mark file: the gpus, cpus and NUMA nodes
+        the server has placed the process on
+    :param env: {name: value} environment variables, see {RUN.get_run_env}
+    :param interactive: False for the tasks of a job array, they run side
+        by side
+    """
+    gpus = mark["gpus"]
+    cpus = mark["cpus"] if "cpus" in mark else []
+    mems = mark["mems"] if "mems" in mark else []
+
+    docker_exec_command = "docker run" + RUN.set_shm_cpu_memory(info)
+    if len(cpus) > 0:
+        docker_exec_command += f'--cpuset-cpus="{format_cpulist(cpus)}" '
+    if len(mems) > 0:
+        docker_exec_command += f'--cpuset-mems="{format_cpulist(mems)}" '
+    if len(gpus) > 0:
+        docker_exec_command += "--gpus '" + '"device='
+        for i, gpuid in enumerate(gpus):
+            if i > 0:
+                docker_exec_command += ","
+            docker_exec_command += str(gpuid)
+        docker_exec_command += '"' + "' "
+    docker_exec_command += RUN.set_env({} if env is None else env)
+
+    docker_exec_command += RUN.set_all_paths(directory, info)
+    docker_exec_command += f"--name {container_name} "
+    docker_exec_command += "--rm -it " if interactive else "--rm "
+    docker_exec_command += f"{info['tag']} " + final_docker_exec_command
+    return docker_exec_command
+
+
+def run_when_placed(
+    directory: str,
+    info,
+    uid: int,
+    container_name: str,
+    mark_file: str,
+    staging_mark: str,
+    final_docker_exec_command: str,
+    env=None,
+    interactive: bool = True,
+):
+    """
+    wait until the server places {uid}, run its container and wait again
+    whenever it is preempted
+    :returns: True if the container has finished successfully
+    """
+    events = client.subscribe_to_uid(uid)
+    while True:
+        event = wait_for_event(events, MARK_FILE_POLL_INTERVAL_IN_S)
+        if event is not None and event["event"] == JobEvent.KILLED:
+            console.warning(f"\nJob {uid} removed from staging...")
+            return False
+        elif event is not None and event["event"] != JobEvent.RUNNING:
+            continue
+        # the mark file is still the source of truth: a RUNNING event
+        # of an earlier placement has no mark file anymore
+        if isfile(mark_file):
+            # if the file exists the server allowed the scheduling!
+            with open(mark_file, "r") as f:
+                mark = json.load(f)
+            docker_exec_command = get_docker_run_command(
+                directory,
+                info,
+                container_name,
+                mark,
+                final_docker_exec_command,
+                env,
+                interactive,
+            )
+            out = call(docker_exec_command, shell=True)
+            client.notify_container_exit(uid)
+            if out == 0:
+                console.success(f"finished {uid}!")
+                return True
+            else:
+                console.warning(f"\nJob {uid} interrupted...")
+                if isfile(staging_mark):
+                    console.info("\nplaced onto staging for re-scheduling...")
+                else:
+                    console.warning("\nnot marked for re-scheduling... exiting now")
+                    return False
+        else:
+            if not isfile(staging_mark):
+                console.warning(f"\nJob {uid} removed from staging...")
+                return False
+
+
 def execute(
     directory: str,
     script: str,
@@ -147,7 +305,15 @@ def execute(
     gpu: int,
     mem: int,
     outfile_name: str,
+    array: str = "",
+    verbose: bool = False,
 ):
+    """
+    :param array: schedule a job array, see {parse_array}: the image is
+        built once and every task is scheduled as its own process with the
+        environment variables REPLIK_ARRAY_INDEX and REPLIK_ARRAY_ARGS
+        (appended to the script call) and its own log file
+    """
     if const.is_replik_project(directory):
         # -- build the dockerfile --
         info = const.get_replik_settings(directory)
@@ -158,56 +324,78 @@ def execute(
         if mem > -1:
             info["memory"] = f"{mem}g"
 
-        build.execute(directory, script, info, outfile_name=outfile_name)
+        RUN.check_outfile_name(info, outfile_name)
+        if not client.check_server_status():
+            console.fail("exiting")
+            sys.exit(1)
+
+        # builds are queued on the server so that a burst of submissions
+        # does not start as many builds on the shared docker daemon
+        build.execute(directory, info, verbose=verbose, fun_build=client.request_build)
 
         # -- start actual scheduling --
 
         console.info("start scheduling...")
 
-        if not client.check_server_status():
-            console.fail("exiting")
-            sys.exit(1)
-
         info = const.get_replik_settings(directory)
-        tag = info["tag"]
-        uid, container_name, mark_file, staging_mark = client.request_uid(info)
-
-        console.info(f"schedule as {uid}")
-
-        while True:
-            time.sleep(3)
-            if isfile(mark_file):
-                # if the file exists the server allowed the scheduling!
-                with open(mark_file, "r") as f:
-                    mark = json.load(f)
-                    gpus = mark["gpus"]
-
-                docker_exec_command = "docker run" + RUN.set_shm_cpu_memory(info)
-                if len(gpus) > 0:
-                    docker_exec_command += "--gpus '" + '"device='
-                    for i, gpuid in enumerate(gpus):
-                        if i > 0:
-                            docker_exec_command += ","
-                        docker_exec_command += str(gpuid)
-                    docker_exec_command += '"' + "' "
-
-                docker_exec_command += RUN.set_all_paths(directory, info)
-                docker_exec_command += f"--name {container_name} "
-                docker_exec_command += f"--rm -it {tag} " + final_docker_exec_command
-                out = call(docker_exec_command, shell=True)
-                if out == 0:
-                    console.success(f"finished {uid}!")
-                    exit(0)
-                else:
-                    console.warning("\nJob interrupted...")
-                    if isfile(staging_mark):
-                        console.info("\nplaced onto staging for re-scheduling...")
-                    else:
-                        console.warning("\nnot marked for re-scheduling... exiting now")
-                        exit(0)
-            else:
-                if not isfile(staging_mark):
-                    console.warning("\nJob removed from staging...")
-                    exit(0)
+
+        if len(array) == 0:
+            uid, container_name, mark_file, staging_mark = client.request_uid(info)
+            console.info(f"schedule as {uid}")
+            run_when_placed(
+                directory,
+                info,
+                uid,
+                container_name,
+                mark_file,
+                staging_mark,
+                final_docker_exec_command,
+                RUN.get_run_env(directory, script, info, outfile_name),
+            )
+            exit(0)
+
+        tasks = parse_array(array, directory)
+        array_id = uuid.uuid4().hex[:8]
+        infos = [dict(info, array=array_id, array_index=index) for index, _ in tasks]
+        staged = client.request_uids(infos)
+        if len(staged) == 0:
+            console.fail(f"could not schedule the {len(tasks)} tasks of the array")
+            exit(0)
+        console.info(
+            f"schedule array {array_id} as {staged[0][0]}..{staged[-1][0]} "
+            f"({len(staged)} tasks), cancel it with: "
+            f"replik unschedule --array={array_id}"
+        )
+        threads = []
+        for (index, args), (uid, container_name, mark_file, staging_mark) in zip(
+            tasks, staged
+        ):
+            env = RUN.get_run_env(
+                directory, script, info, outfile_name, suffix=f"_{array_id}_{index}"
+            )
+            env["REPLIK_ARRAY_ID"] = array_id
+            env["REPLIK_ARRAY_INDEX"] = index
+            env["REPLIK_ARRAY_ARGS"] = args
+            threads.append(
+                threading.Thread(
+                    target=run_when_placed,
+                    args=(
+                        directory,
+                        info,
+                        uid,
+                        container_name,
+                        mark_file,
+                        staging_mark,
+                        final_docker_exec_command,
+                        env,
+                        False,
+                    ),
+                )
+            )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        exit(0)
     else:
         console.warning("Not a valid replik repository")
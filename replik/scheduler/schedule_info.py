@@ -1,9 +1,41 @@
+import time
 import replik.console as console
-from replik.scheduler.client import request_server_infos
+from replik.scheduler.client import request_server_infos, subscribe_to_status
+from replik.scheduler.notify import apply_status_delta, wait_for_event
+from replik.scheduler.build_queue import BuildState
 
 
-def execute():
+WATCH_REDRAW_IN_S = 1  # the waiting and running times change without deltas
+
+
+def execute(watch: bool = False):
+    """
+    :param watch: keep the status up to date with the deltas the server
+        publishes, until ctrl+c
+    """
+    if not watch:
+        print_status(request_server_infos())
+        return
+
+    events = subscribe_to_status()
     status = request_server_infos()
+    try:
+        while True:
+            print("\033[2J\033[H", end="")  # clear the terminal
+            print_status(status)
+            delta = wait_for_event(events, WATCH_REDRAW_IN_S)
+            while delta is not None:
+                # deltas up to the version of the full status are skipped
+                if delta["version"] > status["version"]:
+                    if not apply_status_delta(status, delta):
+                        status = request_server_infos()  # a delta got lost
+                delta = wait_for_event(events, 0)
+    except KeyboardInterrupt:
+        pass
+
+
+def print_status(status):
+    now = time.time()
 
     free_res = status["free"]
     total_res = status["total"]
@@ -12,31 +44,75 @@ def execute():
     console.info(f"gpus:    {free_res['gpus']} / {total_res['gpus']}")
     console.info(f"memory:  {free_res['mem']} / {total_res['mem']}")
 
-    staging_queue = status["staging"]
+    if "fragmentation" in status:
+        console.info("stranded gpus: %.01f%%" % (100 * status["fragmentation"]))
+
+    if "placement_latency" in status and status["placement_latency"]["n"] > 0:
+        latency = status["placement_latency"]
+        console.info(
+            "placement latency (last %d): mean %.01fs | p95 %.01fs | max %.01fs"
+            % (latency["n"], latency["mean"], latency["p95"], latency["max"])
+        )
+
+    builds = status["builds"] if "builds" in status else []
+    if len(builds) > 0:
+        console.info(f"\n~ ~ building (#{len(builds)}) ~ ~")
+        console.info("build | docker tag | user | state | time (#clients)\n")
+        for build in builds:
+            since = build["submitted"] if build["started"] is None else build["started"]
+            line = f"%06d | {build['tag']} | {build['username']} | " % build["id"]
+            line += f"{BuildState(build['state']).name.lower()} | {int(now - since)} s"
+            if build["n_clients"] > 1:
+                line += f" ({build['n_clients']})"
+            console.info(line)
+
+    staging_queue = list_entries(status["staging"])
     console.warning(
         f"\n~ ~ staging (#{len(staging_queue)}) ~ ~\nuid | docker tag | waiting time ~ ~\n"
     )
     for proc in staging_queue:
-        line = f"%06d | {proc['info']['tag']} | " % (proc["info"]["uid"])
-        wtime = proc["waiting_in_h"]
+        line = f"%06d | {get_name(proc['info'])} | " % (proc["info"]["uid"])
+        wtime = (now - proc["waiting_since"]) / 3600
         if wtime > 2:
             line += "%03.02f h" % wtime
         else:
             line += f"{int(60 * wtime)} min"
         console.warning(line)
 
-    running_queue = status["running"]
+    running_queue = list_entries(status["running"])
     console.success(f"\n~ ~ running (#{len(running_queue)}) ~ ~")
-    console.success("uid | docker tag | running time | gpus\n")
+    console.success("uid | docker tag | running time | gpus (distance)\n")
 
     for proc in running_queue:
-        line = f"%06d | {proc['info']['tag']} | " % (proc["info"]["uid"])
-        rtime = proc["running_in_h"]
+        line = f"%06d | {get_name(proc['info'])} | " % (proc["info"]["uid"])
+        rtime = (now - proc["running_since"]) / 3600
         if rtime > 2:
             line += "%03.02f h | " % rtime
         else:
             line += f"{int(60 * rtime)} min | "
         line += f"{proc['gpus']}"
+        if "gpu_distance" in proc and len(proc["gpus"]) > 1:
+            line += f" ({proc['gpu_distance']})"
+        if "cpus" in proc and len(proc["cpus"]) > 0:
+            line += f" | cpus {proc['cpus']}"
         console.success(line)
 
+    killing = status["killing"] if "killing" in status else []
+    if len(killing) > 0:
+        console.fail(f"\n~ ~ being killed (#{len(killing)}) ~ ~")
+        for proc in killing:
+            console.fail(f"%06d | {proc['tag']}" % proc["uid"])
+
     print("\n")
+
+
+def list_entries(entries):
+    """the entries of a queue are a dict once a delta has been applied"""
+    return list(entries.values()) if isinstance(entries, dict) else entries
+
+
+def get_name(info):
+    """docker tag, with the array id and task index of array tasks"""
+    if info.get("array", None) is None:
+        return info["tag"]
+    return f"{info['tag']} [{info['array']}:{info['array_index']}]"
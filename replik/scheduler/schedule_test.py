@@ -1,5 +1,8 @@
 import unittest
+import tempfile
+from os.path import join
 import replik.scheduler.schedule as SCHED
+import replik.run as RUN
 
 
 class TestScheduling(unittest.TestCase):
@@ -48,6 +51,54 @@ class TestScheduling(unittest.TestCase):
         self.assertEqual(len(kill_proc), 1)
         self.assertEqual(kill_proc[0].uid, "00001")
 
+    def test_parse_array(self):
+        tmp = tempfile.TemporaryDirectory()
+        with open(join(tmp.name, "args.txt"), "w") as f:
+            f.write("--lr 0.1\n\n# comment\n--lr 0.01\n")
+        self.assertEqual(
+            [(0, "--lr 0.1"), (1, "--lr 0.01")],
+            SCHED.parse_array("args.txt", tmp.name),
+        )
+        self.assertEqual([0, 1, 2], [i for i, _ in SCHED.parse_array("0-2", tmp.name)])
+        self.assertEqual([0, 10, 20], [i for i, _ in SCHED.parse_array("0-20:10", "")])
+        tmp.cleanup()
+
+    def test_docker_run_command(self):
+        info = {
+            "docker_shm": "8g",
+            "memory": "16g",
+            "cpus": 2,
+            "name": "demo",
+            "is_simple": True,
+            "stdout_to_file": False,
+            "tag": "user/replik_demo",
+        }
+        mark = {"gpus": [1, 3], "cpus": [0, 1], "mems": [0]}
+        env = {"REPLIK_ARRAY_INDEX": 4, "REPLIK_ARRAY_ARGS": "--lr 0.1"}
+        tmp = tempfile.TemporaryDirectory()
+        cmd = SCHED.get_docker_run_command(
+            tmp.name, info, "replik_00000004", mark, "/bin/bash run.sh", env, False
+        )
+        self.assertIn("""--gpus '"device=1,3"'""", cmd)
+        self.assertIn('--cpuset-cpus="0-1"', cmd)
+        self.assertIn("-e REPLIK_ARRAY_INDEX=4 ", cmd)
+        self.assertIn("-e REPLIK_ARRAY_ARGS='--lr 0.1' ", cmd)
+        self.assertNotIn("-it", cmd)  # array tasks run side by side
+        self.assertTrue(cmd.endswith("--rm user/replik_demo /bin/bash run.sh"))
+
+        # the script and the log file are passed at `docker run`
+        info["stdout_to_file"] = True
+        env = RUN.get_run_env(tmp.name, "train.py --lr 0.1", info, "exp")
+        self.assertRegex(
+            env["REPLIK_LOG"], r"^/home/user/.replik/logs/exp_\d+_\d+\.log$"
+        )
+        cmd = SCHED.get_docker_run_command(
+            tmp.name, info, "replik_00000004", mark, "/bin/bash run.sh", env
+        )
+        self.assertIn("-e REPLIK_SCRIPT='train.py --lr 0.1' ", cmd)
+        self.assertTrue(cmd.endswith("--rm -it user/replik_demo /bin/bash run.sh"))
+        tmp.cleanup()
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -14,10 +14,19 @@ from replik.scheduler.resource_monitor import (
     get_system_cpu_count,
     get_system_memory_gb,
 )
+from replik.scheduler.uid_queue import UidQueue
+from replik.scheduler.staging_queue import StagingQueue
+from replik.scheduler.journal import Journal
+from replik.scheduler.notify import Notifier
+from replik.scheduler.cpuset import format_cpulist
 from typing import List
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
 from os.path import join, isfile
 from os import remove, makedirs, listdir
 import shutil
+import tempfile
 import time
 
 
@@ -38,13 +47,25 @@ def mark_uid_as_staging(uid, current_time_in_s=None):
         json.dump({"start_time": current_time_in_s}, f)
 
 
-def mark_uid_as_running(uid, gpus, current_time_in_s=None):
+def mark_uid_as_running(uid, gpus, current_time_in_s=None, cpus=None, mems=None):
+    """
+    :param cpus: cpus the container is pinned to, not pinned if empty
+    :param mems: NUMA nodes the container allocates its memory on
+    """
     if current_time_in_s is None:
         current_time_in_s = time.time()
     fname = get_mark_file(uid)
     assert not isfile(fname), fname
     with open(fname, "w") as f:
-        json.dump({"start_time": current_time_in_s, "gpus": gpus}, f)
+        json.dump(
+            {
+                "start_time": current_time_in_s,
+                "gpus": gpus,
+                "cpus": [] if cpus is None else cpus,
+                "mems": [] if mems is None else mems,
+            },
+            f,
+        )
 
 
 def get_uid_staging_mark_elapsed(uid, current_time_in_s=None):
@@ -85,6 +106,24 @@ def clear_dir(directory: str):
         remove(f)
 
 
+@contextmanager
+def temporary_mark_dirs():
+    """
+    The mark files of a {Scheduler} that is not the server, e.g. of a
+    simulation, are written to a temporary directory: the ones of the live
+    server in {const.SCHEDULE_DIR} must not be touched.
+    """
+    schedule_dir = const.SCHEDULE_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        const.SCHEDULE_DIR = tmp
+        try:
+            makedirs(const.running_files_dir_for_scheduler())
+            makedirs(const.staging_files_dir_for_scheduler())
+            yield tmp
+        finally:
+            const.SCHEDULE_DIR = schedule_dir
+
+
 class Scheduler:
     def __init__(
         self,
@@ -92,82 +131,230 @@ class Scheduler:
         max_id: int = 10000,
         verbose: bool = False,
         fun_docker_kill=docker.kill,
+        kill_executor: docker.KillExecutor = None,
+        journal: Journal = None,
+        notifier: Notifier = None,
+        builds=None,
     ):
         """
         :param fun_docker_kill: {function} to kill a docker container
+        :param kill_executor: kills containers in the background, without
+            holding the lock. If None, containers are killed synchronously
+            with {fun_docker_kill} during the scheduling step.
+        :param journal: records all queue transitions, see {recover}
+        :param notifier: publishes the state changes to the waiting clients
+        :param builds: {BuildQueue} of the images built on the server, it is
+            part of the status
         """
         super().__init__()
-        # -- empty the handing dir --
-        clear_dir(const.running_files_dir_for_scheduler())
-        clear_dir(const.staging_files_dir_for_scheduler())
-        # --
+        if journal is None:
+            # -- empty the handing dir --
+            clear_dir(const.running_files_dir_for_scheduler())
+            clear_dir(const.staging_files_dir_for_scheduler())
+            # --
 
         self.lock = threading.Lock()
+        self.step_requested = threading.Event()
         self.verbose = verbose
         self.resources = resources
         self.fun_docker_kill = fun_docker_kill
-
-        self.USED_IDS = []
-        self.FREE_IDS = list(range(max_id))
-        self.KILLING_QUEUE = (
-            []
+        self.kill_executor = kill_executor
+        self.journal = journal
+        self.notifier = notifier
+        self.builds = builds
+        self.max_id = max_id
+
+        self.USED_IDS = set()
+        self.FREE_IDS = deque(range(max_id))
+        self.KILLING_QUEUE = UidQueue(
+            key=lambda uid: uid
         )  # anything here is supposed to be killed! [R/W] for {Comm} and {Sched}. Contains uid's
+        self.KILLING_PROCS = UidQueue(
+            key=lambda proc: proc.uid
+        )  # processes whose containers are currently being killed, their resources are still in use
         self.STAGING_QUEUE = (
-            []  # [{proc}]
+            StagingQueue()
         )  # anything here is supposed to be staged [R/W] for {Comm} and {Sched}. Contains procs
-        self.RUNNING_QUEUE = (
-            []  # [{proc}, {gpus}]
+        self.RUNNING_QUEUE = UidQueue(
+            key=lambda t: t[0].uid  # [{proc}, {gpus}]
         )  # currently running processes, READONLY for {Comm}, [R/W] for {Sched}. Contains (procs, gpus)
+        self.PLACEMENT_LATENCIES = deque(
+            maxlen=1000
+        )  # seconds between staging and placement of the most recent processes
+        self.placement_latency = None  # json of the latencies, see {publish_status}
+        self.status_version = 0
+        self.status = None  # see {publish_status}
+        self.status_delta = None  # from the previous to the current status
+        self.status_uids = set()  # uids of the processes in the status
+        self.status_changes = []  # [(queue, entry)] since the last status
+        self.status_dirty = False  # changes that are not published yet
+        with self.lock:
+            self.publish_status()
 
     def get_resources_infos_as_json(self):
-        """gather all the resources so that we can display them!"""
-        self.lock.acquire()
-        res_free = self.resources.get_current_free_resources()
-        res_total = self.resources.maximal_resources
-        RUN = []
-        for proc, gpus in self.RUNNING_QUEUE:
-            gpus = list(sorted(gpus))
-            RUN.append(
-                {
+        """
+        the latest published status, see {publish_status}. It is read
+        without the lock and must not be modified. The lock is only taken
+        if there are changes that have not been published yet.
+        """
+        if self.status_dirty:
+            with self.lock:
+                self.refresh_status()
+        return self.status
+
+    def refresh_status(self):
+        """
+        publish the changes since the last status. The snapshot is built
+        once per scheduling step or read, not per submission, as it is
+        O(n) in the number of processes.
+        """
+        assert self.lock.locked()
+        if self.status_dirty:
+            self.publish_status()
+            if self.notifier is not None:
+                self.notifier.flush()
+
+    def get_status_entry(self, proc, gpus=None):
+        """
+        entry of a running or staging process in the status. It is cached
+        on the process until it moves to another queue, so that an
+        unchanged process costs nothing.
+        """
+        if proc.status_entry is None:
+            if proc.place == Place.RUNNING:
+                gpus = list(sorted(gpus))
+                proc.status_entry = {
                     "info": proc.to_json(),
                     "gpus": gpus,
-                    "running_in_h": proc.running_time_in_h(),
+                    "gpu_distance": self.resources.get_placement_score(gpus),
+                    "cpus": format_cpulist(proc.cpuset),
+                    "running_since": proc.running_started_time,
                 }
-            )
-        STAG = []
-        for proc in self.STAGING_QUEUE:
-            STAG.append(
-                {
+                self.status_changes.append(("running", proc.status_entry))
+            else:
+                proc.status_entry = {
                     "info": proc.to_json(),
-                    "waiting_in_h": proc.waiting_time_in_h(),
+                    "waiting_since": proc.staging_started_time,
                 }
+                self.status_changes.append(("staging", proc.status_entry))
+        return proc.status_entry
+
+    def publish_status(self):
+        """
+        Replace the status by a new immutable snapshot. Its version only
+        changes if the content has changed, so clients can ask whether
+        their version is still up to date.
+        """
+        assert self.lock.locked()
+        status = {
+            "version": self.status_version,
+            "free": self.resources.get_current_free_resources().to_json(),
+            "total": self.resources.maximal_resources.to_json(),
+            "running": [
+                proc.status_entry or self.get_status_entry(proc, gpus)
+                for proc, gpus in self.RUNNING_QUEUE.values()
+            ],
+            "staging": [
+                proc.status_entry or self.get_status_entry(proc)
+                for proc in self.STAGING_QUEUE.values()
+            ],
+            "killing": [proc.to_json() for proc in self.KILLING_PROCS],
+            "placement_latency": self.get_placement_latency_as_json(),
+            "fragmentation": self.resources.get_fragmentation(),
+            "builds": [] if self.builds is None else self.builds.to_json(),
+        }
+        # the cached entries are compared by identity first: O(1) each
+        if status != self.status:
+            self.status_version += 1
+            status["version"] = self.status_version
+            if self.status is not None:
+                self.status_delta = self.get_status_delta(status)
+                if self.notifier is not None:
+                    self.notifier.record_status(self.status_delta)
+            self.status = status
+        self.status_changes = []
+        self.status_dirty = False
+
+    def publish_builds(self):
+        """publish a change of the build queue, called by its workers"""
+        with self.lock:
+            self.publish_status()
+            if self.notifier is not None:
+                self.notifier.flush()
+
+    def get_status_delta(self, status):
+        """
+        Changes from the current to the new {status}: the entries of all
+        processes that have been added or moved (a new gpu assignment is a
+        move to the running queue), the uids of all processes that have
+        left both queues and the small fields as they are. Its cost only
+        depends on the number of changes, see {apply_status_delta}.
+        """
+        changed = set(entry["info"]["uid"] for _, entry in self.status_changes)
+        n_new = len(changed.difference(self.status_uids))
+        n_live = len(status["running"]) + len(status["staging"])
+        removed = []
+        if len(self.status_uids) + n_new != n_live:
+            removed = list(
+                self.status_uids.difference(
+                    self.RUNNING_QUEUE.uids(), self.STAGING_QUEUE.uids()
+                )
             )
+            self.status_uids.difference_update(removed)
+        self.status_uids.update(changed)
+        delta = dict(status)
+        delta["base"] = self.status["version"]
+        for place in ["running", "staging"]:
+            delta[place] = [entry for p, entry in self.status_changes if p == place]
+        delta["removed"] = removed
+        return delta
+
+    def get_placement_latency_as_json(self):
+        """
+        latency from submit (or re-staging) to placement in seconds, only
+        computed again after new placements
+        """
+        if self.placement_latency is None:
+            latencies = list(sorted(self.PLACEMENT_LATENCIES))
+            if len(latencies) == 0:
+                self.placement_latency = {
+                    "n": 0,
+                    "mean": 0,
+                    "p50": 0,
+                    "p95": 0,
+                    "max": 0,
+                }
+            else:
+                self.placement_latency = {
+                    "n": len(latencies),
+                    "mean": sum(latencies) / len(latencies),
+                    "p50": latencies[int(0.50 * (len(latencies) - 1))],
+                    "p95": latencies[int(0.95 * (len(latencies) - 1))],
+                    "max": latencies[-1],
+                }
+        return self.placement_latency
 
-        self.lock.release()
+    def request_step(self):
+        """wake up the scheduling loop, can be called from any thread"""
+        self.step_requested.set()
 
-        return {
-            "free": res_free.to_json(),
-            "total": res_total.to_json(),
-            "running": RUN,
-            "staging": STAG,
-        }
+    def wait_for_step_request(self, timeout_in_s: float, debounce_in_s: float = 0.1):
+        """
+        Block until a step is requested or {timeout_in_s} has passed.
+        Requests that arrive within {debounce_in_s} after the first one are
+        handled by the same step.
+        :returns: True if the step was requested, False on timeout
+        """
+        is_requested = self.step_requested.wait(timeout_in_s)
+        if is_requested and debounce_in_s > 0:
+            time.sleep(debounce_in_s)
+        self.step_requested.clear()
+        return is_requested
 
     def remove_from_running_queue(self, remove_procs: List[ReplikProcess]):
         """"""
-        if len(remove_procs) > 0:
-            delete_indices = []
-            uid_is_marked_for_del = set()
-            for proc in remove_procs:
-                uid_is_marked_for_del.add(proc.uid)
-
-            del_indices = []
-            for idx, (proc, _) in enumerate(self.RUNNING_QUEUE):
-                if proc.uid in uid_is_marked_for_del:
-                    del_indices.append(idx)
-
-            if len(del_indices) > 0:
-                for index in sorted(del_indices, reverse=True):
-                    del self.RUNNING_QUEUE[index]
+        for proc in remove_procs:
+            self.RUNNING_QUEUE.discard(proc.uid)
 
     def scheduling_step(
         self, running_docker_containers: List[str], current_time_in_s=None
@@ -179,6 +366,7 @@ class Scheduler:
         self.lock.acquire()
         if current_time_in_s is None:
             current_time_in_s = time.time()
+        running_docker_containers = set(running_docker_containers)
 
         if self.verbose:
             console.info(
@@ -201,66 +389,94 @@ class Scheduler:
                     delete_procs.append(proc)
                     unmark_uid_as_running(proc.uid)
                     proc.push_to_kill()
+                    self.release_uid(proc.uid)
 
         self.remove_from_running_queue(delete_procs)
 
         # (2) kill processes that are requested to be killed
         delete_procs_from_running = []
 
-        already_killed_uid = set()  # make sure we don't kill duplicates
+        # the KILLING_QUEUE is keyed by uid so there are no duplicates
         while len(self.KILLING_QUEUE) > 0:
-            uid = self.KILLING_QUEUE.pop()
-            if uid in already_killed_uid:
-                continue
-            already_killed_uid.add(uid)
+            uid = self.KILLING_QUEUE.popleft()
 
             container_name = get_container_name(uid)
 
             # (2.1) check if the requested process is only in staging
-            is_removed_from_staging = False
-            for i in range(len(self.STAGING_QUEUE)):
-                proc = self.STAGING_QUEUE[i]
-                if proc.uid == uid:
-                    self.STAGING_QUEUE.pop(i)
-                    unmark_uid_as_staging(proc.uid)
+            proc = self.STAGING_QUEUE.discard(uid)
+            if proc is not None:
+                unmark_uid_as_staging(proc.uid)
+                if self.notifier is not None:
+                    self.notifier.record_killed(proc.uid)
+                if proc.uid in self.KILLING_PROCS:
+                    # it has been preempted and its container is still
+                    # being killed: the uid is released once it's gone
+                    proc.push_to_killing()
+                else:
                     proc.push_to_kill()
-                    is_removed_from_staging = True
-                    if self.verbose:
-                        console.info(f"\tremove {proc.uid} from staging")
-                    break
-
-            if not is_removed_from_staging:
+                    self.release_uid(proc.uid)
+                if self.verbose:
+                    console.info(f"\tremove {proc.uid} from staging")
+            elif uid in self.RUNNING_QUEUE:
                 # (2.2) process-to-be-killed is not found in staging
                 # we have to kill it properly
-                for proc, _ in self.RUNNING_QUEUE:
-                    if proc.uid == uid and container_name in running_docker_containers:
-                        self.kill(proc)
-                        proc.push_to_kill()
-                        delete_procs_from_running.append(proc)
-                        break
+                proc, _ = self.RUNNING_QUEUE.get(uid)
+                if container_name in running_docker_containers:
+                    proc.push_to_killing()
+                    self.kill(proc)
+                    if self.notifier is not None:
+                        self.notifier.record_killed(proc.uid)
+                    delete_procs_from_running.append(proc)
 
         self.remove_from_running_queue(delete_procs_from_running)
 
-        # (3) find which processes to kill and which ones to schedule
-        procs_to_be_killed = rank_processes_that_can_be_killed(
-            [t[0] for t in self.RUNNING_QUEUE], current_time_in_s=current_time_in_s
+        # (3) the processes being killed keep their resources until their
+        # containers are gone: staged processes are placed into what is free
+        # right now, only new preemptions wait for the pending kills. Their
+        # completion will request the next step.
+        self.preempt_and_place(
+            current_time_in_s, preempt=len(self.KILLING_PROCS) == 0
         )
 
+        # cleanup the staging folder
+        self.sync_staging_dir_with_staging_queue(current_time_in_s)
+
+        self.flush_journal()
+        self.refresh_status()
+        self.lock.release()
+
+    def preempt_and_place(self, current_time_in_s, preempt: bool = True):
+        """
+        find which processes to kill and which ones to schedule
+        :param preempt: if False, only the free resources are handed out
+        """
+        assert self.lock.locked()
+        procs_to_be_killed = []
+        if preempt:
+            procs_to_be_killed = rank_processes_that_can_be_killed(
+                [t[0] for t in self.RUNNING_QUEUE],
+                current_time_in_s=current_time_in_s,
+            )
+
         (
             procs_to_actually_kill,
             procs_to_schedule,
             procs_to_staging,
         ) = self.resources.schedule_appropriate_resources(
-            procs_to_be_killed, self.STAGING_QUEUE
+            procs_to_be_killed, self.STAGING_QUEUE, current_time_in_s=current_time_in_s
         )
 
         # it is important that we mark all the processes that we gonna
         # kill for staging BEFORE we kill them so that they know that
         # they have to re-schedule!
         for proc in procs_to_staging:
-            self.STAGING_QUEUE.append(proc)
-            get_mark_file_staging(proc.uid)  # re-schedule!
             proc.push_to_staging_queue(cur_time_in_s=current_time_in_s)
+            self.STAGING_QUEUE.append(proc)
+            mark_uid_as_staging(proc.uid, current_time_in_s)  # re-schedule!
+            if self.journal is not None:
+                self.journal.record_staging(proc)
+            if self.notifier is not None:
+                self.notifier.record_preempted(proc)
 
         # murder all the requested processes
         for proc in procs_to_actually_kill:
@@ -268,43 +484,72 @@ class Scheduler:
 
         self.remove_from_running_queue(procs_to_actually_kill)
 
+        if any(proc.uid in self.KILLING_PROCS for proc in procs_to_actually_kill):
+            # the kills run in the background: the resources of the new
+            # processes are only free once they are done
+            return
+
         # start all the other processes
         for proc, gpus in procs_to_schedule:
             self.resources.add_process(proc, gpus)
-            mark_uid_as_running(proc.uid, gpus)
+            mems = self.resources.get_mems(proc.cpuset)
+            mark_uid_as_running(proc.uid, gpus, cpus=proc.cpuset, mems=mems)
             self.RUNNING_QUEUE.append((proc, gpus))
+            latency_in_s = current_time_in_s - proc.staging_started_time
+            self.PLACEMENT_LATENCIES.append(latency_in_s)
+            self.placement_latency = None
             proc.push_to_running_queue(cur_time_in_s=current_time_in_s)
+            if self.journal is not None:
+                self.journal.record_running(proc, gpus)
+            if self.notifier is not None:
+                self.notifier.record_running(proc, gpus, mems)
             if self.verbose:
-                console.success(f"\tschedule {proc.uid}")
+                console.success(
+                    f"\tschedule {proc.uid} (%.02fs after staging)" % latency_in_s
+                )
 
         # cleanup the staging queue
-        uid2idx = {}
-        for idx, proc in enumerate(self.STAGING_QUEUE):
-            uid2idx[proc.uid] = idx
-        delete_indices = [uid2idx[p.uid] for p, _ in procs_to_schedule]
-        for index in sorted(delete_indices, reverse=True):
-            del self.STAGING_QUEUE[index]
+        for proc, _ in procs_to_schedule:
+            self.STAGING_QUEUE.remove(proc.uid)
 
-        # cleanup the staging folder
-        self.sync_staging_dir_with_staging_queue(current_time_in_s)
+    def kill(self, proc):
+        """
+        kill a running process. Its resources are only given back once the
+        container is gone.
+        """
+        assert self.lock.locked()
+        unmark_uid_as_running(proc.uid)
+        self.RUNNING_QUEUE.remove(proc.uid)
+        self.KILLING_PROCS.append(proc)
+        if self.verbose:
+            console.warning(f"\tkill {proc.uid}")
+        if self.kill_executor is None:
+            self.fun_docker_kill(proc.container_name())
+            self.on_container_killed(proc)
+        else:
+            self.kill_executor.submit(
+                proc.container_name(),
+                on_done=lambda: self.handle_container_killed(proc),
+            )
 
+    def handle_container_killed(self, proc):
+        """called by the {kill_executor} once the container is gone"""
+        self.lock.acquire()
+        self.on_container_killed(proc)
+        self.flush_journal()
         self.lock.release()
+        self.request_step()
 
-    def kill(self, proc):
-        """kill a process"""
+    def on_container_killed(self, proc):
+        """"""
         assert self.lock.locked()
-        self.fun_docker_kill(proc.container_name())
-        unmark_uid_as_running(proc.uid)
+        self.KILLING_PROCS.remove(proc.uid)
         self.resources.remove_process(proc)
+        if proc.place == Place.KILLING:
+            proc.push_to_kill()
+            self.release_uid(proc.uid)
         if self.verbose:
-            console.warning(f"\tkill {proc.uid}")
-        idx = -1
-        for i, (oproc, _) in enumerate(self.RUNNING_QUEUE):
-            if oproc.uid == proc.uid:
-                idx = i
-                break
-        assert idx > -1
-        del self.RUNNING_QUEUE[idx]
+            console.warning(f"\t{proc.uid} is gone")
 
     def sync_staging_dir_with_staging_queue(self, cur_time_in_s):
         """"""
@@ -330,44 +575,191 @@ class Scheduler:
     def get_next_free_uid(self):
         """"""
         assert self.lock.locked()
-        # - - re-use uid's - -
-        ids_still_in_use = set()
-        for proc in self.STAGING_QUEUE:
-            ids_still_in_use.add(proc.uid)
-        for proc, _ in self.RUNNING_QUEUE:
-            ids_still_in_use.add(proc.uid)
-
-        delete_indices = []
-        for i, uid in enumerate(self.USED_IDS):
-            if uid not in ids_still_in_use:
-                self.FREE_IDS.append(uid)
-                delete_indices.append(i)
-        for index in sorted(delete_indices, reverse=True):
-            del self.USED_IDS[index]
-        # - - - -
-
-        uid = self.FREE_IDS.pop(0)
-        self.USED_IDS.append(uid)
+        uid = self.FREE_IDS.popleft()
+        self.USED_IDS.add(uid)
         return uid
 
+    def release_uid(self, uid: int):
+        """a process has left all queues: its uid can be re-used"""
+        assert self.lock.locked()
+        if uid in self.USED_IDS:
+            self.USED_IDS.remove(uid)
+            self.FREE_IDS.append(uid)
+            if self.journal is not None:
+                self.journal.record_gone(uid)
+
+    def flush_journal(self):
+        """
+        persist all transitions since the last flush (one fsync), only then
+        the clients are notified. The status is published lazily, see
+        {refresh_status}.
+        """
+        assert self.lock.locked()
+        if self.journal is not None:
+            self.journal.flush()
+            n_live = len(self.STAGING_QUEUE) + len(self.RUNNING_QUEUE)
+            if self.journal.needs_compaction(n_live):
+                self.journal.compact(self.STAGING_QUEUE, self.RUNNING_QUEUE)
+        self.status_dirty = True
+        if self.notifier is not None:
+            self.notifier.flush()
+
+    def recover(self, running_docker_containers: List[str], current_time_in_s=None):
+        """
+        Rebuild the staging and running queue from the journal after a
+        restart. Processes whose container is still alive are re-adopted
+        as running with their previous GPUs, processes that were running
+        but whose container is gone are dropped.
+        :returns: (#staging, #running) recovered processes
+        """
+        if current_time_in_s is None:
+            current_time_in_s = time.time()
+        running_docker_containers = set(running_docker_containers)
+        state = self.journal.replay()
+        self.lock.acquire()
+        # keep the mark files of recovered processes, their clients are still waiting
+        running_marks = set(
+            int(f[:9])
+            for f in listdir(const.running_files_dir_for_scheduler())
+            if f.endswith(".json")
+        )
+        staging_marks = set(
+            int(f[:9])
+            for f in listdir(const.staging_files_dir_for_scheduler())
+            if f.endswith(".json")
+        )
+        for uid, entry in state.items():
+            if uid >= self.max_id:
+                continue
+            proc = ReplikProcess(entry["info"], uid)
+            if get_container_name(uid) in running_docker_containers:
+                gpus = entry["gpus"]
+                # processes from before cpus were pinned get new cpus
+                cpus = entry["cpus"] if len(entry["cpus"]) > 0 else None
+                if not self.resources.can_adopt(gpus, cpus):
+                    console.fail(
+                        f"\tcannot re-adopt {uid} on gpus {gpus}, cpus {cpus}"
+                    )
+                    continue
+                # preempted processes might still be alive if the server
+                # died before their kill finished
+                t = entry["run_t"] if "run_t" in entry else current_time_in_s
+                proc.push_to_running_queue(cur_time_in_s=t)
+                self.resources.add_process(proc, gpus, cpus)
+                self.RUNNING_QUEUE.append((proc, gpus))
+                if uid in running_marks:
+                    running_marks.remove(uid)
+                else:
+                    mark_uid_as_running(
+                        uid,
+                        gpus,
+                        t,
+                        cpus=proc.cpuset,
+                        mems=self.resources.get_mems(proc.cpuset),
+                    )
+            elif entry["place"] == "stage":
+                proc.push_to_staging_queue(cur_time_in_s=entry["t"])
+                self.STAGING_QUEUE.append(proc)
+                if uid in staging_marks:
+                    staging_marks.remove(uid)
+                else:
+                    mark_uid_as_staging(uid, entry["t"])
+            else:
+                continue  # was running but the container is gone
+            self.USED_IDS.add(uid)
+        for uid in running_marks:
+            unmark_uid_as_running(uid)
+        for uid in staging_marks:
+            unmark_uid_as_staging(uid)
+        self.FREE_IDS = deque(
+            uid for uid in range(self.max_id) if uid not in self.USED_IDS
+        )
+        self.journal.compact(self.STAGING_QUEUE, self.RUNNING_QUEUE)
+        self.publish_status()
+        n_staging, n_running = len(self.STAGING_QUEUE), len(self.RUNNING_QUEUE)
+        self.lock.release()
+        if self.verbose:
+            console.info(
+                f"recovered {n_staging} staging and {n_running} running processes"
+            )
+        self.request_step()
+        return n_staging, n_running
+
     def schedule_uid_for_killing(self, uid: int, cur_time_in_s=None):
         """"""
+        self.schedule_for_killing(uids=[uid])
+
+    def schedule_for_killing(
+        self,
+        uids: List[int] = None,
+        tag: str = None,
+        username: str = None,
+        array: str = None,
+    ) -> List[int]:
+        """
+        Unschedule many processes at once, with a single lock. Besides the
+        given {uids} all staging and running processes with the {tag}, of
+        the {username} and/or of the job {array} are unscheduled (all given
+        filters have to match).
+        :returns: all uids that are now scheduled for killing
+        """
+        uids = [] if uids is None else list(uids)
+        filters = [("tag", tag), ("username", username), ("array", array)]
+        filters = [(key, value) for key, value in filters if value is not None]
         self.lock.acquire()
-        self.sync_staging_dir_with_staging_queue(cur_time_in_s)
-        self.KILLING_QUEUE.append(uid)
+        if len(filters) > 0:
+            procs = list(self.STAGING_QUEUE.values()) + [
+                proc for proc, _ in self.RUNNING_QUEUE.values()
+            ]
+            for proc in procs:
+                if all(getattr(proc, key) == value for key, value in filters):
+                    uids.append(proc.uid)
+        uids = list(dict.fromkeys(uids))  # unique, in order
+        for uid in uids:
+            if uid not in self.KILLING_QUEUE:
+                self.KILLING_QUEUE.append(uid)
         self.lock.release()
+        self.request_step()
+        return uids
 
     def add_process_to_staging(self, info, cur_time_in_s=None):
         """this is being called from different threads!"""
+        procs = self.add_processes_to_staging([info], cur_time_in_s=cur_time_in_s)
+        return procs[0] if len(procs) > 0 else None
+
+    def add_processes_to_staging(
+        self, infos: List, cur_time_in_s=None
+    ) -> List[ReplikProcess]:
+        """
+        Submit all {infos} at once: one lock, one journal flush and one
+        status for the whole batch. Either all of them are staged or, if
+        there are not enough free uids or an info is invalid, none.
+        The staging dir is only re-synced in {scheduling_step} as listing it
+        for every submission is O(n) while holding the lock.
+        :returns: the staged processes in the order of the {infos}
+        """
         self.lock.acquire()
-        self.sync_staging_dir_with_staging_queue(cur_time_in_s)
         try:
-            uid = self.get_next_free_uid()
-            proc = ReplikProcess(info, uid)
-            self.STAGING_QUEUE.append(proc)
-            proc.push_to_staging_queue(cur_time_in_s)
-            mark_uid_as_staging(uid, cur_time_in_s)
-        except:
-            pass
-        self.lock.release()
-        return proc
+            if len(self.FREE_IDS) < len(infos):
+                return []
+            procs = [
+                ReplikProcess(info, uid)
+                for info, uid in zip(infos, islice(self.FREE_IDS, len(infos)))
+            ]
+            for proc in procs:
+                self.get_next_free_uid()
+                proc.push_to_staging_queue(cur_time_in_s)
+                self.STAGING_QUEUE.append(proc)
+                mark_uid_as_staging(proc.uid, cur_time_in_s)
+                if self.journal is not None:
+                    self.journal.record_staging(proc)
+                if self.notifier is not None:
+                    self.notifier.record_staged(proc)
+            self.flush_journal()
+        except Exception as e:
+            console.fail(f"could not stage {len(infos)} processes: {e}")
+            return []
+        finally:
+            self.lock.release()
+        self.request_step()
+        return procs
@@ -535,6 +535,189 @@ class TestSchedulingStep(unittest.TestCase):
         self.assertEqual(96, len(scheduler.FREE_IDS))
         self.assertEqual(4, len(scheduler.USED_IDS))
 
+    def test_step_is_requested(self):
+        mon = ResourceMonitor(cpu_count=5, gpu_count=5, mem_gb=100)
+        scheduler = SCHEDULER.Scheduler(mon, max_id=100)
+
+        self.assertFalse(scheduler.wait_for_step_request(0, debounce_in_s=0))
+        proc1 = scheduler.add_process_to_staging(
+            {"cpus": 1, "gpus": 1, "memory": "10g"}, cur_time_in_s=0
+        )
+        self.assertTrue(scheduler.wait_for_step_request(0, debounce_in_s=0))
+        self.assertFalse(scheduler.wait_for_step_request(0, debounce_in_s=0))
+
+        scheduler.scheduling_step([], current_time_in_s=2)
+        self.assert_is_running(proc1)
+        latency = scheduler.get_placement_latency_as_json()
+        self.assertEqual(1, latency["n"])
+        self.assertEqual(2, latency["max"])
+
+        scheduler.schedule_uid_for_killing(proc1.uid)
+        self.assertTrue(scheduler.wait_for_step_request(0, debounce_in_s=0))
+
+    def test_async_kill(self):
+        class FakeKillExecutor:
+            def __init__(self):
+                self.pending = []
+
+            def submit(self, container_name, on_done):
+                self.pending.append((container_name, on_done))
+
+            def finish_all(self):
+                for _, on_done in self.pending:
+                    on_done()
+                self.pending = []
+
+        executor = FakeKillExecutor()
+        mon = ResourceMonitor(cpu_count=10, gpu_count=2, mem_gb=100)
+        scheduler = SCHEDULER.Scheduler(mon, max_id=100, kill_executor=executor)
+
+        proc1 = scheduler.add_process_to_staging(
+            {"cpus": 1, "gpus": 2, "memory": "10g"}, cur_time_in_s=0
+        )
+        scheduler.scheduling_step([], current_time_in_s=0)
+        self.assert_is_running(proc1)
+        FAKE_DOCKER = [proc1.container_name()]
+
+        # proc1 may be preempted after 1h
+        proc2 = scheduler.add_process_to_staging(
+            {"cpus": 1, "gpus": 1, "memory": "10g"}, cur_time_in_s=10
+        )
+        CUR_TIME = 60 * 60 + 10
+        scheduler.scheduling_step(FAKE_DOCKER, current_time_in_s=CUR_TIME)
+        self.assertEqual(1, len(executor.pending))
+        self.assertEqual(1, len(scheduler.KILLING_PROCS))
+        self.assert_is_staging(proc1)
+        self.assert_is_staging(proc2)
+        # the gpus are not given back before the container is gone
+        self.assertEqual(0, mon.get_current_free_resources().gpu_count)
+        self.assertFalse(scheduler.lock.locked())
+
+        # nothing is placed while the kill is still pending
+        CUR_TIME += 5
+        scheduler.scheduling_step(FAKE_DOCKER, current_time_in_s=CUR_TIME)
+        self.assert_is_staging(proc2)
+
+        executor.finish_all()
+        self.assertTrue(scheduler.wait_for_step_request(0, debounce_in_s=0))
+        self.assertEqual(0, len(scheduler.KILLING_PROCS))
+        self.assertEqual(2, mon.get_current_free_resources().gpu_count)
+        FAKE_DOCKER = []
+
+        CUR_TIME += 5
+        scheduler.scheduling_step(FAKE_DOCKER, current_time_in_s=CUR_TIME)
+        self.assert_is_running(proc2)
+        self.assert_is_staging(proc1)
+        FAKE_DOCKER = [proc2.container_name()]
+
+        # unschedule proc2: the uid is only released once the container is gone
+        scheduler.schedule_uid_for_killing(proc2.uid)
+        scheduler.scheduling_step(FAKE_DOCKER, current_time_in_s=CUR_TIME)
+        self.assertEqual(SCHED.Place.KILLING, proc2.place)
+        self.assertTrue(proc2.uid in scheduler.USED_IDS)
+        executor.finish_all()
+        self.assert_is_gone(proc2)
+        self.assertFalse(proc2.uid in scheduler.USED_IDS)
+
+    def test_place_next_to_pending_kill(self):
+        class HangingKillExecutor:
+            """the container never dies"""
+
+            def submit(self, container_name, on_done):
+                pass
+
+        mon = ResourceMonitor(cpu_count=10, gpu_count=2, mem_gb=100)
+        scheduler = SCHEDULER.Scheduler(
+            mon, max_id=100, kill_executor=HangingKillExecutor()
+        )
+        info = {"cpus": 1, "gpus": 1, "memory": "10g"}
+        proc1 = scheduler.add_process_to_staging(info, cur_time_in_s=0)
+        scheduler.scheduling_step([], current_time_in_s=0)
+        self.assert_is_running(proc1)
+        scheduler.schedule_uid_for_killing(proc1.uid)
+        scheduler.scheduling_step([proc1.container_name()], current_time_in_s=1)
+        self.assertEqual(1, len(scheduler.KILLING_PROCS))
+
+        # the free gpu is still handed out, the killed one is not
+        proc2 = scheduler.add_process_to_staging(info, cur_time_in_s=2)
+        proc3 = scheduler.add_process_to_staging(info, cur_time_in_s=2)
+        scheduler.scheduling_step([], current_time_in_s=3)
+        self.assert_is_running(proc2)
+        self.assert_is_staging(proc3)
+        self.assertEqual([1], scheduler.RUNNING_QUEUE.get(proc2.uid)[1])
+        self.assertEqual(1, len(scheduler.KILLING_PROCS))
+
+    def test_status_versions(self):
+        mon = ResourceMonitor(cpu_count=4, gpu_count=1, mem_gb=100)
+        scheduler = SCHEDULER.Scheduler(
+            mon, fun_docker_kill=lambda name: None, max_id=10
+        )
+        status = scheduler.get_resources_infos_as_json()
+        info = {"cpus": 1, "gpus": 1, "memory": "1g"}
+        proc1 = scheduler.add_process_to_staging(info, cur_time_in_s=0)
+        scheduler.add_process_to_staging(info, cur_time_in_s=0)
+        staged = scheduler.get_resources_infos_as_json()
+        self.assertEqual(status["version"] + 2, staged["version"])
+        self.assertEqual(0, len(status["staging"]))  # snapshots are immutable
+        self.assertEqual(2, len(staged["staging"]))
+
+        scheduler.scheduling_step([], current_time_in_s=1)
+        status = scheduler.get_resources_infos_as_json()
+        self.assertEqual(staged["version"] + 1, status["version"])
+        self.assertEqual([0], status["running"][0]["gpus"])
+        self.assertEqual(1, status["running"][0]["running_since"])
+
+        # nothing has changed: same version, the entries are not rebuilt
+        scheduler.scheduling_step([proc1.container_name()], current_time_in_s=2)
+        self.assertIs(status, scheduler.get_resources_infos_as_json())
+        self.assertIs(status["staging"][0], staged["staging"][1])
+
+    def test_batches(self):
+        mon = ResourceMonitor(cpu_count=4, gpu_count=1, mem_gb=100)
+        scheduler = SCHEDULER.Scheduler(
+            mon, fun_docker_kill=lambda name: None, max_id=10
+        )
+        infos = [
+            {"cpus": 1, "gpus": 0, "memory": "1g", "tag": tag, "username": user}
+            for tag, user in [("a", "x"), ("b", "x"), ("a", "y"), ("b", "y")]
+        ]
+        version = scheduler.get_resources_infos_as_json()["version"]
+        procs = scheduler.add_processes_to_staging(infos, cur_time_in_s=0)
+        self.assertEqual([0, 1, 2, 3], [proc.uid for proc in procs])
+        for proc in procs:
+            self.assert_is_staging(proc)
+        # the batch is published as one change
+        status = scheduler.get_resources_infos_as_json()
+        self.assertEqual(version + 1, status["version"])
+
+        # all or nothing
+        self.assertEqual([], scheduler.add_processes_to_staging(infos * 2))
+        self.assertEqual(4, len(scheduler.STAGING_QUEUE))
+        self.assertEqual([], scheduler.add_processes_to_staging([{"cpus": 1}]))
+        self.assertEqual(4, len(scheduler.STAGING_QUEUE))
+
+        scheduler.scheduling_step([], current_time_in_s=1)
+        uids = scheduler.schedule_for_killing(tag="a", username="y")
+        self.assertEqual([2], uids)
+        uids = scheduler.schedule_for_killing(uids=[3], tag="b")
+        self.assertEqual([3, 1], uids)
+        scheduler.scheduling_step(
+            [proc.container_name() for proc in procs], current_time_in_s=2
+        )
+        self.assert_is_running(procs[0])
+        for proc in procs[1:]:
+            self.assert_is_gone(proc)
+
+        # the tasks of an array are cancelled as a unit
+        infos = [
+            {"cpus": 1, "gpus": 0, "memory": "1g", "array": "x", "array_index": i}
+            for i in range(3)
+        ]
+        tasks = scheduler.add_processes_to_staging(infos, cur_time_in_s=3)
+        self.assertEqual([0, 1, 2], [proc.array_index for proc in tasks])
+        uids = scheduler.schedule_for_killing(array="x")
+        self.assertEqual([proc.uid for proc in tasks], sorted(uids))
+
 
 def print_running_queue(scheduler, CUR_TIME):
     for proc, gpus in scheduler.RUNNING_QUEUE:
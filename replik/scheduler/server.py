@@ -4,25 +4,62 @@ import zmq
 import json
 import replik.console as console
 import replik.constants as const
-from replik.scheduler.message import MsgType, get_msg_type, get_is_alive_msg
+import replik.images as images
+from replik.scheduler.message import (
+    MsgType,
+    get_msg_type,
+    get_is_alive_msg,
+    get_error_msg,
+)
 from replik.scheduler.schedule import ReplikProcess, rank_processes_that_can_be_killed
 import threading
+import queue
 from replik.scheduler.resource_monitor import (
     ResourceMonitor,
     get_system_cpu_count,
     get_system_memory_gb,
 )
 from replik.scheduler.scheduler import Scheduler, get_mark_file, get_mark_file_staging
+from replik.scheduler.journal import Journal
+from replik.scheduler.notify import Notifier, EVENTS_PORT
+from replik.scheduler.build_queue import BuildQueue
+from replik.scheduler.placement import get_policy
+from replik.scheduler.topology import load_topology
+from replik.scheduler.cpuset import load_cpu_topology, read_cpu_topology
 import replik.scheduler.docker as docker
 from os.path import isfile, join
 from os import remove, makedirs
 import shutil
 
 
+KILL_WORKERS = 8  # containers that can be killed in parallel
+KILL_GRACE_PERIOD_IN_S = 10  # time between the killhook and `docker kill`
+BUILD_WORKERS = 2  # images that are built in parallel, see {BuildQueue}
+STATUS_ENCODE_IN_S = 0.1  # max. delay until a step is visible in the status
+MAX_PENDING_REPLIES = 64  # replies that wait at most for the encoded status
+IMAGE_GC_INTERVAL_IN_S = 3600  # time between two runs of the image collector
+
+
 class SchedulingThread(threading.Thread):
-    def __init__(self, scheduler: Scheduler):
-        super().__init__()
+    def __init__(
+        self,
+        scheduler: Scheduler,
+        containers: docker.ContainerTracker,
+        tick_in_s: float = 10,
+        debounce_in_s: float = 0.1,
+    ):
+        """
+        :param containers: tracks the live replik containers
+        :param tick_in_s: maximal time between two scheduling steps, steps
+            are usually triggered by submits, kills and container exits
+        :param debounce_in_s: bursts of requests within this time are
+            handled by a single step
+        """
+        super().__init__(daemon=True)
         self.scheduler = scheduler
+        self.containers = containers
+        self.tick_in_s = tick_in_s
+        self.debounce_in_s = debounce_in_s
         self.start()
 
     def run(self):
@@ -32,60 +69,364 @@ class SchedulingThread(threading.Thread):
         global STAGING_QUEUE, RUNNING_QUEUE
 
         while True:
-            time.sleep(5)
-            current_docker_containers = docker.get_running_container_names()
+            self.scheduler.wait_for_step_request(
+                timeout_in_s=self.tick_in_s, debounce_in_s=self.debounce_in_s
+            )
+            current_docker_containers = self.containers.get_running_container_names()
             self.scheduler.scheduling_step(current_docker_containers)
 
 
-def server(n_gpus: int):
+class ImageCollectorThread(threading.Thread):
+    def __init__(
+        self,
+        scheduler: Scheduler,
+        budget: int,
+        interval_in_s: float = IMAGE_GC_INTERVAL_IN_S,
+    ):
+        """
+        removes the least recently used replik images in the background once
+        the images take more than {budget} bytes, see {images.collect}. The
+        images of staged and running processes and of builds are kept.
+        """
+        super().__init__(daemon=True)
+        self.scheduler = scheduler
+        self.budget = budget
+        self.interval_in_s = interval_in_s
+        self.start()
+
+    def run(self):
+        while True:
+            protected = images.get_protected_tags(
+                self.scheduler.get_resources_infos_as_json()
+            )
+            try:
+                images.collect(self.budget, protected, verbose=True)
+            except Exception as e:
+                console.fail(f"image collection failed: {e}")
+            time.sleep(self.interval_in_s)
+
+
+def start_scheduling(scheduler: Scheduler, containers: docker.ContainerTracker):
+    """
+    The live containers are listed before the first scheduling step: until
+    the tracker has synced, the processes re-adopted by {Scheduler.recover}
+    would be taken for dead and their resources handed out again.
+    :returns: the {SchedulingThread}
+    """
+    containers.resync()
+    containers.start()
+    return SchedulingThread(scheduler, containers)
+
+
+def server(
+    n_gpus: int,
+    backfill: bool = False,
+    placement: str = "fifo",
+    topology_file: str = None,
+    cpu_topology_file: str = None,
+    pin_cpus: bool = True,
+    max_builds: int = BUILD_WORKERS,
+    image_budget: int = None,
+):
+    """
+    :param topology_file: json file with the gpu topology, see {load_topology}
+    :param cpu_topology_file: json file with the cpus of each NUMA node,
+        overrides /sys/devices/system/node
+    :param pin_cpus: if True, every process is pinned to its own cpus
+    :param max_builds: images that are built at the same time
+    :param image_budget: if set, unused images are removed in the background
+        once all images take more bytes
+    """
     global FREE_IDS, KILLING_QUEUE, STAGING_QUEUE, RUNNING_QUEUE, USED_IDS
     console.info("\n* * * START REPLIK SERVER * * *\n")
 
     n_cpus = get_system_cpu_count()
     n_mem = get_system_memory_gb()
-    resources = ResourceMonitor(cpu_count=n_cpus, gpu_count=n_gpus, mem_gb=n_mem)
+    cpu_topology = None
+    if cpu_topology_file is not None:
+        cpu_topology = load_cpu_topology(cpu_topology_file)
+    elif pin_cpus:
+        cpu_topology = read_cpu_topology()
+    if cpu_topology is not None:
+        n_cpus = len(cpu_topology)
+        console.info(f"pin processes to cpus of {len(cpu_topology.nodes)} NUMA nodes")
+    resources = ResourceMonitor(
+        cpu_count=n_cpus,
+        gpu_count=n_gpus,
+        mem_gb=n_mem,
+        backfill=backfill,
+        policy=get_policy(placement),
+        topology=None if topology_file is None else load_topology(topology_file),
+        cpu_topology=cpu_topology,
+    )
 
-    context = zmq.Context()
-    socket = context.socket(zmq.REP)
-    socket.bind("tcp://*:5555")
+    kill_executor = docker.KillExecutor(
+        max_workers=KILL_WORKERS, grace_period_in_s=KILL_GRACE_PERIOD_IN_S, verbose=True
+    )
+    journal = Journal(const.journal_file_for_scheduler())
+    notifier = Notifier(f"tcp://*:{EVENTS_PORT}")
+    builds = BuildQueue(
+        max_workers=max_builds,
+        on_change=lambda: scheduler.publish_builds(),
+        verbose=True,
+    )
+    scheduler = Scheduler(
+        resources,
+        verbose=True,
+        kill_executor=kill_executor,
+        journal=journal,
+        notifier=notifier,
+        builds=builds,
+    )
+    rpc = RpcServer(scheduler, "tcp://*:5555")
     console.info("server is listining...")
+    start = time.time()
+    scheduler.recover(docker.get_running_container_names())
+    console.info("recovery took %.02fs" % (time.time() - start))
+    containers = docker.ContainerTracker(
+        on_exit=lambda container_name: scheduler.request_step(), verbose=True
+    )
+    scheduling = start_scheduling(scheduler, containers)
+    if image_budget is not None:
+        collector = ImageCollectorThread(scheduler, image_budget)
 
-    scheduler = Scheduler(resources, verbose=True)
-    scheduling = SchedulingThread(scheduler)
-
-    while True:
-        msg = socket.recv_json()
-
-        if MsgType.ALIVE == get_msg_type(msg):
-            socket.send_json(get_is_alive_msg())
-        elif MsgType.REQUEST_UID == get_msg_type(msg):
-            info = msg["info"]
-            proc = scheduler.add_process_to_staging(info)
-            socket.send_json(
-                {
-                    "msg": MsgType.SEND_UID,
-                    "uid": proc.uid,
-                    "container_name": proc.container_name(),
-                    "mark": get_mark_file(proc.uid),
-                    "staging_mark": get_mark_file_staging(proc.uid),
-                }
-            )
-        elif MsgType.REQUEST_MURDER == get_msg_type(msg):
-            uid = msg["uid"]
-            scheduler.schedule_uid_for_killing(uid)
-            socket.send_json(get_is_alive_msg())
-        elif MsgType.REQUEST_STATUS == get_msg_type(msg):
-            socket.send_json(
-                {
-                    "msg": MsgType.RESPOND_STATUS,
-                    "status": scheduler.get_resources_infos_as_json(),
-                }
-            )
+    rpc.serve()
+
+
+def get_uid_reply(proc: ReplikProcess):
+    """what a client needs to know about its staged process"""
+    return {
+        "uid": proc.uid,
+        "container_name": proc.container_name(),
+        "mark": get_mark_file(proc.uid),
+        "staging_mark": get_mark_file_staging(proc.uid),
+    }
+
+
+def handle_message(scheduler: Scheduler, msg):
+    """
+    :returns: the reply to the client's {msg}
+    """
+    if MsgType.ALIVE == get_msg_type(msg):
+        return get_is_alive_msg()
+    elif MsgType.REQUEST_UID == get_msg_type(msg):
+        info = msg["info"]
+        proc = scheduler.add_process_to_staging(info)
+        if proc is None:
+            error = "the info is invalid or no uid is free"
+            return {"msg": MsgType.SEND_UID, "uid": None, "error": error}
+        return dict({"msg": MsgType.SEND_UID}, **get_uid_reply(proc))
+    elif MsgType.REQUEST_UIDS == get_msg_type(msg):
+        procs = scheduler.add_processes_to_staging(msg["infos"])
+        return {"msg": MsgType.SEND_UIDS, "procs": [get_uid_reply(p) for p in procs]}
+    elif MsgType.REQUEST_MURDER == get_msg_type(msg):
+        uid = msg["uid"]
+        scheduler.schedule_uid_for_killing(uid)
+        return get_is_alive_msg()
+    elif MsgType.REQUEST_MURDERS == get_msg_type(msg):
+        uids = scheduler.schedule_for_killing(
+            uids=msg["uids"],
+            tag=msg["tag"],
+            username=msg["username"],
+            array=msg.get("array", None),
+        )
+        return {"msg": MsgType.RESPOND_MURDERS, "uids": uids}
+    elif MsgType.NOTIFY_EXIT == get_msg_type(msg):
+        scheduler.request_step()
+        return get_is_alive_msg()
+    elif MsgType.REQUEST_BUILD == get_msg_type(msg):
+        if scheduler.builds is None:
+            return {"msg": MsgType.SEND_BUILD, "build": None}
+        build = scheduler.builds.submit(
+            msg["dockerdir"], msg["dockerfile"], msg["tag"], msg["username"]
+        )
+        return {"msg": MsgType.SEND_BUILD, "build": build}
+    elif MsgType.REQUEST_BUILD_STATE == get_msg_type(msg):
+        build = None
+        if scheduler.builds is not None:
+            build = scheduler.builds.get(msg["build_id"])
+        return {"msg": MsgType.SEND_BUILD, "build": build}
+    elif MsgType.REQUEST_STATUS == get_msg_type(msg):
+        status = scheduler.get_resources_infos_as_json()
+        if msg.get("version", None) == status["version"]:
+            return {"msg": MsgType.STATUS_NOT_MODIFIED, "version": status["version"]}
+        return {"msg": MsgType.RESPOND_STATUS, "status": status}
+    raise ValueError(f"unknown message type {get_msg_type(msg)}")
+
+
+READ_ONLY_MESSAGES = set(
+    [MsgType.ALIVE, MsgType.REQUEST_STATUS, MsgType.REQUEST_BUILD_STATE]
+)
+
+
+class RpcServer:
+    """
+    Multiplexes all clients on one ROUTER socket (clients keep using REQ).
+    Read-only requests are answered right away, status requests from the
+    snapshot the scheduler has published last (encoded once per version,
+    see {work}). Mutations are queued and
+    applied one after another by a worker thread, so that a client never
+    waits for the scheduler lock to be answered by others.
+    """
+
+    def __init__(
+        self,
+        scheduler: Scheduler,
+        address: str,
+        context: zmq.Context = None,
+    ):
+        """
+        :param address: e.g. "tcp://*:5555", a "*" port binds a random port
+        """
+        self.scheduler = scheduler
+        self.context = zmq.Context.instance() if context is None else context
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.socket.bind(address)
+        self.address = self.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        # the worker hands its replies back to the thread that owns {socket}
+        self.replies_address = f"inproc://replik_replies_{id(self)}"
+        self.replies = self.context.socket(zmq.PULL)
+        self.replies.bind(self.replies_address)
+        self.mutations = queue.Queue()  # (envelope, msg)
+        self.encoded_status = (None, None)  # (version, encoded status reply)
+
+    def encode_status(self):
+        """encode the latest status of the scheduler, once per version"""
+        status = self.scheduler.get_resources_infos_as_json()
+        if self.encoded_status[0] != status["version"]:
+            reply = {"msg": MsgType.RESPOND_STATUS, "status": status}
+            self.encoded_status = (status["version"], json.dumps(reply).encode())
+
+    def get_encoded_status(self, msg) -> bytes:
+        """:returns: the reply to the status request {msg}"""
+        version, encoded = self.encoded_status
+        if msg.get("version", None) == version:
+            reply = {"msg": MsgType.STATUS_NOT_MODIFIED, "version": version}
+            return json.dumps(reply).encode()
+        return encoded
+
+    def handle(self, msg):
+        """
+        :returns: the reply to {msg}, an error reply if it could not be
+            handled: a bad request must not take the server down
+        """
+        try:
+            return handle_message(self.scheduler, msg)
+        except Exception as e:
+            console.fail(f"could not handle message {msg.get('msg', None)}: {e!r}")
+            return get_error_msg(repr(e))
+
+    def work(self, stop: threading.Event):
+        """
+        Apply the queued mutations. The encoding of the status is left to
+        this thread as well: after a burst of mutations it encodes the
+        status once and only then replies, so that a client always sees its
+        own changes. Under a steady stream of mutations the replies are
+        flushed after {MAX_PENDING_REPLIES} mutations or {STATUS_ENCODE_IN_S},
+        whatever comes first. Changes of the scheduling loop are encoded
+        when the queue is idle.
+        """
+        replies = self.context.socket(zmq.PUSH)
+        replies.connect(self.replies_address)
+        pending = []  # replies waiting for the encoded status
+        oldest = None  # time at which the first pending reply was ready
+        while not stop.is_set():
+            try:
+                envelope, msg = self.mutations.get(timeout=STATUS_ENCODE_IN_S)
+                reply = self.handle(msg)
+                if len(pending) == 0:
+                    oldest = time.time()
+                pending.append(envelope + [json.dumps(reply).encode()])
+            except queue.Empty:
+                pass
+            if (
+                self.mutations.empty()
+                or len(pending) >= MAX_PENDING_REPLIES
+                or (len(pending) > 0 and time.time() - oldest >= STATUS_ENCODE_IN_S)
+            ):
+                self.encode_status()
+                for frames in pending:
+                    replies.send_multipart(frames)
+                pending = []
+        replies.close()
+
+    def answer(self, envelope, msg):
+        """
+        :param envelope: routing frames of the client, including the
+            empty delimiter of its REQ socket
+        """
+        msg_type = get_msg_type(msg)
+        if msg_type == MsgType.REQUEST_STATUS:
+            self.socket.send_multipart(envelope + [self.get_encoded_status(msg)])
+        elif msg_type in READ_ONLY_MESSAGES:
+            reply = self.handle(msg)
+            self.socket.send_multipart(envelope + [json.dumps(reply).encode()])
+        else:
+            self.mutations.put((envelope, msg))
+
+    def serve(self, stop: threading.Event = None):
+        """
+        :param stop: if given, serve until it is set
+        """
+        stop = threading.Event() if stop is None else stop
+        self.encode_status()
+        worker = threading.Thread(target=self.work, args=(stop,), daemon=True)
+        worker.start()
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        poller.register(self.replies, zmq.POLLIN)
+        while not stop.is_set():
+            events = dict(poller.poll(timeout=100))
+            if self.replies in events:
+                self.socket.send_multipart(self.replies.recv_multipart())
+            if self.socket in events:
+                frames = self.socket.recv_multipart()
+                try:
+                    msg = json.loads(frames[-1])
+                except ValueError:
+                    continue  # not a replik client
+                if not isinstance(msg, dict) or "msg" not in msg:
+                    reply = get_error_msg("not a replik message")
+                    self.socket.send_multipart(
+                        frames[:-1] + [json.dumps(reply).encode()]
+                    )
+                    continue
+                self.answer(frames[:-1], msg)
+        worker.join()
+        self.replies.close()
+        self.socket.close()
 
 
 if __name__ == "__main__":
     n_gpus = 0
-    if len(sys.argv) == 2:
+    if len(sys.argv) >= 2:
         n_gpus = int(sys.argv[1])
+    backfill = "--backfill" in sys.argv
+    placement = "fifo"
+    topology_file = None
+    cpu_topology_file = None
+    max_builds = BUILD_WORKERS
+    image_budget = None
+    pin_cpus = "--no-cpu-pinning" not in sys.argv
+    for arg in sys.argv:
+        if arg.startswith("--placement="):
+            placement = arg.replace("--placement=", "")
+        elif arg.startswith("--topology="):
+            topology_file = arg.replace("--topology=", "")
+        elif arg.startswith("--cpu-topology="):
+            cpu_topology_file = arg.replace("--cpu-topology=", "")
+        elif arg.startswith("--max-builds="):
+            max_builds = int(arg.replace("--max-builds=", ""))
+        elif arg.startswith("--image-budget="):
+            image_budget = images.parse_size(arg.replace("--image-budget=", ""))
 
-    server(n_gpus)
+    server(
+        n_gpus,
+        backfill=backfill,
+        placement=placement,
+        topology_file=topology_file,
+        cpu_topology_file=cpu_topology_file,
+        pin_cpus=pin_cpus,
+        max_builds=max_builds,
+        image_budget=image_budget,
+    )
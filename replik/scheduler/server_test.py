@@ -0,0 +1,182 @@
+import unittest
+import threading
+import time
+import zmq
+import replik.scheduler.message as MSG
+from replik.scheduler.message import MsgType
+from replik.scheduler.resource_monitor import ResourceMonitor
+from replik.scheduler.scheduler import Scheduler
+from replik.scheduler.server import RpcServer, SchedulingThread, start_scheduling
+from replik.scheduler.docker import ContainerTracker
+
+
+class TestRpcServer(unittest.TestCase):
+    def test_requests(self):
+        mon = ResourceMonitor(cpu_count=4, gpu_count=1, mem_gb=100)
+        scheduler = Scheduler(mon, max_id=10, fun_docker_kill=lambda name: None)
+        context = zmq.Context()
+        rpc = RpcServer(scheduler, "tcp://127.0.0.1:*", context=context)
+        stop = threading.Event()
+        thread = threading.Thread(target=rpc.serve, args=(stop,))
+        thread.start()
+
+        clients = []
+        for _ in range(2):
+            req = context.socket(zmq.REQ)
+            req.connect(rpc.address)
+            clients.append(req)
+
+        # both clients are waiting for their replies at the same time
+        for req in clients:
+            req.send_json(MSG.get_is_alive_msg())
+        for req in clients:
+            self.assertEqual(MsgType.ALIVE, req.recv_json()["msg"])
+
+        info = {"cpus": 1, "gpus": 0, "memory": "1g"}
+        clients[0].send_json(MSG.get_request_uid_msg(info))
+        reply = clients[0].recv_json()
+        self.assertEqual(MsgType.SEND_UID, reply["msg"])
+        self.assertEqual(1, len(scheduler.STAGING_QUEUE))
+
+        # the status snapshot is refreshed after the mutation
+        clients[1].send_json(MSG.get_request_status_msg())
+        reply = clients[1].recv_json()
+        self.assertEqual(MsgType.RESPOND_STATUS, reply["msg"])
+        self.assertEqual(1, len(reply["status"]["staging"]))
+
+        # a client with the current version gets a short reply
+        version = reply["status"]["version"]
+        clients[1].send_json(MSG.get_request_status_msg(version))
+        reply = clients[1].recv_json()
+        self.assertEqual(MsgType.STATUS_NOT_MODIFIED, reply["msg"])
+        clients[1].send_json(MSG.get_request_status_msg(version - 1))
+        self.assertEqual(MsgType.RESPOND_STATUS, clients[1].recv_json()["msg"])
+
+        stop.set()
+        thread.join()
+        for req in clients:
+            req.close()
+        context.term()
+
+    def test_bad_request(self):
+        mon = ResourceMonitor(cpu_count=4, gpu_count=1, mem_gb=100)
+        scheduler = Scheduler(mon, max_id=10, fun_docker_kill=lambda name: None)
+        context = zmq.Context()
+        rpc = RpcServer(scheduler, "tcp://127.0.0.1:*", context=context)
+        stop = threading.Event()
+        thread = threading.Thread(target=rpc.serve, args=(stop,))
+        thread.start()
+        req = context.socket(zmq.REQ)
+        req.connect(rpc.address)
+
+        for msg in [{"msg": MsgType.REQUEST_MURDER}, {"uid": 1}, [1, 2]]:
+            req.send_json(msg)
+            reply = req.recv_json()
+            self.assertEqual(MsgType.ERROR, reply["msg"])
+
+        # the worker is still alive and handles the next mutation
+        info = {"cpus": 1, "gpus": 0, "memory": "1g"}
+        req.send_json(MSG.get_request_uid_msg(info))
+        self.assertTrue(req.poll(timeout=5000))
+        self.assertEqual(MsgType.SEND_UID, req.recv_json()["msg"])
+
+        stop.set()
+        thread.join()
+        req.close()
+        context.term()
+
+    def test_rejected_uid_request(self):
+        mon = ResourceMonitor(cpu_count=4, gpu_count=1, mem_gb=100)
+        scheduler = Scheduler(mon, max_id=1, fun_docker_kill=lambda name: None)
+        context = zmq.Context()
+        rpc = RpcServer(scheduler, "tcp://127.0.0.1:*", context=context)
+        stop = threading.Event()
+        thread = threading.Thread(target=rpc.serve, args=(stop,))
+        thread.start()
+        req = context.socket(zmq.REQ)
+        req.connect(rpc.address)
+
+        info = {"cpus": 1, "gpus": 0, "memory": "1g"}
+        for msg, uid in [({"cpus": 1}, None), (info, 0), (info, None)]:
+            req.send_json(MSG.get_request_uid_msg(msg))
+            self.assertTrue(req.poll(timeout=5000))
+            reply = req.recv_json()
+            self.assertEqual(MsgType.SEND_UID, reply["msg"])
+            self.assertEqual(uid, reply["uid"])
+        self.assertEqual(1, len(scheduler.STAGING_QUEUE))
+
+        stop.set()
+        thread.join()
+        req.close()
+        context.term()
+
+    def test_replies_during_burst(self):
+        mon = ResourceMonitor(cpu_count=4, gpu_count=1, mem_gb=100)
+        scheduler = Scheduler(mon, max_id=10, fun_docker_kill=lambda name: None)
+        context = zmq.Context()
+        rpc = RpcServer(scheduler, "tcp://127.0.0.1:*", context=context)
+
+        def slow_handle(msg):
+            time.sleep(0.01)
+            return MSG.get_is_alive_msg()
+
+        rpc.handle = slow_handle
+        for i in range(200):
+            rpc.mutations.put(([str(i).encode(), b""], MSG.get_notify_exit_msg(i)))
+        stop = threading.Event()
+        thread = threading.Thread(target=rpc.work, args=(stop,))
+        thread.start()
+
+        try:
+            # the first clients do not wait until the whole burst is applied
+            self.assertTrue(rpc.replies.poll(timeout=5000))
+            self.assertEqual(b"0", rpc.replies.recv_multipart()[0])
+            self.assertTrue(rpc.mutations.qsize() > 100)
+        finally:
+            stop.set()
+            thread.join()
+        rpc.replies.close()
+        rpc.socket.close()
+        context.term()
+
+
+class TestSchedulingThread(unittest.TestCase):
+    def test_start(self):
+        mon = ResourceMonitor(cpu_count=4, gpu_count=1, mem_gb=100)
+        scheduler = Scheduler(mon, max_id=10, fun_docker_kill=lambda name: None)
+        containers = ContainerTracker(fun_list_containers=lambda: [])
+        SchedulingThread(scheduler, containers, tick_in_s=0.1, debounce_in_s=0)
+        proc = scheduler.add_process_to_staging({"cpus": 1, "gpus": 1, "memory": "1g"})
+        for _ in range(50):
+            if len(scheduler.RUNNING_QUEUE) > 0:
+                break
+            time.sleep(0.1)
+        self.assertEqual([proc.uid], [p.uid for p, _ in scheduler.RUNNING_QUEUE])
+
+    def test_first_step_sees_running_containers(self):
+        mon = ResourceMonitor(cpu_count=4, gpu_count=1, mem_gb=100)
+        scheduler = Scheduler(mon, max_id=10, fun_docker_kill=lambda name: None)
+        info = {"cpus": 1, "gpus": 1, "memory": "1g"}
+        proc = scheduler.add_process_to_staging(info, cur_time_in_s=0)
+        scheduler.scheduling_step([], current_time_in_s=0)  # e.g. re-adopted
+        steps = []
+        scheduling_step = scheduler.scheduling_step
+        scheduler.scheduling_step = lambda names: steps.append(scheduling_step(names))
+
+        # the event stream hangs: only the initial listing knows the container
+        containers = ContainerTracker(
+            fun_event_stream=lambda: threading.Event().wait(),
+            fun_list_containers=lambda: [proc.container_name()],
+        )
+        start_scheduling(scheduler, containers)
+        scheduler.request_step()
+        for _ in range(50):
+            if len(steps) > 0:
+                break
+            time.sleep(0.1)
+        self.assertTrue(len(steps) > 0)
+        self.assertEqual([proc.uid], [p.uid for p, _ in scheduler.RUNNING_QUEUE])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,321 @@
+"""
+Replay a job trace against the real {Scheduler} with a virtual clock and
+fake docker containers:
+    python -m replik.scheduler.sim
+compares the placement policies on a synthetic trace and
+    python -m replik.scheduler.sim trace.json [--gpus=8] [--cpus=32] [--mem=256]
+        [--backfill] [--placement=fifo] [--min-hours=1] [--checkpoint=1800]
+replays a trace file. A trace is a json list (or one json object per line) of jobs:
+    {"submit": 0, "cpus": 4, "gpus": 1, "memory": "16g", "run_time": 3600,
+     "minimum_required_running_hours": 1, "maximal_running_hours": 12}
+where "submit" and "run_time" (the time the job needs to finish) are in
+seconds. Preempted jobs restart from scratch, just like a re-scheduled
+replik job, unless they checkpoint: a job with "checkpoint_every": 1800
+only loses the work since its last checkpoint.
+The clock jumps from event to event (submits, container exits and the
+times at which running processes may or must be preempted).
+"""
+import sys
+import json
+import random
+import replik.console as console
+from replik.scheduler.resource_monitor import ResourceMonitor
+from replik.scheduler.placement import PlacementPolicy, get_policy
+from replik.scheduler.scheduler import Scheduler, temporary_mark_dirs
+from typing import Dict, List
+
+
+EPSILON_IN_S = 1  # preemption happens *after* the minimal running time
+CLEANUP_DELAY_IN_S = 30  # the scheduler ignores exits of just started containers
+
+
+def make_trace(n_jobs: int = 200, n_hours: float = 120, seed: int = 0) -> List[Dict]:
+    """
+    mostly short 1-gpu jobs with a few big 4-gpu jobs and cpu-only
+    jobs in between
+    """
+    rnd = random.Random(seed)
+    trace = []
+    for _ in range(n_jobs):
+        kind = rnd.random()
+        if kind < 0.1:
+            tag, cpus, gpus, memory = "big", 8, 4, "64g"
+        elif kind < 0.25:
+            tag, cpus, gpus, memory = "cpu", 12, 0, "64g"
+        else:
+            tag, cpus, gpus, memory = "small", 2, 1, "16g"
+        run_time = rnd.uniform(0.5, 6) * 3600
+        trace.append(
+            {
+                "submit": rnd.uniform(0, n_hours * 3600),
+                "cpus": cpus,
+                "gpus": gpus,
+                "memory": memory,
+                "run_time": run_time,
+                "minimum_required_running_hours": 12,
+                "maximal_running_hours": min(12, 2 * run_time / 3600),
+                "tag": tag,
+            }
+        )
+    return list(sorted(trace, key=lambda job: job["submit"]))
+
+
+def load_trace(fname: str) -> List[Dict]:
+    """a json list of jobs or one json job per line"""
+    with open(fname, "r") as f:
+        content = f.read()
+    if content.lstrip().startswith("["):
+        trace = json.loads(content)
+    else:
+        trace = [json.loads(line) for line in content.split("\n") if len(line) > 0]
+    for job in trace:
+        if "tag" not in job:
+            job["tag"] = "untagged"
+    return list(sorted(trace, key=lambda job: job["submit"]))
+
+
+def percentile(values: List[float], q: float):
+    if len(values) == 0:
+        return 0
+    values = list(sorted(values))
+    return values[int(q * (len(values) - 1))]
+
+
+def simulate(
+    trace: List[Dict],
+    cpu_count: int = 32,
+    gpu_count: int = 8,
+    mem_gb: int = 256,
+    backfill: bool = False,
+    policy: PlacementPolicy = None,
+    checkpoint_in_s: float = None,
+    horizon_in_s: float = None,
+):
+    """
+    :param checkpoint_in_s: default checkpoint interval of the jobs,
+        None: preempted jobs restart from scratch
+    :param horizon_in_s: stop the replay at this time, by default after the
+        last submit plus the time to run all jobs one after another, each of
+        them losing one maximal run to a preemption
+    :returns: {dict} with the utilization, the wait times, the preemptions,
+        the lost gpu-hours and the average gpu fragmentation
+    """
+    if horizon_in_s is None:
+        horizon_in_s = max([0] + [job["submit"] for job in trace]) + sum(
+            job["run_time"] + job.get("maximal_running_hours", 12) * 3600
+            for job in trace
+        )
+    cur_time = 0
+    containers = {}  # container_name -> (proc, end_time_in_s)
+    jobs = {}  # proc -> {state}
+    stats = {"n_preemptions": 0, "lost_gpu_s": 0}
+
+    def fun_docker_kill(container_name: str):
+        """the process is preempted: keep what has been checkpointed"""
+        if container_name not in containers:
+            return  # it has just finished by itself
+        proc, _ = containers.pop(container_name)
+        state = jobs[proc]
+        ran_in_s = cur_time - state["run_start"]
+        checkpoint = state["job"].get("checkpoint_every", checkpoint_in_s)
+        kept_in_s = 0 if checkpoint is None else ran_in_s - ran_in_s % checkpoint
+        state["remaining"] -= kept_in_s
+        state["n_preemptions"] += 1
+        stats["n_preemptions"] += 1
+        stats["lost_gpu_s"] += proc.resources.gpus * (ran_in_s - kept_in_s)
+
+    mon = ResourceMonitor(
+        cpu_count=cpu_count,
+        gpu_count=gpu_count,
+        mem_gb=mem_gb,
+        memory_factor=1.0,
+        backfill=backfill,
+        policy=policy,
+    )
+    # the marks of a live server on this machine must not be touched
+    with temporary_mark_dirs():
+        scheduler = Scheduler(
+            mon, max_id=len(trace) + 1, fun_docker_kill=fun_docker_kill
+        )
+
+        wait_times_in_s = {}  # tag -> [wait time until the first start]
+        fragmentation = 0
+        used_gpu_s = 0
+        used_cpu_s = 0
+        n_finished = 0
+        next_job = 0
+        while n_finished < len(trace) and cur_time <= horizon_in_s:
+            # -- submit --
+            while next_job < len(trace) and trace[next_job]["submit"] <= cur_time:
+                job = trace[next_job]
+                proc = scheduler.add_process_to_staging(job, cur_time_in_s=cur_time)
+                jobs[proc] = {
+                    "job": job,
+                    "started": None,
+                    "run_start": None,
+                    "remaining": job["run_time"],
+                    "n_preemptions": 0,
+                    "done": False,
+                }
+                next_job += 1
+
+            # -- finished containers --
+            for name, (proc, end_time_in_s) in list(containers.items()):
+                if end_time_in_s <= cur_time:
+                    del containers[name]
+                    jobs[proc]["done"] = True
+                    n_finished += 1
+
+            scheduler.scheduling_step(
+                list(containers.keys()), current_time_in_s=cur_time
+            )
+
+            # -- the clients start their containers --
+            for proc, _ in scheduler.RUNNING_QUEUE:
+                state = jobs[proc]
+                if proc.container_name() not in containers and not state["done"]:
+                    if state["started"] is None:
+                        state["started"] = cur_time
+                        wait_times_in_s.setdefault(state["job"]["tag"], []).append(
+                            cur_time - state["job"]["submit"]
+                        )
+                    state["run_start"] = cur_time
+                    containers[proc.container_name()] = (
+                        proc,
+                        cur_time + state["remaining"],
+                    )
+
+            # -- jump to the next event --
+            events = [end_time_in_s for _, end_time_in_s in containers.values()]
+            if next_job < len(trace):
+                events.append(trace[next_job]["submit"])
+            for proc, _ in scheduler.RUNNING_QUEUE:
+                start = proc.running_started_time
+                events.append(start + CLEANUP_DELAY_IN_S + EPSILON_IN_S)
+                if not proc.run_forever:
+                    for hours in [
+                        proc.minimum_required_running_hours,
+                        proc.maximal_running_hours,
+                    ]:
+                        events.append(start + hours * 3600 + EPSILON_IN_S)
+            events = [t for t in events if t > cur_time]
+            if len(events) == 0:
+                break  # nothing will ever change again
+            next_time = min(events)
+
+            dt = next_time - cur_time
+            for proc, _ in containers.values():
+                used_gpu_s += proc.resources.gpus * dt
+                used_cpu_s += proc.resources.cpus * dt
+            fragmentation += mon.get_fragmentation() * dt
+            cur_time = next_time
+
+    all_wait_times_in_s = []
+    for values in wait_times_in_s.values():
+        all_wait_times_in_s += values
+    makespan_in_s = max(cur_time, 1)
+    return {
+        "n_jobs": len(trace),
+        "n_finished": n_finished,
+        "utilization": used_gpu_s / max(gpu_count * makespan_in_s, 1),
+        "cpu_utilization": used_cpu_s / max(cpu_count * makespan_in_s, 1),
+        "makespan_in_h": makespan_in_s / 3600,
+        "mean_wait_in_h": sum(all_wait_times_in_s)
+        / max(len(all_wait_times_in_s), 1)
+        / 3600,
+        "p50_wait_in_h": percentile(all_wait_times_in_s, 0.50) / 3600,
+        "p90_wait_in_h": percentile(all_wait_times_in_s, 0.90) / 3600,
+        "p95_wait_in_h": percentile(all_wait_times_in_s, 0.95) / 3600,
+        "p99_wait_in_h": percentile(all_wait_times_in_s, 0.99) / 3600,
+        "p95_wait_by_tag_in_h": dict(
+            (tag, percentile(values, 0.95) / 3600)
+            for tag, values in wait_times_in_s.items()
+        ),
+        "n_preemptions": stats["n_preemptions"],
+        "n_preempted_jobs": sum(
+            1 for state in jobs.values() if state["n_preemptions"] > 0
+        ),
+        "lost_gpu_hours": stats["lost_gpu_s"] / 3600,
+        "fragmentation": fragmentation / makespan_in_s,
+    }
+
+
+def compare_policies():
+    trace = make_trace()
+    console.info("\n~ ~ replay of a synthetic trace (200 jobs, 120h, 8 gpus) ~ ~")
+    console.info(
+        "policy                        | utilization | makespan | mean wait | p95 wait | p95 wait (4 gpus) | fragmentation"
+    )
+    for name in ["fifo", "best_fit", "fifo+keep_gpus", "best_fit+keep_gpus"]:
+        for backfill in [False, True]:
+            result = simulate(trace, backfill=backfill, policy=get_policy(name))
+            console.write(
+                "%-29s | %10.01f%% | %7.01fh | %8.02fh | %7.02fh | %16.02fh | %12.01f%%"
+                % (
+                    name + (" (backfill)" if backfill else ""),
+                    result["utilization"] * 100,
+                    result["makespan_in_h"],
+                    result["mean_wait_in_h"],
+                    result["p95_wait_in_h"],
+                    result["p95_wait_by_tag_in_h"].get("big", 0),
+                    result["fragmentation"] * 100,
+                )
+            )
+
+
+def main(argv: List[str]):
+    if len(argv) < 2 or argv[1].startswith("--"):
+        compare_policies()
+        return
+
+    trace = load_trace(argv[1])
+    options = {}
+    for arg in argv[2:]:
+        if arg.startswith("--") and "=" in arg:
+            key, value = arg[2:].split("=", 1)
+            options[key] = value
+    if "min-hours" in options:
+        for job in trace:
+            job["minimum_required_running_hours"] = float(options["min-hours"])
+    result = simulate(
+        trace,
+        cpu_count=int(options.get("cpus", 32)),
+        gpu_count=int(options.get("gpus", 8)),
+        mem_gb=int(options.get("mem", 256)),
+        backfill="--backfill" in argv,
+        policy=get_policy(options.get("placement", "fifo")),
+        checkpoint_in_s=(
+            float(options["checkpoint"]) if "checkpoint" in options else None
+        ),
+    )
+    if "--json" in argv:
+        print(json.dumps(result, indent=2))
+        return
+    console.info(f"\n~ ~ replay of {argv[1]} ~ ~")
+    console.write(f"finished jobs:    {result['n_finished']} / {result['n_jobs']}")
+    console.write("makespan:         %.02fh" % result["makespan_in_h"])
+    console.write(
+        "utilization:      gpu %.01f%% | cpu %.01f%%"
+        % (result["utilization"] * 100, result["cpu_utilization"] * 100)
+    )
+    console.write(
+        "wait:             mean %.02fh | p50 %.02fh | p90 %.02fh | p99 %.02fh"
+        % (
+            result["mean_wait_in_h"],
+            result["p50_wait_in_h"],
+            result["p90_wait_in_h"],
+            result["p99_wait_in_h"],
+        )
+    )
+    for tag, wait_in_h in sorted(result["p95_wait_by_tag_in_h"].items()):
+        console.write("  p95 wait %-7s %.02fh" % (tag + ":", wait_in_h))
+    console.write(
+        f"preemptions:      {result['n_preemptions']} "
+        f"({result['n_preempted_jobs']} jobs)"
+    )
+    console.write("lost gpu-hours:   %.02f" % result["lost_gpu_hours"])
+    console.write("stranded gpus:    %.01f%%" % (result["fragmentation"] * 100))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,99 @@
+import unittest
+import json
+import tempfile
+from os.path import join, exists
+import replik.constants as const
+import replik.scheduler.sim as SIM
+
+
+def job(submit, run_time, gpus=1, minimum_required_running_hours=1):
+    return {
+        "submit": submit,
+        "cpus": 1,
+        "gpus": gpus,
+        "memory": "1g",
+        "run_time": run_time,
+        "minimum_required_running_hours": minimum_required_running_hours,
+        "maximal_running_hours": 12,
+        "tag": "a",
+    }
+
+
+class TestSim(unittest.TestCase):
+    def test_queueing(self):
+        # both jobs may not be preempted: the second one has to wait
+        trace = [job(0, 3600, minimum_required_running_hours=12), job(0, 1800)]
+        result = SIM.simulate(trace, cpu_count=4, gpu_count=1, mem_gb=10)
+        self.assertEqual(2, result["n_finished"])
+        self.assertAlmostEqual(1.5, result["makespan_in_h"])
+        self.assertAlmostEqual(1.0, result["utilization"])
+        self.assertAlmostEqual(0.5, result["mean_wait_in_h"])
+        self.assertAlmostEqual(0.0, result["p50_wait_in_h"])
+        self.assertEqual(0, result["n_preemptions"])
+
+    def test_preemption(self):
+        # the first job is preempted after its minimal running time and
+        # restarts once the second one is done
+        trace = [job(0, 3 * 3600), job(1800, 1800)]
+        result = SIM.simulate(trace, cpu_count=4, gpu_count=1, mem_gb=10)
+        self.assertEqual(2, result["n_finished"])
+        self.assertEqual(1, result["n_preemptions"])
+        self.assertEqual(1, result["n_preempted_jobs"])
+        preempted_at = 3600 + SIM.EPSILON_IN_S
+        self.assertAlmostEqual(preempted_at / 3600, result["lost_gpu_hours"])
+        self.assertAlmostEqual(
+            (preempted_at + 1800 + 3 * 3600) / 3600, result["makespan_in_h"]
+        )
+
+        # with checkpoints only the work since the last one is lost
+        result = SIM.simulate(
+            trace, cpu_count=4, gpu_count=1, mem_gb=10, checkpoint_in_s=1800
+        )
+        self.assertAlmostEqual(SIM.EPSILON_IN_S / 3600, result["lost_gpu_hours"])
+        self.assertAlmostEqual(
+            (preempted_at + 1800 + 2 * 3600) / 3600, result["makespan_in_h"]
+        )
+
+    def test_horizon(self):
+        # two jobs that take turns but never run long enough to finish
+        trace = [job(0, 2 * 3600), job(0, 2 * 3600)]
+        result = SIM.simulate(
+            trace, cpu_count=4, gpu_count=1, mem_gb=10, horizon_in_s=10 * 3600
+        )
+        self.assertEqual(0, result["n_finished"])
+        self.assertEqual(9, result["n_preemptions"])
+        self.assertEqual(2, result["n_preempted_jobs"])
+        self.assertTrue(result["makespan_in_h"] > 10)
+
+    def test_load_trace(self):
+        tmp = tempfile.TemporaryDirectory()
+        trace = [job(10, 60), job(0, 60)]
+        del trace[0]["tag"]
+        fname = join(tmp.name, "trace.jsonl")
+        with open(fname, "w") as f:
+            f.write("\n".join(json.dumps(j) for j in trace) + "\n")
+        loaded = SIM.load_trace(fname)
+        self.assertEqual([0, 10], [j["submit"] for j in loaded])
+        self.assertEqual("untagged", loaded[1]["tag"])
+        fname = join(tmp.name, "trace.json")
+        with open(fname, "w") as f:
+            json.dump(trace, f)
+        self.assertEqual(loaded, SIM.load_trace(fname))
+        tmp.cleanup()
+
+    def test_live_marks_are_untouched(self):
+        tmp = tempfile.TemporaryDirectory()
+        schedule_dir = const.SCHEDULE_DIR
+        const.SCHEDULE_DIR = join(tmp.name, "missing")  # no server on this host
+        try:
+            result = SIM.simulate([job(0, 60)], cpu_count=4, gpu_count=1, mem_gb=10)
+            self.assertEqual(1, result["n_finished"])
+            self.assertEqual(join(tmp.name, "missing"), const.SCHEDULE_DIR)
+            self.assertFalse(exists(const.SCHEDULE_DIR))
+        finally:
+            const.SCHEDULE_DIR = schedule_dir
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
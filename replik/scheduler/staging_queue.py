@@ -0,0 +1,106 @@
+"""
+Staging queue with a columnar view of the queued processes so that
+admission questions can be answered for all of them at once.
+"""
+import numpy as np
+from typing import List
+from replik.scheduler.uid_queue import UidQueue
+
+
+class StagingQueue(UidQueue):
+    """
+    {UidQueue} of {ReplikProcess} that also keeps the cpus, gpus and memory
+    of every queued process in arrays. Slots are appended in queue order,
+    removed processes leave a hole until the arrays are compacted.
+    """
+
+    COLUMNS = [
+        ("uid", np.int64),
+        ("cpus", np.int64),
+        ("gpus", np.int64),
+        ("memory", np.int64),
+        ("valid", bool),
+    ]
+
+    def __init__(self, capacity: int = 1024):
+        super().__init__(key=lambda proc: proc.uid)
+        self.slot_of = {}  # uid -> slot
+        self.n_slots = 0
+        for name, dtype in self.COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+
+    def allocate(self, capacity: int):
+        """re-allocate the columns with room for {capacity} slots"""
+        for name, dtype in self.COLUMNS:
+            column = np.zeros(capacity, dtype=dtype)
+            column[: self.n_slots] = getattr(self, name)[: self.n_slots]
+            setattr(self, name, column)
+
+    def append(self, proc):
+        super().append(proc)
+        if self.n_slots == len(self.valid):
+            if len(self.items) <= self.n_slots // 2:
+                self.compact()
+            else:
+                self.allocate(2 * len(self.valid))
+        slot = self.n_slots
+        self.uid[slot] = proc.uid
+        self.cpus[slot] = proc.resources.cpus
+        self.gpus[slot] = proc.resources.gpus
+        self.memory[slot] = proc.resources.memory
+        self.valid[slot] = True
+        self.slot_of[proc.uid] = slot
+        self.n_slots += 1
+
+    def remove(self, uid):
+        self.valid[self.slot_of.pop(uid)] = False
+        return super().remove(uid)
+
+    def discard(self, uid):
+        if uid not in self.items:
+            return None
+        return self.remove(uid)
+
+    def popleft(self):
+        uid = next(iter(self.items))
+        return self.remove(uid)
+
+    def compact(self):
+        """drop the holes of removed processes, keeps the queue order"""
+        slots = np.flatnonzero(self.valid[: self.n_slots])
+        for name, _ in self.COLUMNS:
+            column = getattr(self, name)
+            column[: len(slots)] = column[slots]
+        self.valid[len(slots) :] = False
+        self.n_slots = len(slots)
+        self.slot_of = dict(
+            (int(uid), slot) for slot, uid in enumerate(self.uid[: self.n_slots])
+        )
+
+    def fitting(self, free) -> np.ndarray:
+        """
+        :param free: {FreeResources}
+        :returns: mask over the slots of the processes that fit into {free}
+        """
+        n = self.n_slots
+        return (
+            self.valid[:n]
+            & (self.cpus[:n] <= free.cpu_count)
+            & (self.gpus[:n] <= free.gpu_count)
+            & (self.memory[:n] <= free.mem_gb)
+        )
+
+    def admissible(self, free, include_first_blocked: bool = False) -> List:
+        """
+        processes that fit into {free}, in queue order: nothing else can be
+        placed while at most {free} resources are available.
+        :param include_first_blocked: also return the first process that
+            does not fit (e.g. to reserve resources for it)
+        """
+        n = self.n_slots
+        fits = self.fitting(free)
+        if include_first_blocked:
+            blocked = np.flatnonzero(self.valid[:n] & ~fits)
+            if len(blocked) > 0:
+                fits[blocked[0]] = True
+        return [self.items[uid] for uid in self.uid[:n][fits].tolist()]
@@ -0,0 +1,79 @@
+import unittest
+import replik.scheduler.schedule as SCHED
+import replik.scheduler.resource_monitor as RESMON
+from replik.scheduler.staging_queue import StagingQueue
+
+
+def make_proc(uid, cpus, gpus, memory):
+    info = {"cpus": cpus, "gpus": gpus, "memory": f"{memory}g"}
+    proc = SCHED.ReplikProcess(info, uid)
+    proc.push_to_staging_queue(cur_time_in_s=uid)
+    return proc
+
+
+class TestStagingQueue(unittest.TestCase):
+    def test_columns(self):
+        queue = StagingQueue(capacity=2)
+        for uid in range(5):
+            queue.append(make_proc(uid, uid, 1, 10))
+        self.assertEqual([0, 1, 2, 3, 4], list(queue.uid[: queue.n_slots]))
+        self.assertEqual([0, 1, 2, 3, 4], list(queue.cpus[: queue.n_slots]))
+
+        queue.remove(1)
+        self.assertEqual(0, queue.popleft().uid)
+        self.assertIsNone(queue.discard(0))
+        self.assertEqual([2, 3, 4], [proc.uid for proc in queue])
+
+        # filling up the arrays drops the holes, the order is kept
+        queue = StagingQueue(capacity=4)
+        for uid in range(4):
+            queue.append(make_proc(uid, 1, 1, 10))
+        for uid in [0, 2, 1]:
+            queue.remove(uid)
+        queue.append(make_proc(4, 1, 1, 10))
+        self.assertEqual(4, len(queue.valid))
+        self.assertEqual([3, 4], list(queue.uid[: queue.n_slots]))
+        self.assertEqual({3: 0, 4: 1}, queue.slot_of)
+        queue.remove(3)
+        self.assertEqual([4], [int(uid) for uid in queue.uid[queue.valid]])
+
+    def test_admissible(self):
+        queue = StagingQueue()
+        for uid, (cpus, gpus) in enumerate([(1, 2), (4, 0), (1, 1), (8, 1), (2, 1)]):
+            queue.append(make_proc(uid, cpus, gpus, 10))
+        queue.remove(2)
+        free = RESMON.FreeResources(cpu_count=4, gpu_count=1, mem_gb=50)
+        self.assertEqual(
+            [False, True, False, False, True], list(queue.fitting(free))
+        )
+        self.assertEqual([1, 4], [p.uid for p in queue.admissible(free)])
+        self.assertEqual(
+            [0, 1, 4],
+            [p.uid for p in queue.admissible(free, include_first_blocked=True)],
+        )
+
+    def test_same_placement(self):
+        """the columnar path places exactly the processes of the object loop"""
+        procs = [
+            (uid, 1 + uid % 3, uid % 2, 10 + uid % 4 * 20) for uid in range(40)
+        ]
+        for backfill in [False, True]:
+            results = []
+            for queue in [StagingQueue(), list()]:
+                mon = RESMON.ResourceMonitor(
+                    cpu_count=8, gpu_count=3, mem_gb=100, backfill=backfill
+                )
+                running = make_proc(100, 1, 1, 10)
+                running.push_to_running_queue(cur_time_in_s=0)
+                mon.add_process(running, [0])
+                for args in procs:
+                    queue.append(make_proc(*args))
+                _, to_schedule, _ = mon.schedule_appropriate_resources(
+                    [], queue, current_time_in_s=0
+                )
+                results.append([proc.uid for proc, _ in to_schedule])
+            self.assertEqual(results[1], results[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+GPU topology of the machine, loaded from a json file:
+{
+    "distances": [[0, 1, 2, 2], [1, 0, 2, 2], [2, 2, 0, 1], [2, 2, 1, 0]],
+    "numa": [0, 0, 1, 1]
+}
+"distances" is the interconnect distance between two gpus (e.g. 1 for the
+same PCIe switch, 2 across the CPU sockets) and "numa" is the NUMA node
+each gpu is attached to.
+"""
+import json
+from itertools import combinations
+from typing import List, Tuple
+
+
+class GpuTopology:
+    def __init__(self, distances: List[List[float]], numa: List[int]):
+        super().__init__()
+        assert len(distances) == len(numa)
+        for row in distances:
+            assert len(row) == len(numa)
+        self.distances = distances
+        self.numa = numa
+
+    def __len__(self):
+        return len(self.numa)
+
+    def score(self, gpus: List[int]) -> float:
+        """sum of the pairwise interconnect distances, lower is better"""
+        return sum(self.distances[a][b] for a, b in combinations(gpus, 2))
+
+    def to_json(self):
+        return {"distances": self.distances, "numa": self.numa}
+
+
+def load_topology(fname: str) -> GpuTopology:
+    with open(fname, "r") as f:
+        topo = json.load(f)
+    return GpuTopology(distances=topo["distances"], numa=topo["numa"])
+
+
+MAX_COMBINATIONS = 5000  # above this, gpus are chosen greedily
+
+
+def select_gpus(
+    free_gpus: List[int], n_gpus: int, topology: GpuTopology
+) -> Tuple[List[int], float]:
+    """
+    choose {n_gpus} of the {free_gpus} with the smallest interconnect
+    distance. Ties are broken by spanning as few NUMA nodes as possible and
+    then by breaking up as few close pairs of free gpus as possible and by
+    using up nodes that have the fewest free gpus, so that large groups
+    stay available for later.
+    :returns: gpus, score
+    """
+    if n_gpus == 0:
+        return [], 0
+    assert len(free_gpus) >= n_gpus
+    free_per_numa = {}
+    for gpu in free_gpus:
+        node = topology.numa[gpu]
+        free_per_numa[node] = free_per_numa.get(node, 0) + 1
+
+    closest = min(
+        [d for row in topology.distances for d in row if d > 0], default=0
+    )
+
+    def key(gpus):
+        nodes = set(topology.numa[gpu] for gpu in gpus)
+        close_to_remaining = sum(
+            1
+            for gpu in gpus
+            for other in free_gpus
+            if other not in gpus and topology.distances[gpu][other] <= closest
+        )
+        return (
+            topology.score(gpus),
+            len(nodes),
+            close_to_remaining,
+            sum(free_per_numa[node] for node in nodes),
+            gpus,
+        )
+
+    if count_combinations(len(free_gpus), n_gpus) <= MAX_COMBINATIONS:
+        candidates = combinations(free_gpus, n_gpus)
+    else:
+        candidates = [
+            grow_greedily(seed, free_gpus, n_gpus, topology) for seed in free_gpus
+        ]
+    best = min((tuple(sorted(gpus)) for gpus in candidates), key=key)
+    return list(best), topology.score(best)
+
+
+def grow_greedily(
+    seed: int, free_gpus: List[int], n_gpus: int, topology: GpuTopology
+) -> List[int]:
+    """add the nearest free gpu until there are {n_gpus}"""
+    gpus = [seed]
+    while len(gpus) < n_gpus:
+        nearest = min(
+            (gpu for gpu in free_gpus if gpu not in gpus),
+            key=lambda gpu: (
+                sum(topology.distances[gpu][other] for other in gpus),
+                gpu,
+            ),
+        )
+        gpus.append(nearest)
+    return gpus
+
+
+def count_combinations(n: int, k: int) -> int:
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
@@ -0,0 +1,77 @@
+import unittest
+import json
+import tempfile
+from os.path import join
+import replik.scheduler.topology as TOPO
+import replik.scheduler.resource_monitor as RESMON
+import replik.scheduler.schedule as SCHED
+
+
+# two sockets with two PCIe switches each:
+# gpus 0,1 | 2,3 on socket 0 and 4,5 | 6,7 on socket 1
+def distance(a, b):
+    if a == b:
+        return 0
+    elif a // 2 == b // 2:
+        return 1  # same switch
+    elif a // 4 == b // 4:
+        return 2  # same socket
+    return 3
+
+
+DISTANCES = [[distance(a, b) for b in range(8)] for a in range(8)]
+NUMA = [0, 0, 0, 0, 1, 1, 1, 1]
+
+
+class TestTopology(unittest.TestCase):
+    def load(self):
+        tmp = tempfile.TemporaryDirectory()
+        fname = join(tmp.name, "topology.json")
+        with open(fname, "w") as f:
+            json.dump({"distances": DISTANCES, "numa": NUMA}, f)
+        topology = TOPO.load_topology(fname)
+        tmp.cleanup()
+        return topology
+
+    def test_select_gpus(self):
+        topology = self.load()
+        # both pairs are on one switch, socket 1 has fewer free gpus left
+        gpus, score = TOPO.select_gpus([1, 2, 3, 4, 5], 2, topology)
+        self.assertEqual([4, 5], gpus)
+        self.assertEqual(1, score)
+
+        # gpu 1 is alone on its switch: use it for a single gpu job
+        gpus, _ = TOPO.select_gpus([1, 2, 3, 4, 5], 1, topology)
+        self.assertEqual([1], gpus)
+
+        gpus, score = TOPO.select_gpus([0, 3, 4, 5, 7], 3, topology)
+        self.assertEqual([4, 5, 7], gpus)
+        self.assertEqual(1 + 2 + 2, score)
+
+    def test_greedy_for_many_gpus(self):
+        n = 32
+        distances = [[abs(a - b) for b in range(n)] for a in range(n)]
+        topology = TOPO.GpuTopology(distances, [a // 8 for a in range(n)])
+        free_gpus = [0, 5, 9, 10, 11, 12, 20, 31]
+        gpus, _ = TOPO.select_gpus(free_gpus, 4, topology)
+        self.assertEqual([9, 10, 11, 12], gpus)
+
+    def test_resource_monitor(self):
+        mon = RESMON.ResourceMonitor(
+            cpu_count=32, gpu_count=8, mem_gb=100, topology=self.load()
+        )
+        proc1 = SCHED.ReplikProcess({"cpus": 1, "gpus": 1, "memory": "1g"}, uid=1)
+        proc2 = SCHED.ReplikProcess({"cpus": 1, "gpus": 2, "memory": "1g"}, uid=2)
+        proc3 = SCHED.ReplikProcess({"cpus": 1, "gpus": 4, "memory": "1g"}, uid=3)
+        _, procs_to_schedule, _ = mon.schedule_appropriate_resources(
+            [], [proc1, proc2, proc3], 0
+        )
+        gpus = dict((proc.uid, gpus) for proc, gpus in procs_to_schedule)
+        self.assertEqual([0], gpus[1])
+        self.assertEqual([2, 3], gpus[2])
+        self.assertEqual([4, 5, 6, 7], gpus[3])
+        self.assertEqual(1, mon.get_placement_score(gpus[2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+from typing import Callable
+
+
+class UidQueue:
+    """
+    FIFO queue that is indexed by uid: insert, remove and lookup are O(1)
+    while iteration keeps the insertion order (dicts are ordered).
+    """
+
+    def __init__(self, key: Callable = lambda item: item):
+        """
+        :param key: {function} that maps an item to its uid
+        """
+        super().__init__()
+        self.key = key
+        self.items = {}  # uid -> item
+
+    def append(self, item):
+        uid = self.key(item)
+        assert uid not in self.items, f"uid {uid} is already queued"
+        self.items[uid] = item
+
+    def get(self, uid, default=None):
+        return self.items.get(uid, default)
+
+    def remove(self, uid):
+        """remove {uid}, return the item"""
+        return self.items.pop(uid)
+
+    def discard(self, uid):
+        """remove {uid} if it is queued, return the item or None"""
+        return self.items.pop(uid, None)
+
+    def popleft(self):
+        """remove the oldest item"""
+        uid = next(iter(self.items))
+        return self.items.pop(uid)
+
+    def uids(self):
+        return self.items.keys()
+
+    def values(self):
+        """
+        live view in queue order without copying, the queue must not be
+        changed while iterating over it
+        """
+        return self.items.values()
+
+    def __contains__(self, uid):
+        return uid in self.items
+
+    def __iter__(self):
+        return iter(list(self.items.values()))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "UidQueue(" + str(list(self.items.keys())) + ")"
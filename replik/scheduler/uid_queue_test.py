@@ -0,0 +1,47 @@
+import unittest
+from replik.scheduler.uid_queue import UidQueue
+import replik.scheduler.schedule as SCHED
+
+
+class TestUidQueue(unittest.TestCase):
+    def test_fifo_order(self):
+        Q = UidQueue(key=lambda proc: proc.uid)
+        procs = [
+            SCHED.ReplikProcess({"cpus": 1, "gpus": 0, "memory": "1g"}, uid=uid)
+            for uid in [5, 1, 3, 2]
+        ]
+        for proc in procs:
+            Q.append(proc)
+        self.assertEqual(4, len(Q))
+        self.assertEqual([5, 1, 3, 2], [proc.uid for proc in Q])
+
+        Q.remove(3)
+        self.assertFalse(3 in Q)
+        self.assertTrue(1 in Q)
+        self.assertEqual([5, 1, 2], [proc.uid for proc in Q])
+
+        self.assertEqual(5, Q.popleft().uid)
+        self.assertIsNone(Q.discard(5))
+        self.assertEqual(1, Q.get(1).uid)
+
+        Q.append(procs[0])  # re-enter at the end
+        self.assertEqual([1, 2, 5], [proc.uid for proc in Q])
+
+    def test_duplicate(self):
+        Q = UidQueue()
+        Q.append(1)
+        with self.assertRaises(AssertionError):
+            Q.append(1)
+
+    def test_remove_while_iterating(self):
+        Q = UidQueue()
+        for uid in range(10):
+            Q.append(uid)
+        for uid in Q:
+            if uid % 2 == 0:
+                Q.remove(uid)
+        self.assertEqual([1, 3, 5, 7, 9], list(Q))
+
+
+if __name__ == "__main__":
+    unittest.main()
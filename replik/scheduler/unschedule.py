@@ -1,11 +1,48 @@
 import replik.console as console
 import replik.scheduler.client as client
+from typing import List
 
 
-def execute(uid):
-    if len(uid) == 0:
-        console.fail("you need to pass a {uid} for unscheduling..")
+def parse_uids(text: str) -> List[int]:
+    """'1,4-6' -> [1, 4, 5, 6]"""
+    uids = []
+    for part in text.split(","):
+        part = part.strip()
+        if len(part) == 0:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            uids += list(range(int(first), int(last) + 1))
+        else:
+            uids.append(int(part))
+    return uids
+
+
+def execute(uid: str, tag: str = "", username: str = "", array: str = ""):
+    """
+    :param uid: one uid or a list like '1,4-6'
+    :param tag: unschedule all processes with this docker tag
+    :param username: unschedule all processes of this user
+    :param array: unschedule all tasks of this job array
+    """
+    if len(uid + tag + username + array) == 0:
+        console.fail(
+            "you need to pass a {uid}, {tag}, {user} or {array} for unscheduling.."
+        )
         console.info("for example: \n\t$ replik unschedule --uid=1")
+        console.info("\t$ replik unschedule --uid=1,4-6")
+        console.info("\t$ replik unschedule --tag=julian_tanke/replik_demo")
+        console.info("\t$ replik unschedule --user=julian")
+        console.info("\t$ replik unschedule --array=3f2a9c1e")
         exit()
 
-    client.request_to_kill_uid(int(uid))
+    uids = parse_uids(uid)
+    if len(uids) == 1 and len(tag + username + array) == 0:
+        client.request_to_kill_uid(uids[0])
+    else:
+        client.request_to_kill(
+            uids,
+            tag=tag if len(tag) > 0 else None,
+            username=username if len(username) > 0 else None,
+            array=array if len(array) > 0 else None,
+        )
@@ -1 +1 @@
-python3 -m replik.scheduler.server $1
\ No newline at end of file
+python3 -m replik.scheduler.server $@
\ No newline at end of file